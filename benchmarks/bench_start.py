@@ -0,0 +1,83 @@
+'''Benchmark comparing sequential and pipelined `start`, for a growing number of nodes.
+Reads a reservation from stdin (like the CLI does), and boots clusters on the first N nodes of it.
+Connections are pooled, so we measure boot time only, not ssh handshakes.
+Usage:
+    python3 benchmarks/bench_start.py --key-path ~/.ssh/id_rsa --nodes 2 4 8 16 --repeats 3'''
+
+import argparse
+import statistics
+import sys
+import time
+
+from spark_deploy import ConnectionPool, start, stop
+import spark_deploy.cli.util as _cli_util
+import spark_deploy.internal.defaults.install as install_defaults
+from spark_deploy.internal.util.printer import *
+
+
+class _SubsetReservation(object):
+    '''Reservation containing only the first `amount` nodes of another reservation.'''
+    def __init__(self, reservation, amount):
+        self._nodes = sorted(reservation.nodes, key=lambda x: x.node_id)[:amount]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    @property
+    def nodes(self):
+        return iter(self._nodes)
+
+    def get_node(self, node_id):
+        return next(x for x in self._nodes if x.node_id == node_id)
+
+
+def _time_start(reservation, pool, pipelined, args):
+    '''Boots a cluster, waits until all workers registered, and stops it again.
+    Returns:
+        Number of seconds it took to boot, or `None` on failure.'''
+    with pool.lease(reservation.nodes) as connectionwrappers:
+        t0 = time.monotonic()
+        ok, _, _ = start(reservation, install_dir=args.install_dir, connectionwrappers=connectionwrappers, wait=True, pipelined=pipelined, silent=True)
+        elapsed = time.monotonic() - t0
+        stop(reservation, install_dir=args.install_dir, connectionwrappers=connectionwrappers, silent=True)
+    return elapsed if ok else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sequential and pipelined Spark start times.')
+    parser.add_argument('--install-dir', metavar='path', dest='install_dir', type=str, default=install_defaults.install_dir(), help='Location on remote hosts where Spark is installed (default={}).'.format(install_defaults.install_dir()))
+    parser.add_argument('--key-path', metavar='path', dest='key_path', type=str, default=None, help='Path to ssh key to access nodes.')
+    parser.add_argument('--nodes', metavar='amount', type=int, nargs='+', default=[2, 4, 8], help='Cluster sizes to benchmark (default=2 4 8).')
+    parser.add_argument('--repeats', metavar='amount', type=int, default=3, help='Number of boots per cluster size and mode (default=3).')
+    args = parser.parse_args()
+
+    reservation = _cli_util.read_reservation_cli()
+    if not reservation:
+        return 1
+    sizes = [x for x in args.nodes if x <= len(reservation)]
+    if len(sizes) < len(args.nodes):
+        printw('Skipping cluster sizes larger than the reservation ({} nodes).'.format(len(reservation)))
+
+    results = []
+    with ConnectionPool(key_path=args.key_path, silent=True) as pool:
+        for size in sizes:
+            subset = _SubsetReservation(reservation, size)
+            timings = {False: [], True: []}
+            for x in range(args.repeats):
+                for pipelined in (False, True):
+                    elapsed = _time_start(subset, pool, pipelined, args)
+                    if elapsed == None:
+                        printe('Boot failed (nodes={}, pipelined={}). Skipping measurement.'.format(size, pipelined))
+                    else:
+                        timings[pipelined].append(elapsed)
+            if timings[False] and timings[True]:
+                results.append((size, statistics.median(timings[False]), statistics.median(timings[True])))
+
+    print('{:>6} {:>14} {:>14} {:>10}'.format('nodes', 'sequential (s)', 'pipelined (s)', 'saving'))
+    for size, sequential, pipelined in results:
+        print('{:>6} {:>14.2f} {:>14.2f} {:>9.1f}%'.format(size, sequential, pipelined, 100*(sequential-pipelined)/sequential))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
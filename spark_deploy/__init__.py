@@ -1,5 +1,11 @@
 from .install import install
+from .jobs import JobHandle
+from .scale import add_workers, remove_workers, rolling_restart
 from .start import start
+from .status import status
 from .stop import stop
 from .submit import submit, SubmitCommandBuilder
-from .uninstall import uninstall
\ No newline at end of file
+from .submit_queue import SubmitQueue
+from .uninstall import uninstall
+from .internal.remoto.pool import ConnectionPool
+from .internal.util.engine import configure as configure_engine
\ No newline at end of file
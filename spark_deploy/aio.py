@@ -0,0 +1,321 @@
+'''asyncio variants of `install`, `start`, `stop` and `submit`.
+Node operations run as asyncio tasks, driving plain `ssh` and `rsync` subprocesses instead of 1 thread (and execnet channel) per node.
+This way, a small controller handles thousands of nodes. Example:
+    import asyncio
+    import spark_deploy.aio
+
+    asyncio.run(spark_deploy.aio.start(reservation, key_path='~/.ssh/key', timeout=300))
+
+All operations accept:
+    timeout (optional float): Maximal number of seconds an operation may take on a single node. Nodes exceeding it are cancelled and count as failed.
+    progress (optional callable): Called as `progress(node, line)` for every line of output produced on a node. If `None`, output is printed unless `silent` is set.
+Cancelling the task running an operation cancels all its node operations, and terminates the remote processes they spawned.'''
+
+import asyncio
+import shlex
+
+from spark_deploy.install import _generate_module_java, _generate_module_manifest, _generate_module_spark
+import spark_deploy.internal.defaults.install as install_defaults
+import spark_deploy.internal.defaults.start as start_defaults
+import spark_deploy.internal.defaults.stop as stop_defaults
+import spark_deploy.internal.defaults.submit as submit_defaults
+import spark_deploy.internal.remoto.aio as aio
+from spark_deploy.internal.remoto.batch import Batch
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+from spark_deploy.start import _autosize_policy, _generate_module_start, _get_master_and_workers
+from spark_deploy.stop import _generate_module_stop
+from spark_deploy.submit import _generate_module_submit, _transfer_targets, SubmitCommandBuilder
+
+
+def _merge_kwargs(x, y):
+    z = x.copy()
+    z.update(y)
+    return z
+
+
+def _progress_for(node, progress, silent):
+    '''Returns a single-argument callback passing output lines of given node to `progress`.'''
+    if progress:
+        return lambda line: progress(node, line)
+    if silent:
+        return None
+    return lambda line: print('[{}] {}'.format(node.ip_public, line))
+
+
+async def _open_targets(nodes, key_path=None, multiplex=False):
+    '''Opens `AsyncTarget`s for given nodes.
+    Returns:
+        `dict(metareserve.Node, AsyncTarget)`.'''
+    ssh_kwargs = {'IdentitiesOnly': 'yes', 'StrictHostKeyChecking': 'no'}
+    if key_path:
+        ssh_kwargs['IdentityFile'] = key_path
+    targets = {node: aio.AsyncTarget(node, node.ip_public, ssh_params=_merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), multiplex=multiplex) for node in nodes}
+    results = await asyncio.gather(*(x.open() for x in targets.values()), return_exceptions=True)
+    errors = [x for x in results if isinstance(x, BaseException)]
+    if any(errors): # Other targets opened fine, and hold ssh configs and master connections we must clean up.
+        await _close_targets(targets)
+        raise errors[0]
+    return targets
+
+
+async def _close_targets(targets):
+    '''Closes all given targets. Failing to close one target does not keep us from closing the others.'''
+    for x in await asyncio.gather(*(x.close() for x in targets.values()), return_exceptions=True):
+        if isinstance(x, Exception):
+            printw('Could not close connection: {}'.format(x))
+
+
+async def _guarded(node, coroutine, timeout=None):
+    '''Awaits a node operation, converting timeouts and errors to failures.
+    Errors must never escape: callers gather many guarded operations, and close all connections once the gather returns.
+    Returns:
+        Result of the operation, or `False` when it timed out or raised an error.'''
+    try:
+        return await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError as e:
+        printe('Operation on {} timed out after {} seconds.'.format(node, timeout))
+    except aio.RemoteError as e:
+        printe(str(e))
+    except Exception as e:
+        printe('Operation on {} failed: {}'.format(node, e))
+    return False
+
+
+async def install(reservation, install_dir=install_defaults.install_dir(), key_path=None, spark_url=install_defaults.spark_url(), java_url=install_defaults.java_url(), java_min=install_defaults.java_min(), java_max=install_defaults.java_max(), use_sudo=install_defaults.use_sudo(), force_reinstall=False, stream=install_defaults.stream(), download_streams=install_defaults.download_streams(), multiplex=False, timeout=None, progress=None, silent=False, retries=install_defaults.retries()):
+    '''Install Spark and Java on a reserved cluster. Like `spark_deploy.install` in "nodes" fetch mode: every node checks its install manifest, and downloads what it misses.
+    Args:
+        reservation (`metareserve.Reservation`): Reservation object with all nodes to install Spark on.
+        install_dir (optional str): Location on remote host to install Spark in.
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        spark_url (optional str): URL to download Spark.
+        java_url (optional str): URL to download Java.
+        java_min (optional int): Minimal Java version to accept. 0 means no limit.
+        java_max (optional int): Maximal Java version to accept. 0 means no limit.
+        use_sudo (optional bool): If set, installs some libraries system-wide. Otherwise, performs local installation.
+        force_reinstall (optional bool): If set, we always will re-download and install Spark.
+        stream (optional bool): If set, nodes extract archives while downloading them.
+        download_streams (optional int): Number of concurrent HTTP Range requests nodes download every archive with. Ignored when nodes use `stream`.
+        multiplex (optional bool): If set, all ssh sessions to a node share 1 OpenSSH master connection.
+        timeout (optional float): Maximal number of seconds to install on a single node.
+        progress (optional callable): Called as `progress(node, line)` for every line of output.
+        silent (optional bool): If set, we only print errors and critical info.
+        retries (optional int): Number of tries we try to download archives.
+
+    Raises:
+        Valuerror: When reservation contains 0 nodes or is `None`.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    if not reservation or len(reservation) == 0:
+        raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+    manifest_module = _generate_module_manifest()
+    spark_module = _generate_module_spark()
+    java_module = _generate_module_java()
+    manifest = loc.manifest(install_dir)
+
+    async def _install_node(target):
+        output = _progress_for(target.node, progress, silent)
+        spark_ok, java_ok = await aio.call(target, manifest_module, 'manifest_check', manifest, loc.sparkdir(install_dir), spark_url, java_url, java_min, java_max, use_sudo)
+        if java_ok == None:
+            java_ok = await aio.call(target, java_module, 'java_detect', java_min, java_max, manifest)
+        calls = []
+        if force_reinstall or not spark_ok:
+            calls.append(aio.call(target, spark_module, 'spark_install', loc.sparkdir(install_dir), spark_url, True, silent, retries, stream, download_streams, manifest, progress=output))
+        if not java_ok:
+            if use_sudo:
+                calls.append(aio.call(target, java_module, 'java_install_sudo', java_min, java_max, silent, retries, manifest, progress=output))
+            else:
+                calls.append(aio.call(target, java_module, 'java_install_nonsudo', loc.java_nonroot_dir(install_dir), java_url, java_min, java_max, silent, retries, stream, download_streams, manifest, progress=output))
+        results = await asyncio.gather(*calls, return_exceptions=True) # Waits for all calls, even when 1 of them fails.
+        errors = [x for x in results if isinstance(x, BaseException)]
+        if any(errors):
+            raise errors[0]
+        return all(results)
+
+    targets = await _open_targets(reservation.nodes, key_path=key_path, multiplex=multiplex)
+    try:
+        results = await asyncio.gather(*(_guarded(node, _install_node(x), timeout) for node, x in targets.items()))
+    finally:
+        await _close_targets(targets)
+
+    for node, ok in zip(targets.keys(), results):
+        if not ok:
+            printe('Could not install on remote {}!'.format(node))
+    if all(results):
+        prints('Installation on all nodes succeeded.')
+        return True
+    printe('Installation failed on some nodes.')
+    return False
+
+
+async def start(reservation, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, master_host=lambda x: x.ip_local, master_port=start_defaults.masterport(), webui_port=start_defaults.webuiport(), worker_workdir=start_defaults.workdir(), use_sudo=False, wait=True, wait_timeout=start_defaults.wait_timeout(), pipelined=False, autosize=False, reserved_cores=start_defaults.reserved_cores(), reserved_memory=start_defaults.reserved_memory(), memory_fraction=start_defaults.memory_fraction(), multiplex=False, timeout=None, progress=None, silent=False, retries=start_defaults.retries()):
+    '''Boot Spark on an existing reservation. See `spark_deploy.start` for the meaning of most arguments.
+    Args:
+        timeout (optional float): Maximal number of seconds to boot a daemon on a single node. Does not include waiting for worker registration (see `wait_timeout`).
+        progress (optional callable): Called as `progress(node, line)` for every line of output.
+        multiplex (optional bool): If set, all ssh sessions to a node share 1 OpenSSH master connection.
+
+    Returns:
+        `(True, master_node_id, master_url)` on success, `(False, None, None)` otherwise.'''
+    if not reservation or len(reservation) == 0:
+        raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+
+    if master_host == None:
+        master_host = lambda x: x.ip_local
+    autosize = _autosize_policy(autosize, reserved_cores, reserved_memory, memory_fraction)
+
+    master_picked, workers_picked = _get_master_and_workers(reservation, master_id)
+    printc('Picked master node: {}. Deploying 1 master and {} workers'.format(master_picked, len(workers_picked)), Color.CAN)
+    if callable(master_host):
+        master_host = master_host(master_picked)
+    elif not isinstance(master_host, str):
+        printe('Given master_host was not a callable function, nor a str. Instead: {} (type: {})'.format(master_host, type(master_host)))
+        return False, None, None
+
+    module = _generate_module_start()
+    sparkdir = loc.sparkdir(install_dir)
+    targets = await _open_targets(reservation.nodes, key_path=key_path, multiplex=multiplex)
+    try:
+        task_master = asyncio.ensure_future(_guarded(master_picked, aio.call(targets[master_picked], module, 'start_master', sparkdir, master_host, master_picked.ip_public, master_port, webui_port, use_sudo, silent, retries, 5, wait_timeout, progress=_progress_for(master_picked, progress, silent)), timeout))
+        submit_workers = lambda: {node: asyncio.ensure_future(_guarded(node, aio.call(targets[node], module, 'start_worker', sparkdir, worker_workdir, master_picked.ip_local, master_port, use_sudo, silent, retries, 5, autosize, progress=_progress_for(node, progress, silent)), timeout)) for node in workers_picked}
+        tasks_workers = submit_workers() if pipelined else dict()
+
+        master_result = await task_master
+        state_ok, master_url = master_result if master_result else (False, None)
+        if not state_ok:
+            printe('Could not start Spark master on node: {}'.format(master_picked))
+            if pipelined: # Workers would keep trying to reach a master that never comes up.
+                await asyncio.gather(*tasks_workers.values())
+                await asyncio.gather(*(_guarded(node, aio.call(targets[node], module, 'stop_all', sparkdir, worker_workdir, use_sudo, True, retries), timeout) for node in tasks_workers.keys()))
+            return False, None, None
+
+        if not pipelined:
+            tasks_workers = submit_workers()
+        for node, ok in zip(tasks_workers.keys(), await asyncio.gather(*tasks_workers.values())):
+            if not ok:
+                printe('Could not start Spark worker on remote: {}'.format(node))
+                state_ok = False
+
+        if state_ok and wait and any(tasks_workers):
+            workers_ok, alive = await _guarded(master_picked, aio.call(targets[master_picked], module, 'wait_workers', master_host, webui_port, len(tasks_workers), wait_timeout), None) or (False, 0)
+            if workers_ok:
+                if not silent:
+                    print('All {} workers registered at the master.'.format(alive))
+            else:
+                printe('Only {}/{} workers registered at the master within {} seconds.'.format(alive, len(tasks_workers), wait_timeout))
+                state_ok = False
+    finally:
+        await _close_targets(targets)
+
+    if state_ok:
+        prints('Starting Spark on all nodes succeeded.')
+        return True, master_picked.node_id, master_url
+    printe('Starting Spark failed on some nodes.')
+    return False, None, None
+
+
+async def stop(reservation, install_dir=install_defaults.install_dir(), key_path=None, worker_workdir=start_defaults.workdir(), use_sudo=False, fast=False, stop_timeout=stop_defaults.stop_timeout(), async_cleanup=False, multiplex=False, timeout=None, progress=None, silent=False, retries=stop_defaults.retries()):
+    '''Stop Spark on an existing reservation. See `spark_deploy.stop` for the meaning of most arguments.
+    Args:
+        timeout (optional float): Maximal number of seconds to stop the daemons on a single node.
+        progress (optional callable): Called as `progress(node, line)` for every line of output.
+        multiplex (optional bool): If set, all ssh sessions to a node share 1 OpenSSH master connection.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    if not reservation or len(reservation) == 0:
+        raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+    module = _generate_module_stop()
+    targets = await _open_targets(reservation.nodes, key_path=key_path, multiplex=multiplex)
+    try:
+        results = await asyncio.gather(*(_guarded(node, aio.call(x, module, 'stop_all', loc.sparkdir(install_dir), worker_workdir, use_sudo, silent, retries, 5, fast, stop_timeout, async_cleanup, progress=_progress_for(node, progress, silent)), timeout) for node, x in targets.items()))
+    finally:
+        await _close_targets(targets)
+
+    for node, ok in zip(targets.keys(), results):
+        if not ok:
+            printe('Could not stop Spark worker on remote: {}'.format(node))
+    if all(results):
+        prints('Stopping Spark on all nodes succeeded.')
+        return True
+    printe('Stopping Spark failed on some nodes.')
+    return False
+
+
+async def submit(reservation, command, paths=[], install_dir=install_defaults.install_dir(), key_path=None, application_dir=submit_defaults.application_dir(), master_id=None, use_sudo=False, multiplex=False, targets='auto', timeout=None, progress=None, silent=False):
+    '''Submit applications using spark-submit on the remote Spark cluster. See `spark_deploy.submit` for the meaning of most arguments.
+    Every target node receives all `paths` with 1 rsync process.
+    Args:
+        timeout (optional float): Maximal number of seconds for preparing and transferring to a single node, and separately for running spark-submit.
+        progress (optional callable): Called as `progress(node, line)` for every line of output, including spark-submit output.
+        multiplex (optional bool): If set, all ssh sessions to a node share 1 OpenSSH master connection.
+
+    Raises:
+        FileNotFoundError: When spark-submit is not found on the master.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    if not reservation or len(reservation) == 0:
+        raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+    builder = command if isinstance(command, SubmitCommandBuilder) else None
+    command = builder.build() if builder else command
+    if application_dir == '~/' or application_dir == '~' or not application_dir:
+        raise ValueError('application_dir must not be equal to "{}". Check the docs.'.format(application_dir))
+    if application_dir.startswith('~/'):
+        application_dir = application_dir[2:]
+
+    paths = [fs.abspath(x) for x in paths]
+    missing = [x for x in paths if not (fs.exists(x) or fs.issymlink(x))]
+    if any(missing):
+        printe('Application data transfer found non-existing source paths:')
+        for path in missing:
+            print('    {}'.format(path))
+        return False
+
+    master_picked, workers_picked = _get_master_and_workers(reservation, master_id)
+    print('Picked master node: {}'.format(master_picked))
+    target_nodes = _transfer_targets(reservation, master_picked, builder or command, targets)
+    submit_bin = fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit')
+
+    submit_module = _generate_module_submit()
+    shell_ok = lambda result: result[0] and result[1][0] == 0
+
+    submit_missing = []
+
+    async def _prepare_node(node, target):
+        '''Creates the application directory (and checks for spark-submit on the master) in 1 round-trip, then transfers all paths.'''
+        batch = Batch()
+        check_submit = batch.shell('ls {}'.format(submit_bin)) if node == master_picked else None
+        check_mkdir = batch.shell('mkdir -p {}'.format(shlex.quote(application_dir)))
+        results = await batch.run_async(target, submit_module)
+        if check_submit != None and not shell_ok(results[check_submit]):
+            submit_missing.append(node) # We raise once all nodes are done, so no transfer runs while we close connections.
+            return False
+        if not shell_ok(results[check_mkdir]):
+            printe('Could not make directory "{}" on {}.'.format(application_dir, node))
+            return False
+        return (not any(paths)) or await aio.rsync(target, paths, application_dir, flags='-azL', progress=_progress_for(node, progress, silent))
+
+    connections = await _open_targets(target_nodes, key_path=key_path, multiplex=multiplex)
+    try:
+        if any(paths) and not silent:
+            print('Transferring application data to {}/{} nodes...'.format(len(target_nodes), len(reservation)))
+        prepared = await asyncio.gather(*(_guarded(node, _prepare_node(node, x), timeout) for node, x in connections.items()))
+        if any(submit_missing):
+            raise FileNotFoundError('Could not find spark-submit executable on master. Expected at: {}'.format(submit_bin))
+        if not all(prepared):
+            printe('Could not deploy data to all remote nodes.')
+            return False
+        if not silent:
+            prints('Application data deployed.')
+
+        run_cmd = '{} {}'.format(submit_bin, command)
+        if use_sudo:
+            run_cmd = 'sudo '+run_cmd
+        if not silent:
+            print('Executing: {}'.format(run_cmd))
+        return await _guarded(master_picked, aio.call(connections[master_picked], submit_module, 'submit', run_cmd, application_dir, progress=_progress_for(master_picked, progress, silent)), timeout)
+    finally:
+        await _close_targets(connections)
\ No newline at end of file
@@ -9,22 +9,30 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))) # Appends main project root as importpath.
 
 import spark_deploy
+import spark_deploy.internal.defaults.engine as engine_defaults
 import spark_deploy.internal.defaults.install as defaults
+import spark_deploy.internal.util.engine as engine
 
 
 def _get_modules():
     import spark_deploy.cli.install as install
+    import spark_deploy.cli.scale as scale
     import spark_deploy.cli.start as start
+    import spark_deploy.cli.status as status
     import spark_deploy.cli.submit as submit
     import spark_deploy.cli.stop as stop
     import spark_deploy.cli.uninstall as uninstall
-    return [install, start, submit, stop, uninstall]
+    return [install, scale, start, status, submit, stop, uninstall]
 
 
 def generic_args(parser):
     '''Configure arguments important for all modules (install, uninstall, start, stop) here.'''
     parser.add_argument('--install_dir', type=str, default=defaults.install_dir(), help='Installation directory for Spark and java, for all remote machines (default={}).'.format(defaults.install_dir()))
     parser.add_argument('--key-path', dest='key_path', type=str, default=None, help='Path to ssh key to access nodes.')
+    parser.add_argument('--max-workers', metavar='amount', dest='max_workers', type=int, default=engine_defaults.max_workers(), help='Maximal number of remote tasks running at the same time (default={}).'.format(engine_defaults.max_workers()))
+    parser.add_argument('--per-operation', metavar='amount', dest='per_operation', type=int, default=engine_defaults.per_operation(), help='Maximal number of threads a single operation uses (default={}).'.format(engine_defaults.per_operation()))
+    parser.add_argument('--connect-rate', metavar='amount', dest='connect_rate', type=float, default=engine_defaults.connect_rate(), help='Maximal average number of new ssh connections per second. 0 disables the limit (default={}).'.format(engine_defaults.connect_rate()))
+    parser.add_argument('--connect-burst', metavar='amount', dest='connect_burst', type=int, default=engine_defaults.connect_burst(), help='Maximal number of new ssh connections opened at once, before --connect-rate applies (default={}).'.format(engine_defaults.connect_burst()))
 
 
 def subparser(parser):
@@ -36,6 +44,7 @@ def subparser(parser):
 
 def deploy(mainparser, parsers, args):
     '''Processing of deploy commandline args occurs here'''
+    engine.configure(max_workers=args.max_workers, per_operation=args.per_operation, connect_rate=args.connect_rate, connect_burst=args.connect_burst)
     for parsers_for_module, module in zip(parsers, _get_modules()):
         if module.deploy_args_set(args):
             return module.deploy(parsers_for_module, args)
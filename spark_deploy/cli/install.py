@@ -13,6 +13,14 @@ def subparser(subparsers):
     installparser.add_argument('--java-max', dest='java_max', type=int, default=defaults.java_max(), help='Java minimal version (default={}). 0 means "no limit". use this to ensure a recent-enough version is installed for use with your Spark version.'.format(defaults.java_max()))
     installparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses superuser-priviledged commands during installation. Otherwise, performs local installs, no superuser privileges required.')
     installparser.add_argument('--force-reinstall', dest='force_reinstall', help='If set, we always will re-download and install Spark. Otherwise, we will skip installing if we already have installed Spark.', action='store_true')
+    installparser.add_argument('--fetch-mode', dest='fetch_mode', type=str, choices=['nodes', 'controller'], default=defaults.fetch_mode(), help='Who downloads Spark and Java (default={}). "nodes": every node downloads its own copy. "controller": we download once, and push to the nodes.'.format(defaults.fetch_mode()))
+    installparser.add_argument('--distribution', type=str, choices=['direct', 'tree'], default=defaults.distribution(), help='How we push archives to nodes when using "--fetch-mode controller" (default={}). "direct": we push to every node. "tree": we push to a few seed nodes, which relay to other nodes over the cluster-internal network.'.format(defaults.distribution()))
+    installparser.add_argument('--seeds', metavar='amount', type=int, default=defaults.seeds(), help='Number of nodes we push archives to directly, when using "--distribution tree" (default={}).'.format(defaults.seeds()))
+    installparser.add_argument('--offline', help='If set, installs entirely from the local artifact store, without accessing the internet. Implies "--fetch-mode controller".', action='store_true')
+    installparser.add_argument('--cache-size', metavar='megabytes', dest='cache_size', type=int, default=defaults.artifact_cache_size()//(1024*1024), help='Maximal size of the local artifact store (default={}). Least-recently used archives are evicted.'.format(defaults.artifact_cache_size()//(1024*1024)))
+    installparser.add_argument('--stream', help='If set, nodes extract archives while downloading them, without storing archives on disk. Reduces disk usage and I/O on nodes.', action='store_true')
+    installparser.add_argument('--download-streams', metavar='amount', dest='download_streams', type=int, default=defaults.download_streams(), help='Number of concurrent connections to download every archive with, if the server supports it (default={}).'.format(defaults.download_streams()))
+    installparser.add_argument('--multiplex', help='If set, uses OpenSSH connection multiplexing, so pushing archives to a node reuses its ssh connection.', action='store_true')
     installparser.add_argument('--silent', help='If set, less boot output is shown.', action='store_true')
     installparser.add_argument('--retries', metavar='amount', type=int, default=defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(defaults.retries()))
     return [installparser]
@@ -29,4 +37,4 @@ def deploy_args_set(args):
 
 def deploy(parsers, args):
     reservation = _cli_util.read_reservation_cli()
-    return _install(reservation, install_dir=args.install_dir, key_path=args.key_path, spark_url=args.spark_url, java_url=args.java_url, java_min=args.java_min, java_max=args.java_max, use_sudo=args.use_sudo, force_reinstall=args.force_reinstall, silent=args.silent, retries=args.retries) if reservation else False
\ No newline at end of file
+    return _install(reservation, install_dir=args.install_dir, key_path=args.key_path, spark_url=args.spark_url, java_url=args.java_url, java_min=args.java_min, java_max=args.java_max, use_sudo=args.use_sudo, force_reinstall=args.force_reinstall, fetch_mode=args.fetch_mode, distribution=args.distribution, seeds=args.seeds, offline=args.offline, cache_size=args.cache_size*1024*1024, stream=args.stream, download_streams=args.download_streams, multiplex=args.multiplex, silent=args.silent, retries=args.retries) if reservation else False
\ No newline at end of file
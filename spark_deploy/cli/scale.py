@@ -0,0 +1,75 @@
+'''CLI module to add workers to, remove workers from, and restart workers of a running Spark cluster.'''
+
+import spark_deploy.cli.util as _cli_util
+import spark_deploy.internal.defaults.start as defaults
+import spark_deploy.internal.defaults.stop as stop_defaults
+import spark_deploy.scale as _scale
+
+def subparser(subparsers):
+    '''Register subparser modules'''
+    addparser = subparsers.add_parser('add-workers', help='Start workers on given nodes, and register them at the running master.')
+    addparser.add_argument('workers', metavar='id', type=int, nargs='+', help='IDs of the nodes to start workers on.')
+    addparser.add_argument('--master', metavar='id', dest='master_id', type=int, default=None, help='ID of the master node.')
+    addparser.add_argument('--master-host', metavar='host', dest='master_host', type=str, default=None, help='Hostname the master listens on.')
+    addparser.add_argument('--master-port', metavar='port', dest='master_port', type=int, default=defaults.masterport(), help='port the master uses (default={}).'.format(defaults.masterport()))
+    addparser.add_argument('--webui-port', metavar='port', dest='webui_port', type=int, default=defaults.webuiport(), help='port of the Spark webUI (default={}).'.format(defaults.webuiport()))
+    addparser.add_argument('--workdir', metavar='path', type=str, default=defaults.workdir(), help='Path to Spark workdir location for the new worker daemons (default={}).'.format(defaults.workdir()))
+    addparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when starting Spark.')
+    addparser.add_argument('--no-wait', dest='wait', help='If set, returns as soon as all daemons are launched. Otherwise, waits until all new workers registered at the master.', action='store_false')
+    addparser.add_argument('--wait-timeout', metavar='seconds', dest='wait_timeout', type=int, default=defaults.wait_timeout(), help='Maximal number of seconds to wait for new workers to register (default={}).'.format(defaults.wait_timeout()))
+    addparser.add_argument('--autosize', help='If set, sizes the new workers to the cores, memory and local disks of their node, instead of letting Spark claim all cores and all memory minus 1GB.', action='store_true')
+    addparser.add_argument('--reserved-cores', metavar='amount', dest='reserved_cores', type=int, default=defaults.reserved_cores(), help='Number of cores per node left for other services when using --autosize (default={}).'.format(defaults.reserved_cores()))
+    addparser.add_argument('--reserved-memory', metavar='megabytes', dest='reserved_memory', type=int, default=defaults.reserved_memory(), help='Minimal amount of memory per node left for other services when using --autosize (default={}).'.format(defaults.reserved_memory()))
+    addparser.add_argument('--memory-fraction', metavar='fraction', dest='memory_fraction', type=float, default=defaults.memory_fraction(), help='Maximal fraction of the memory of a node given to its worker when using --autosize (default={}).'.format(defaults.memory_fraction()))
+    addparser.add_argument('--silent', help='If set, less output is shown.', action='store_true')
+    addparser.add_argument('--retries', metavar='amount', type=int, default=defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(defaults.retries()))
+
+    removeparser = subparsers.add_parser('remove-workers', help='Stop workers on given nodes, keeping the master and other workers running.')
+    removeparser.add_argument('workers', metavar='id', type=int, nargs='+', help='IDs of the nodes to stop workers on.')
+    removeparser.add_argument('--master', metavar='id', dest='master_id', type=int, default=None, help='ID of the master node.')
+    removeparser.add_argument('--workdir', metavar='path', type=str, default=defaults.workdir(), help='Workdir location of the worker daemons, removed after stopping (default={}).'.format(defaults.workdir()))
+    removeparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when stopping Spark.')
+    removeparser.add_argument('--fast', help='If set, signals Spark workers directly using their PID files, instead of using the Spark stop scripts.', action='store_true')
+    removeparser.add_argument('--stop-timeout', metavar='seconds', dest='stop_timeout', type=int, default=stop_defaults.stop_timeout(), help='Number of seconds workers get to exit when using --fast, before they are killed (default={}).'.format(stop_defaults.stop_timeout()))
+    removeparser.add_argument('--async-cleanup', dest='async_cleanup', help='If set, workdirs are deleted in the background, without waiting for the delete to finish.', action='store_true')
+    removeparser.add_argument('--silent', help='If set, less output is shown.', action='store_true')
+    removeparser.add_argument('--retries', metavar='amount', type=int, default=stop_defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(stop_defaults.retries()))
+
+    restartparser = subparsers.add_parser('rolling-restart', help='Restart all workers in batches, while the master keeps serving jobs.')
+    restartparser.add_argument('--master', metavar='id', dest='master_id', type=int, default=None, help='ID of the master node.')
+    restartparser.add_argument('--master-host', metavar='host', dest='master_host', type=str, default=None, help='Hostname the master listens on.')
+    restartparser.add_argument('--master-port', metavar='port', dest='master_port', type=int, default=defaults.masterport(), help='port the master uses (default={}).'.format(defaults.masterport()))
+    restartparser.add_argument('--webui-port', metavar='port', dest='webui_port', type=int, default=defaults.webuiport(), help='port of the Spark webUI (default={}).'.format(defaults.webuiport()))
+    restartparser.add_argument('--workdir', metavar='path', type=str, default=defaults.workdir(), help='Path to Spark workdir location for all worker daemons (default={}).'.format(defaults.workdir()))
+    restartparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when stopping and starting Spark.')
+    restartparser.add_argument('--batch-size', metavar='amount', dest='batch_size', type=int, default=defaults.rolling_batch_size(), help='Number of workers to restart at the same time (default={}).'.format(defaults.rolling_batch_size()))
+    restartparser.add_argument('--fast', help='If set, signals Spark workers directly using their PID files, instead of using the Spark stop scripts.', action='store_true')
+    restartparser.add_argument('--stop-timeout', metavar='seconds', dest='stop_timeout', type=int, default=stop_defaults.stop_timeout(), help='Number of seconds workers get to exit when using --fast, before they are killed (default={}).'.format(stop_defaults.stop_timeout()))
+    restartparser.add_argument('--wait-timeout', metavar='seconds', dest='wait_timeout', type=int, default=defaults.wait_timeout(), help='Maximal number of seconds to wait for restarted workers of a batch to register (default={}).'.format(defaults.wait_timeout()))
+    restartparser.add_argument('--autosize', help='If set, sizes the restarted workers to the cores, memory and local disks of their node, instead of letting Spark claim all cores and all memory minus 1GB.', action='store_true')
+    restartparser.add_argument('--reserved-cores', metavar='amount', dest='reserved_cores', type=int, default=defaults.reserved_cores(), help='Number of cores per node left for other services when using --autosize (default={}).'.format(defaults.reserved_cores()))
+    restartparser.add_argument('--reserved-memory', metavar='megabytes', dest='reserved_memory', type=int, default=defaults.reserved_memory(), help='Minimal amount of memory per node left for other services when using --autosize (default={}).'.format(defaults.reserved_memory()))
+    restartparser.add_argument('--memory-fraction', metavar='fraction', dest='memory_fraction', type=float, default=defaults.memory_fraction(), help='Maximal fraction of the memory of a node given to its worker when using --autosize (default={}).'.format(defaults.memory_fraction()))
+    restartparser.add_argument('--silent', help='If set, less output is shown.', action='store_true')
+    restartparser.add_argument('--retries', metavar='amount', type=int, default=defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(defaults.retries()))
+    return [addparser, removeparser, restartparser]
+
+
+def deploy_args_set(args):
+    '''Indicates whether we will handle command parse output in this module.
+    `deploy()` function will be called if set.
+
+    Returns:
+        `True` if we found arguments used by this subsubparser, `False` otherwise.'''
+    return args.command in ('add-workers', 'remove-workers', 'rolling-restart')
+
+
+def deploy(parsers, args):
+    reservation = _cli_util.read_reservation_cli()
+    if not reservation:
+        return False
+    if args.command == 'add-workers':
+        return _scale.add_workers(reservation, args.workers, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, master_host=args.master_host, master_port=args.master_port, webui_port=args.webui_port, worker_workdir=args.workdir, use_sudo=args.use_sudo, wait=args.wait, wait_timeout=args.wait_timeout, autosize=args.autosize, reserved_cores=args.reserved_cores, reserved_memory=args.reserved_memory, memory_fraction=args.memory_fraction, silent=args.silent, retries=args.retries)
+    elif args.command == 'remove-workers':
+        return _scale.remove_workers(reservation, args.workers, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, worker_workdir=args.workdir, use_sudo=args.use_sudo, fast=args.fast, stop_timeout=args.stop_timeout, async_cleanup=args.async_cleanup, silent=args.silent, retries=args.retries)
+    return _scale.rolling_restart(reservation, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, master_host=args.master_host, master_port=args.master_port, webui_port=args.webui_port, worker_workdir=args.workdir, use_sudo=args.use_sudo, batch_size=args.batch_size, fast=args.fast, stop_timeout=args.stop_timeout, wait_timeout=args.wait_timeout, autosize=args.autosize, reserved_cores=args.reserved_cores, reserved_memory=args.reserved_memory, memory_fraction=args.memory_fraction, silent=args.silent, retries=args.retries)
\ No newline at end of file
@@ -13,6 +13,13 @@ def subparser(subparsers):
     startparser.add_argument('--master-port', metavar='port', dest='master_port', type=int, default=defaults.masterport(), help='port to use for master (default={}).'.format(defaults.masterport()))
     startparser.add_argument('--webui-port', metavar='port', dest='webui_port', type=int, default=defaults.webuiport(), help='port to use for the Spark webUI (default={}).'.format(defaults.webuiport()))
     startparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when starting Spark.')
+    startparser.add_argument('--no-wait', dest='wait', help='If set, returns as soon as all daemons are launched. Otherwise, waits until all workers registered at the master.', action='store_false')
+    startparser.add_argument('--wait-timeout', metavar='seconds', dest='wait_timeout', type=int, default=defaults.wait_timeout(), help='Maximal number of seconds to wait for the master to open its ports, and for all workers to register (default={}).'.format(defaults.wait_timeout()))
+    startparser.add_argument('--autosize', help='If set, sizes workers to the cores, memory and local disks of their node, instead of letting Spark claim all cores and all memory minus 1GB.', action='store_true')
+    startparser.add_argument('--reserved-cores', metavar='amount', dest='reserved_cores', type=int, default=defaults.reserved_cores(), help='Number of cores per node left for other services when using --autosize (default={}).'.format(defaults.reserved_cores()))
+    startparser.add_argument('--reserved-memory', metavar='megabytes', dest='reserved_memory', type=int, default=defaults.reserved_memory(), help='Minimal amount of memory per node left for other services when using --autosize (default={}).'.format(defaults.reserved_memory()))
+    startparser.add_argument('--memory-fraction', metavar='fraction', dest='memory_fraction', type=float, default=defaults.memory_fraction(), help='Maximal fraction of the memory of a node given to its worker when using --autosize (default={}).'.format(defaults.memory_fraction()))
+    startparser.add_argument('--pipelined', help='If set, launches workers at the same time as the master, instead of after the master is ready.', action='store_true')
     startparser.add_argument('--silent', help='If set, less boot output is shown.', action='store_true')
     startparser.add_argument('--retries', metavar='amount', type=int, default=defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(defaults.retries()))
     return [startparser]
@@ -29,4 +36,4 @@ def deploy_args_set(args):
 
 def deploy(parsers, args):
     reservation = _cli_util.read_reservation_cli()
-    return _start(reservation, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, master_host=args.master_host, master_port=args.master_port, webui_port=args.webui_port, worker_workdir=args.workdir, use_sudo=args.use_sudo, silent=args.silent, retries=args.retries)[0] if reservation else False
\ No newline at end of file
+    return _start(reservation, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, master_host=args.master_host, master_port=args.master_port, webui_port=args.webui_port, worker_workdir=args.workdir, use_sudo=args.use_sudo, wait=args.wait, wait_timeout=args.wait_timeout, pipelined=args.pipelined, autosize=args.autosize, reserved_cores=args.reserved_cores, reserved_memory=args.reserved_memory, memory_fraction=args.memory_fraction, silent=args.silent, retries=args.retries)[0] if reservation else False
\ No newline at end of file
@@ -0,0 +1,67 @@
+'''CLI module to report the state of a Spark cluster.'''
+
+import json
+
+import spark_deploy.cli.util as _cli_util
+import spark_deploy.internal.defaults.start as start_defaults
+import spark_deploy.internal.defaults.status as defaults
+from spark_deploy.internal.util.printer import *
+import spark_deploy.status as _status
+
+def subparser(subparsers):
+    '''Register subparser modules'''
+    statusparser = subparsers.add_parser('status', help='Show the state of a Spark cluster.')
+    statusparser.add_argument('--master', metavar='id', dest='master_id', type=int, default=None, help='ID of the master node.')
+    statusparser.add_argument('--master-host', metavar='host', dest='master_host', type=str, default=None, help='Hostname the master listens on.')
+    statusparser.add_argument('--webui-port', metavar='port', dest='webui_port', type=int, default=start_defaults.webuiport(), help='port of the Spark webUI (default={}).'.format(start_defaults.webuiport()))
+    statusparser.add_argument('--probe', help='If set, also probes every node for running daemons, installed versions, load and memory.', action='store_true')
+    statusparser.add_argument('--ttl', metavar='seconds', dest='cache_ttl', type=int, default=defaults.cache_ttl(), help='Maximal age of a cached status we show. 0 disables the cache (default={}).'.format(defaults.cache_ttl()))
+    statusparser.add_argument('--refresh', help='If set, always queries the cluster instead of showing a cached status.', action='store_true')
+    statusparser.add_argument('--json', help='If set, prints the status as JSON.', action='store_true')
+    statusparser.add_argument('--silent', help='If set, less output is shown.', action='store_true')
+    return [statusparser]
+
+
+def deploy_args_set(args):
+    '''Indicates whether we will handle command parse output in this module.
+    `deploy()` function will be called if set.
+
+    Returns:
+        `True` if we found arguments used by this subsubparser, `False` otherwise.'''
+    return args.command == 'status'
+
+
+def _print_summary(snapshot):
+    master = snapshot['master']
+    if master == None:
+        printe('Master: unreachable')
+    else:
+        print('Master: {} ({}), {} alive worker(s), {} active application(s)'.format(master['url'], master['status'], master['aliveworkers'], master['activeapps']))
+        print('    cores: {}/{} used, memory: {}/{} MB used'.format(master['coresused'], master['cores'], master['memoryused'], master['memory']))
+    for worker in snapshot['workers']:
+        print('Worker {} ({}): {}, cores: {}/{} used, memory: {}/{} MB used'.format(worker['host'], worker['id'], worker['state'], worker['coresused'], worker['cores'], worker['memoryused'], worker['memory']))
+    for node_id, node in sorted(snapshot.get('nodes', dict()).items()):
+        if node == None:
+            printe('Node {}: unreachable'.format(node_id))
+            continue
+        daemons = [name for name, running in (('master', node['master_running']), ('worker', node['worker_running'])) if running]
+        print('Node {}: Spark {}, Java {}, daemons: {}, load: {}, memory available: {}/{} MB'.format(
+            node_id,
+            node['spark_version'] if node['spark_installed'] else 'not installed',
+            node['java_version'],
+            ', '.join(daemons) if any(daemons) else 'none',
+            node['load'],
+            node['memory_available']//(1024*1024) if node['memory_available'] != None else None,
+            node['memory_total']//(1024*1024) if node['memory_total'] != None else None))
+
+
+def deploy(parsers, args):
+    reservation = _cli_util.read_reservation_cli()
+    if not reservation:
+        return False
+    snapshot = _status(reservation, install_dir=args.install_dir, key_path=args.key_path, master_id=args.master_id, master_host=args.master_host, webui_port=args.webui_port, probe=args.probe, cache_ttl=args.cache_ttl, refresh=args.refresh, silent=args.silent)
+    if args.json:
+        print(json.dumps(snapshot, indent=4))
+    else:
+        _print_summary(snapshot)
+    return snapshot['master'] != None
\ No newline at end of file
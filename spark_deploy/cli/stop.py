@@ -19,6 +19,9 @@ def subparser(subparsers):
     stopparser = subparsers.add_parser('stop',  help='Stop Spark cluster.')
     stopparser.add_argument('--workdir', metavar='path', type=str, default=start_defaults.workdir(), help='If set, workdir location will be removed for all worker daemons (default={}).'.format(start_defaults.workdir()))
     stopparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when stopping Spark.')
+    stopparser.add_argument('--fast', help='If set, signals Spark daemons directly using their PID files, instead of using the Spark stop scripts.', action='store_true')
+    stopparser.add_argument('--stop-timeout', metavar='seconds', dest='stop_timeout', type=int, default=defaults.stop_timeout(), help='Number of seconds daemons get to exit when using --fast, before they are killed (default={}).'.format(defaults.stop_timeout()))
+    stopparser.add_argument('--async-cleanup', dest='async_cleanup', help='If set, workdirs are deleted in the background, without waiting for the delete to finish.', action='store_true')
     stopparser.add_argument('--silent', help='If set, less boot output is shown.', action='store_true')
     stopparser.add_argument('--retries', metavar='amount', type=int, default=defaults.retries(), help='Amount of retries to use for risky operations (default={}).'.format(defaults.retries()))
     return [stopparser]
@@ -35,4 +38,4 @@ def deploy_args_set(args):
 
 def deploy(parsers, args):
     reservation = _cli_util.read_reservation_cli()
-    return _stop(reservation, install_dir=args.install_dir, key_path=args.key_path, worker_workdir=args.workdir, use_sudo=args.use_sudo, silent=args.silent, retries=args.retries) if reservation else False
\ No newline at end of file
+    return _stop(reservation, install_dir=args.install_dir, key_path=args.key_path, worker_workdir=args.workdir, use_sudo=args.use_sudo, fast=args.fast, stop_timeout=args.stop_timeout, async_cleanup=args.async_cleanup, silent=args.silent, retries=args.retries) if reservation else False
\ No newline at end of file
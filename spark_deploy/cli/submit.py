@@ -13,6 +13,15 @@ def subparser(subparsers):
     submitparser.add_argument('--paths', metavar='path', type=str, nargs='+', default=[], help='Paths to files/directories to export to the cluster. These files/directories will be in the CWD when executing "spark-submit".')
     submitparser.add_argument('--application_dir', type=str, default=defaults.application_dir(), help='Location on remote host where we export all given applications to (pointed to by "paths").')
     submitparser.add_argument('--use-sudo', dest='use_sudo', help='If set, uses sudo when deploying.')
+    submitparser.add_argument('--multiplex', help='If set, uses OpenSSH connection multiplexing, so all transfers to a node share 1 ssh connection.', action='store_true')
+    submitparser.add_argument('--transfer-mode', metavar='mode', dest='transfer_mode', type=str, choices=['direct', 'relay'], default='direct', help='How paths get to all nodes. "direct" sends them to every node, "relay" sends them to the master only, which relays them to the workers over the cluster-internal network (default=direct).')
+    submitparser.add_argument('--app-cache', dest='app_cache', help='If set, nodes keep application data in a content-addressed store, and only changed files are transferred.', action='store_true')
+    submitparser.add_argument('--app-cache-size', metavar='bytes', dest='app_cache_size', type=int, default=defaults.app_cache_size(), help='Maximal amount of unused application data every node keeps when using --app-cache (default={}).'.format(defaults.app_cache_size()))
+    submitparser.add_argument('--targets', metavar='target', type=str, nargs='+', default=['auto'], help='Nodes receiving paths. "auto" picks the master only for client deploy mode, and all nodes for cluster deploy mode. "all" and "master" pick all nodes and the master only. Node ids pick these nodes and the master (default=auto).')
+    submitparser.add_argument('--hdfs-dir', metavar='url', dest='hdfs_dir', type=str, default=None, help='If set, the master uploads paths to this HDFS location, and only the master receives paths.')
+    submitparser.add_argument('--stream', help='If set, shows spark-submit output while the application runs.', action='store_true')
+    submitparser.add_argument('--log-file', metavar='path', dest='log_file', type=str, default=None, help='If set with --stream, appends spark-submit output to this local file instead of showing it.')
+    submitparser.add_argument('--detach', help='If set, launches the application detached from the connection, and returns right away. Output goes to a log file on the master.', action='store_true')
     submitparser.add_argument('--silent', help='If set, less boot output is shown.', action='store_true')
     return [submitparser]
 
@@ -26,6 +35,21 @@ def deploy_args_set(args):
     return args.command == 'submit'
 
 
+def _parse_targets(targets):
+    if len(targets) == 1 and targets[0] in ('auto', 'all', 'master'):
+        return targets[0]
+    try:
+        return [int(x) for x in targets]
+    except ValueError as e:
+        raise ValueError('--targets must be "auto", "all", "master", or a list of node ids. Found: {}'.format(' '.join(targets)))
+
+
 def deploy(parsers, args):
+    targets = _parse_targets(args.targets)
     reservation = _cli_util.read_reservation_cli()
-    return _submit(reservation, args.cmd, paths=args.paths, install_dir=args.install_dir, key_path=args.key_path, application_dir=args.application_dir, master_id=args.master_id, use_sudo=args.use_sudo, silent=args.silent) if reservation else False
\ No newline at end of file
+    if not reservation:
+        return False
+    retval = _submit(reservation, args.cmd, paths=args.paths, install_dir=args.install_dir, key_path=args.key_path, application_dir=args.application_dir, master_id=args.master_id, use_sudo=args.use_sudo, multiplex=args.multiplex, transfer_mode=args.transfer_mode, app_cache=args.app_cache, app_cache_size=args.app_cache_size, targets=targets, hdfs_dir=args.hdfs_dir, stream=args.stream, output=args.log_file, detach=args.detach, silent=args.silent)
+    if args.detach:
+        return retval != None
+    return retval == 0 if args.stream else retval
\ No newline at end of file
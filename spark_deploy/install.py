@@ -1,50 +1,86 @@
-import concurrent.futures
-
 import spark_deploy.internal.defaults.install as defaults
-from spark_deploy.internal.remoto.modulegenerator import ModuleGenerator
+from spark_deploy.internal.remoto.distribute import distribute
+import spark_deploy.internal.remoto.modulecache as modulecache
 from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.artifacts as artifacts
+import spark_deploy.internal.util.download as download
+import spark_deploy.internal.util.engine as engine
 import spark_deploy.internal.util.fs as fs
 import spark_deploy.internal.util.location as loc
-import spark_deploy.internal.util.importer as importer
 from spark_deploy.internal.util.printer import *
 
-def _install_spark(connection, spark_module, install_dir, spark_url, force_reinstall, silent=False, retries=5):
+def _install_spark(connection, spark_module, install_dir, spark_url, force_reinstall, stream=False, download_streams=4, silent=False, retries=5):
     remote_module = connection.import_module(spark_module)
-    return remote_module.spark_install(loc.sparkdir(install_dir), spark_url, force_reinstall, silent, retries)
+    return remote_module.spark_install(loc.sparkdir(install_dir), spark_url, force_reinstall, silent, retries, stream, download_streams, loc.manifest(install_dir))
 
 
-def _install_java(connection, java_module, install_dir, java_url, java_min, java_max, use_sudo, silent=False, retries=5):
+def _install_java(connection, java_module, install_dir, java_url, java_min, java_max, use_sudo, stream=False, download_streams=4, silent=False, retries=5):
     remote_module = connection.import_module(java_module)
     if use_sudo:
-        return remote_module.java_install_sudo(java_min, java_max, silent, retries)
+        return remote_module.java_install_sudo(java_min, java_max, silent, retries, loc.manifest(install_dir))
+    else:
+        return remote_module.java_install_nonsudo(loc.java_nonroot_dir(install_dir), java_url, java_min, java_max, silent, retries, stream, download_streams, loc.manifest(install_dir))
+
+
+def _query_needs(wrapper, manifest_module, java_module, install_dir, spark_url, java_url, java_min, java_max, use_sudo, force_reinstall):
+    '''Asks a node which components it needs, by comparing its install manifest with what we want to install.
+    This costs 1 round-trip for nodes with a manifest. Nodes without recorded Java installation get checked for usable existing Java installations.
+    Returns:
+        `(needs_spark, needs_java)`.'''
+    spark_ok, java_ok = wrapper.connection.import_module(manifest_module).manifest_check(loc.manifest(install_dir), loc.sparkdir(install_dir), spark_url, java_url, java_min, java_max, use_sudo)
+    if java_ok == None:
+        java_ok = wrapper.connection.import_module(java_module).java_detect(java_min, java_max, loc.manifest(install_dir))
+    return force_reinstall or not spark_ok, not java_ok
+
+
+def _install_staged(wrapper, spark_module, java_module, install_dir, spark_url, java_url, spark_archive, java_archive, needs_spark, needs_java, java_min, java_max, use_sudo, silent=False, retries=5):
+    '''Installs Spark and Java on a node, from archives we distributed to its staging directory.
+    Returns:
+        `(spark_ok, java_ok)`, `True` for each component installed successfully.'''
+    staging = loc.stagingdir(install_dir)
+    spark_ok = (not needs_spark) or wrapper.connection.import_module(spark_module).spark_install_archive(loc.sparkdir(install_dir), fs.join(staging, fs.basename(spark_archive)), True, silent, loc.manifest(install_dir), spark_url)
+    if use_sudo:
+        java_ok = (not needs_java) or _install_java(wrapper.connection, java_module, install_dir, None, java_min, java_max, use_sudo, silent=silent, retries=retries)
     else:
-        return remote_module.java_install_nonsudo(loc.java_nonroot_dir(install_dir), java_url, java_min, java_max, silent, retries)
+        java_ok = (not needs_java) or wrapper.connection.import_module(java_module).java_install_archive(loc.java_nonroot_dir(install_dir), fs.join(staging, fs.basename(java_archive)), java_min, java_max, silent, loc.manifest(install_dir), java_url)
+    return spark_ok, java_ok
+
+
+def _generate_module_manifest(silent=False):
+    '''Generates install-manifest module from available sources.'''
+    files = [
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'manifest.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
+    ]
+    return modulecache.get_module('install_manifest', files, modules=[fs], silent=silent)
 
 
 def _generate_module_spark(silent=False):
     '''Generates Spark-install module from available sources.'''
-    generation_loc = fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'generated', 'install_spark.py')
     files = [
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'stream_extract.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'manifest.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_install.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
     ]
-    ModuleGenerator().with_module(fs).with_files(*files).generate(generation_loc, silent)
-    return importer.import_full_path(generation_loc)
+    return modulecache.get_module('install_spark', files, modules=[fs, download], silent=silent)
 
 
 def _generate_module_java(silent=False):    
-    generation_loc = fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'generated', 'install_java.py')
     files = [
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'env.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'stream_extract.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'manifest.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'java_install.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
     ]
-    ModuleGenerator().with_module(fs).with_files(*files).generate(generation_loc, silent)
-    return importer.import_full_path(generation_loc)
+    return modulecache.get_module('install_java', files, modules=[fs, download], silent=silent)
 
 
 def _merge_kwargs(x, y):
@@ -53,30 +89,48 @@ def _merge_kwargs(x, y):
     return z
 
 
-def install(reservation, install_dir=defaults.install_dir(), key_path=None, connectionwrappers=None, spark_url=defaults.spark_url(), java_url=defaults.java_url(), java_min=defaults.java_min(), java_max=defaults.java_max(), use_sudo=defaults.use_sudo(), force_reinstall=False, silent=False, retries=defaults.retries()):
+def install(reservation, install_dir=defaults.install_dir(), key_path=None, connectionwrappers=None, spark_url=defaults.spark_url(), java_url=defaults.java_url(), java_min=defaults.java_min(), java_max=defaults.java_max(), use_sudo=defaults.use_sudo(), force_reinstall=False, fetch_mode=defaults.fetch_mode(), distribution=defaults.distribution(), seeds=defaults.seeds(), offline=False, cache_size=defaults.artifact_cache_size(), stream=defaults.stream(), download_streams=defaults.download_streams(), multiplex=False, silent=False, retries=defaults.retries()):
     '''Install Spark and Java on a reserved cluster. Does not reinstall if already present.
+    Every node keeps a manifest of what we installed. We check all manifests first, and only install on nodes where the manifest does not match the requested installation.
     Args:
         reservation (`metareserve.Reservation`): Reservation object with all nodes to install Spark on.
         install_dir (optional str): Location on remote host to install Spark in.
         key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
-        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
         spark_url (optional str): URL to download Spark.
         java_url (optional str): URL to download Java.
         java_min (optional int): Minimal Java version to accept. 0 means no limit.
         java_max (optional int): Maximal Java version to accept. 0 means no limit.
         use_sudo (optional bool): If set, installs some libraries system-wide. Otherwise, performs local installation.
-        force_reinstall (optional bool): If set, we always will re-download and install libraries. Otherwise, we will skip installing libraries that we already have installed.
+        force_reinstall (optional bool): If set, we always will re-download and install Spark. Otherwise, we will skip installing libraries that we already have installed.
+        fetch_mode (optional str): Determines who downloads the archives.
+            "nodes": Every node downloads its own copy.
+            "controller": We download every archive once into a local artifact store, verify it against the checksum published next to it, and push it to the nodes that need it. Nodes only extract.
+        distribution (optional str): Determines how we push archives to nodes in "controller" fetch mode.
+            "direct": We push to every node ourselves.
+            "tree": We push to `seeds` nodes, which relay archives to other nodes over the cluster-internal network (`ip_local`) in a binomial tree.
+        seeds (optional int): Number of nodes we push archives to directly in "tree" distribution.
+        offline (optional bool): If set, installs entirely from the local artifact store, without accessing the internet. Implies "controller" fetch mode.
+        cache_size (optional int): Maximal size (in bytes) of the local artifact store. When it grows larger, we evict least-recently used archives.
+        stream (optional bool): If set, nodes extract archives while downloading them in "nodes" fetch mode, without storing archives on disk. Archives pushed in "controller" fetch mode are always extracted without temporary copies.
+        download_streams (optional int): Number of concurrent HTTP Range requests we download every archive with, on nodes and on the controller. Ignored when nodes use `stream`.
+        multiplex (optional bool): If set, new connections use OpenSSH multiplexing, so pushing archives does not require new ssh handshakes. Ignored when `connectionwrappers` is set.
         silent (optional bool): If set, we only print errors and critical info.
         retries (optional int): Number of tries we try to download archives.
 
     Raises:
-        Valuerror: When reservation contains 0 nodes or is `None`.
+        Valuerror: When reservation contains 0 nodes or is `None`, or when `fetch_mode` or `distribution` is unknown.
 
     Returns:
         `True` on success, `False` otherwise.'''
     if not reservation or len(reservation) == 0:
         raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
-
+    if offline:
+        fetch_mode = 'controller'
+    if fetch_mode != 'nodes' and fetch_mode != 'controller':
+        raise ValueError('Only know of "nodes" and "controller" fetch modes. Found: "{}"'.format(fetch_mode))
+    if distribution != 'direct' and distribution != 'tree':
+        raise ValueError('Only know of "direct" and "tree" distribution modes. Found: "{}"'.format(distribution))
 
     local_connections = connectionwrappers == None
     if local_connections:
@@ -85,28 +139,70 @@ def install(reservation, install_dir=defaults.install_dir(), key_path=None, conn
             ssh_kwargs['IdentityFile'] = key_path
         else:
             printw('Connections have no assigned ssh key. Prepare to fill in your password often.')
-        connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=silent)
+        connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), multiplex=multiplex, silent=silent)
     if any(x for x in connectionwrappers.values() if not x):
         printe('Could not connect to some nodes.')
         if local_connections:
             close_wrappers(connectionwrappers)
         return False
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(reservation)) as executor:
+    with engine.executor(len(reservation)) as executor:
+        manifest_module = _generate_module_manifest()
         spark_module = _generate_module_spark()
         java_module = _generate_module_java()
 
-        futures_install_spark = {executor.submit(_install_spark, x.connection, spark_module, install_dir, spark_url, force_reinstall, silent=silent, retries=retries): x for x in connectionwrappers.values()}
-        futures_install_java = {executor.submit(_install_java, x.connection, java_module, install_dir, java_url, java_min, java_max, use_sudo, silent=silent, retries=retries): x for x in connectionwrappers.values()}
+        futures_needs = {node: executor.submit(_query_needs, x, manifest_module, java_module, install_dir, spark_url, java_url, java_min, java_max, use_sudo, force_reinstall) for node, x in connectionwrappers.items()}
+        needs = {node: future.result() for node, future in futures_needs.items()}
+        needs_spark = [node for node, (x, _) in needs.items() if x]
+        needs_java = [node for node, (_, x) in needs.items() if x]
+        if not silent:
+            print('Spark needs installation on {}/{} nodes, Java on {}/{} nodes.'.format(len(needs_spark), len(needs), len(needs_java), len(needs)))
+        if not (needs_spark or needs_java):
+            if local_connections:
+                close_wrappers(connectionwrappers)
+            prints('Installation on all nodes up-to-date.')
+            return True
 
         state_ok = True
-        for key, val in futures_install_spark.items():
-            if not key.result():
-                printe('Could not install Spark on remote {}!'.format(val.connection.hostname))
-                state_ok = False
-        for key, val in futures_install_java.items():
-            if not key.result():
-                printe('Could not install java on remote {}!'.format(val.connection.hostname))
-                state_ok = False
+        if fetch_mode == 'controller':
+            spark_archive = artifacts.fetch(spark_url, offline=offline, max_size=cache_size, streams=download_streams, silent=silent, retries=retries) if needs_spark else None
+            java_archive = artifacts.fetch(java_url, offline=offline, max_size=cache_size, streams=download_streams, silent=silent, retries=retries) if needs_java and not use_sudo else None
+            if (needs_spark and not spark_archive) or (needs_java and not (use_sudo or java_archive)):
+                printe('Could not fetch install artifacts on the controller.')
+                if local_connections:
+                    close_wrappers(connectionwrappers)
+                return False
+
+            staging = loc.stagingdir(install_dir)
+            future_spark_push = executor.submit(distribute, {node: connectionwrappers[node] for node in needs_spark}, [spark_archive], staging, mode=distribution, seeds=seeds, silent=silent) if spark_archive else None
+            future_java_push = executor.submit(distribute, {node: connectionwrappers[node] for node in needs_java}, [java_archive], staging, mode=distribution, seeds=seeds, silent=silent) if java_archive else None
+            received = future_spark_push.result() if future_spark_push else dict()
+            received_java = future_java_push.result() if future_java_push else dict()
+            for node, ok in list(received.items()) + list(received_java.items()):
+                if not ok:
+                    printe('Could not push install artifacts to remote {}.'.format(connectionwrappers[node].connection.hostname))
+            received = {node: received.get(node, True) and received_java.get(node, True) for node in connectionwrappers.keys()}
+
+            futures_install = {executor.submit(_install_staged, x, spark_module, java_module, install_dir, spark_url, java_url, spark_archive, java_archive, needs[node][0], needs[node][1], java_min, java_max, use_sudo, silent=silent, retries=retries): x for node, x in connectionwrappers.items() if received[node] and any(needs[node])}
+            state_ok = all(received.values())
+            for key, val in futures_install.items():
+                spark_ok, java_ok = key.result()
+                if not spark_ok:
+                    printe('Could not install Spark on remote {}!'.format(val.connection.hostname))
+                if not java_ok:
+                    printe('Could not install java on remote {}!'.format(val.connection.hostname))
+                state_ok &= spark_ok and java_ok
+        else:
+            futures_install_spark = {executor.submit(_install_spark, connectionwrappers[node].connection, spark_module, install_dir, spark_url, True, stream=stream, download_streams=download_streams, silent=silent, retries=retries): connectionwrappers[node] for node in needs_spark}
+            futures_install_java = {executor.submit(_install_java, connectionwrappers[node].connection, java_module, install_dir, java_url, java_min, java_max, use_sudo, stream=stream, download_streams=download_streams, silent=silent, retries=retries): connectionwrappers[node] for node in needs_java}
+
+            for key, val in futures_install_spark.items():
+                if not key.result():
+                    printe('Could not install Spark on remote {}!'.format(val.connection.hostname))
+                    state_ok = False
+            for key, val in futures_install_java.items():
+                if not key.result():
+                    printe('Could not install java on remote {}!'.format(val.connection.hostname))
+                    state_ok = False
         
         if local_connections:
             close_wrappers(connectionwrappers)
@@ -0,0 +1,12 @@
+# execution engine default values
+def max_workers():
+    return 64
+
+def per_operation():
+    return 32
+
+def connect_rate():
+    return 10
+
+def connect_burst():
+    return 10
\ No newline at end of file
@@ -19,4 +19,22 @@ def retries():
     return 5
 
 def use_sudo():
-    return False
\ No newline at end of file
+    return False
+
+def fetch_mode():
+    return 'nodes'
+
+def distribution():
+    return 'direct'
+
+def seeds():
+    return 2
+
+def stream():
+    return False
+
+def download_streams():
+    return 4
+
+def artifact_cache_size():
+    return 4*1024*1024*1024 # 4 GiB
\ No newline at end of file
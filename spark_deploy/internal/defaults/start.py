@@ -9,4 +9,19 @@ def masterport():
     return 7077
 
 def webuiport():
-    return 8080
\ No newline at end of file
+    return 8080
+
+def wait_timeout():
+    return 60
+
+def rolling_batch_size():
+    return 1
+
+def reserved_cores():
+    return 1
+
+def reserved_memory():
+    return 2048
+
+def memory_fraction():
+    return 0.8
\ No newline at end of file
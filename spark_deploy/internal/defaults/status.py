@@ -0,0 +1,3 @@
+# status default values
+def cache_ttl():
+    return 10
\ No newline at end of file
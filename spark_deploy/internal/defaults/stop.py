@@ -1,2 +1,5 @@
 def retries():
-    return 5
\ No newline at end of file
+    return 5
+
+def stop_timeout():
+    return 10
\ No newline at end of file
@@ -1,2 +1,14 @@
 def application_dir():
-    return '~/application'
\ No newline at end of file
+    return '~/application'
+
+def app_cache_size():
+    return 10*1024*1024*1024
+
+def queue_max_running():
+    return 4
+
+def queue_poll_interval():
+    return 5
+
+def queue_max_poll_failures():
+    return 5
\ No newline at end of file
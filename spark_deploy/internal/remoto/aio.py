@@ -0,0 +1,241 @@
+'''asyncio transport for remote modules. Every remote call is a plain `ssh` subprocess, driven by the event loop.
+No call occupies an OS thread, so 1 controller process can keep thousands of nodes busy.
+
+Protocol: We start a small bootstrap program with `python3 -c`. It reads the generated module and the call to make from stdin, runs it, and prints the result on a marker line.
+All other output is streamed back line by line. Stdin stays open during the call. When it closes (because we cancelled the call, or the controller died),
+the bootstrap terminates the call and everything it spawned.'''
+
+import ast
+import asyncio
+import shlex
+import shutil
+import tempfile
+import uuid
+import weakref
+
+from spark_deploy.internal.remoto.ssh_wrapper import _build_ssh_config
+import spark_deploy.internal.remoto.transfer as transfer
+import spark_deploy.internal.util.engine as engine
+from spark_deploy.internal.util.printer import *
+
+
+_BOOTSTRAP = '''
+import ast, os, signal, sys, threading, traceback
+try:
+    os.setpgid(0, 0)
+except OSError as e:
+    pass
+_size = int(sys.stdin.buffer.readline())
+_source = sys.stdin.buffer.read(_size).decode('utf-8')
+_function, _args = ast.literal_eval(sys.stdin.buffer.readline().decode('utf-8'))
+def _watch():
+    while os.read(0, 65536):
+        pass
+    os.killpg(0, signal.SIGTERM)
+threading.Thread(target=_watch, daemon=True).start()
+_namespace = {'__name__': '__spark_deploy__'}
+try:
+    exec(compile(_source, '<spark-deploy>', 'exec'), _namespace)
+    _result, _ok = _namespace[_function](*_args), True
+except BaseException as e:
+    _result, _ok = traceback.format_exc(), False
+sys.stdout.write('\\n{marker}' + repr((_ok, _result)) + '\\n')
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+class RemoteError(Exception):
+    '''Raised when a remote call raises an exception. The message contains the remote traceback.'''
+    pass
+
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _semaphore():
+    '''Returns the semaphore bounding the number of running remote calls in the current event loop. Its size is the engine's global worker limit.'''
+    loop = asyncio.get_running_loop()
+    if not loop in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(engine.max_workers())
+    return _semaphores[loop]
+
+
+class AsyncTarget(object):
+    '''ssh target for asyncio operations. Holds the ssh config (and optional multiplexed master connection) for 1 node.
+    Use in an "async with" clause, or call `open()` and `close()`.'''
+    def __init__(self, node, hostname, ssh_params=None, multiplex=False):
+        self.node = node
+        self.hostname = hostname
+        self._ssh_params = ssh_params
+        self._multiplex = multiplex
+        self._ssh_config = None
+        self._control_dir = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def multiplexed(self):
+        '''`True` if ssh sessions to this target share an OpenSSH master connection.'''
+        return self._control_dir != None
+
+    @property
+    def ssh_command(self):
+        '''ssh command (without hostname) to reach this target, e.g. for use with `rsync -e`.'''
+        return 'ssh -F {}'.format(self._ssh_config.name) if self._ssh_config else 'ssh'
+
+    async def open(self):
+        '''Prepares the ssh config. When multiplexing, also opens the master connection. If that fails, we fall back to regular connections.'''
+        if self._multiplex:
+            self._control_dir = tempfile.mkdtemp(prefix='spark-deploy-')
+            self._ssh_config = _build_ssh_config(self.hostname, self._ssh_params or dict(), control_dir=self._control_dir)
+            await _connect_permit()
+            proc = await asyncio.create_subprocess_exec('ssh', '-F', self._ssh_config.name, '-o', 'ControlMaster=yes', '-f', '-N', self.hostname, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            if await proc.wait() == 0:
+                return
+            printw('Could not open multiplexed connection to {}. Falling back to regular connections.'.format(self.hostname))
+            self._ssh_config.close()
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+        self._ssh_config = _build_ssh_config(self.hostname, self._ssh_params) if self._ssh_params else None
+
+    async def close(self):
+        '''Closes the master connection (if any), and removes the ssh config.'''
+        if self._control_dir:
+            proc = await asyncio.create_subprocess_exec('ssh', '-F', self._ssh_config.name, '-O', 'exit', self.hostname, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            await proc.wait()
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+        if self._ssh_config:
+            self._ssh_config.close()
+            self._ssh_config = None
+
+
+async def _connect_permit():
+    '''Waits until we are allowed to open a new ssh connection, without blocking the event loop.'''
+    wait = engine.ssh_connect_delay()
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def _kill(proc):
+    '''Closes stdin of a subprocess, kills it if it still runs, and reaps it.'''
+    if proc.stdin:
+        proc.stdin.close()
+    if proc.returncode == None:
+        try:
+            proc.kill()
+        except ProcessLookupError as e:
+            pass
+        await proc.wait()
+
+
+async def _pump(stream, callback):
+    '''Calls `callback(line)` for every line read from `stream`, until EOF.'''
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        callback(line.decode('utf-8', errors='replace').rstrip('\n'))
+
+
+async def call(target, module, function, *args, progress=None):
+    '''Calls a function of a generated remote module on a target.
+    Cancelling the awaiting task kills the ssh session, after which the remote side terminates the call (see module docstring).
+    Args:
+        target (AsyncTarget): Target to run the call on.
+        module (module): Generated module, as returned by `modulecache.get_module`.
+        function (str): Name of the function to call.
+        args: Positional arguments for the function. Must be valid Python literals (i.e. `repr`-able and parseable by `ast.literal_eval`).
+        progress (optional callable): If set, called with every line of output the call produces. Otherwise, output is discarded.
+
+    Raises:
+        RemoteError: When the remote call raised an exception, or the ssh session ended without a result.
+
+    Returns:
+        Return value of the remote function.'''
+    marker = 'spark-deploy-result-{}:'.format(uuid.uuid4().hex)
+    with open(module.__file__, 'rb') as f:
+        source = f.read()
+    payload = str(len(source)).encode('utf-8')+b'\n'+source+repr((function, args)).encode('utf-8')+b'\n'
+
+    result = []
+    def _on_stdout(line):
+        if line.startswith(marker):
+            result.append(ast.literal_eval(line[len(marker):]))
+        elif line and progress:
+            progress(line)
+    def _on_stderr(line):
+        if progress:
+            progress(line)
+
+    cmd = shlex.split(target.ssh_command) + [target.hostname, 'python3 -u -c {}'.format(shlex.quote(_BOOTSTRAP.replace('{marker}', marker)))]
+    async with _semaphore():
+        if not target.multiplexed:
+            await _connect_permit()
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=2**24)
+        try:
+            proc.stdin.write(payload)
+            await proc.stdin.drain()
+            await asyncio.gather(_pump(proc.stdout, _on_stdout), _pump(proc.stderr, _on_stderr))
+            proc.stdin.close()
+            await proc.wait()
+        finally:
+            await _kill(proc)
+    if not result:
+        raise RemoteError('Call to {} on {} ended without result (exitcode={}).'.format(function, target.hostname, proc.returncode))
+    ok, value = result[0]
+    if not ok:
+        raise RemoteError('Call to {} on {} raised an exception:\n{}'.format(function, target.hostname, value))
+    return value
+
+
+async def run(target, command, progress=None):
+    '''Runs a shell command on a target.
+    Args:
+        target (AsyncTarget): Target to run the command on.
+        command (str): Command to execute in the remote shell.
+        progress (optional callable): If set, called with every line of output the command produces.
+
+    Returns:
+        Exitcode of the command. 255 means ssh itself failed.'''
+    cmd = shlex.split(target.ssh_command) + [target.hostname, command]
+    async with _semaphore():
+        if not target.multiplexed:
+            await _connect_permit()
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        try:
+            await _pump(proc.stdout, progress or (lambda line: None))
+            return await proc.wait()
+        finally:
+            await _kill(proc)
+
+
+async def rsync(target, sources, dest, flags='-aL', progress=None):
+    '''Transfers local sources to a remote destination, using 1 rsync process for all sources.
+    Args:
+        target (AsyncTarget): Target to transfer to.
+        sources (str, list(str)): Local path(s) to transfer.
+        dest (str): Remote destination. When transferring multiple sources, this should be a directory.
+        flags (optional str): rsync flags to use.
+        progress (optional callable): If set, called with every line of output rsync produces.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    if isinstance(sources, str):
+        sources = [sources]
+    cmd = ['rsync', '-e', target.ssh_command] + shlex.split(flags) + list(sources) + ['{}:{}'.format(target.hostname, transfer.remote_path(dest))]
+    async with _semaphore():
+        if not target.multiplexed:
+            await _connect_permit()
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        try:
+            await _pump(proc.stdout, progress or (lambda line: None))
+            return await proc.wait() == 0
+        finally:
+            await _kill(proc)
\ No newline at end of file
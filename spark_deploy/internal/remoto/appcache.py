@@ -0,0 +1,129 @@
+'''Controller side of the content-addressed application cache (see `internal/remoto/modules/app_cache.py`).
+We describe application data with a manifest of content hashes. Nodes report which blobs they lack, and we only transfer those.
+When nothing changed, a submit costs 1 round-trip per node. File hashes are cached locally, keyed on path, size and modification time, so we only hash changed files.'''
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import uuid
+
+import spark_deploy.internal.remoto.transfer as transfer
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+
+
+def _hash_cache_path():
+    return fs.join(loc.cachedir(), 'appcache', 'hashes.json')
+
+
+def _read_hash_cache():
+    try:
+        with open(_hash_cache_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        return dict()
+
+
+def _write_hash_cache(cache):
+    fs.mkdir(fs.dirname(_hash_cache_path()), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=fs.dirname(_hash_cache_path()))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, _hash_cache_path())
+
+
+def _file_sha256(path, info, cache):
+    '''Returns the sha256 hexdigest of a file, using the cached digest if the file did not change since we last hashed it.'''
+    key = os.path.realpath(path)
+    cached = cache.get(key)
+    if cached and cached[0] == info.st_size and cached[1] == info.st_mtime_ns:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    cache[key] = [info.st_size, info.st_mtime_ns, h.hexdigest()]
+    return h.hexdigest()
+
+
+def local_manifest(paths):
+    '''Builds a manifest for local files and directories. Symlinks are followed (like `rsync -L`).
+    Args:
+        paths (list(str)): Absolute local paths. Every path becomes a top-level entry, named after its basename.
+
+    Returns:
+        `(manifest, sources)`. `manifest` is the manifest to send to nodes (see `appcache_sync` in the remote module).
+        `sources` maps every sha256 hexdigest to a local file with that content.'''
+    cache = _read_hash_cache()
+    manifest = dict()
+    sources = dict()
+    for path in paths:
+        name = fs.basename(path)
+        dirs = []
+        files = []
+        def add_file(local, rel):
+            info = os.stat(local)
+            sha256 = _file_sha256(local, info, cache)
+            sources[sha256] = local
+            files.append([rel, sha256, bool(info.st_mode & stat.S_IXUSR)])
+
+        if fs.isdir(path):
+            for root, dirnames, filenames in os.walk(path, followlinks=True):
+                rel_root = fs.join(name, os.path.relpath(root, path)) if root != path else name
+                dirs.append(rel_root)
+                for filename in filenames:
+                    add_file(fs.join(root, filename), fs.join(rel_root, filename))
+        else:
+            add_file(path, name)
+        dirs.sort()
+        files.sort()
+        digest = hashlib.sha256(json.dumps([dirs, files]).encode('utf-8')).hexdigest()
+        manifest[name] = {'digest': digest, 'dirs': dirs, 'files': files}
+    _write_hash_cache(cache)
+    return manifest, sources
+
+
+def _sync_node(wrapper, hostname, module, manifest, sources, store, app_dir, max_size, silent):
+    remote_module = wrapper.connection.import_module(module)
+    done, missing = remote_module.appcache_sync(store, app_dir, manifest, max_size)
+    if done:
+        return True
+    if not silent:
+        print('Transferring {} changed file(s) to {}...'.format(len(missing), hostname))
+    transfer_id = uuid.uuid4().hex # Concurrent submits to the same node each get their own incoming directory.
+    incoming = fs.join(store, 'incoming', transfer_id)
+    tmpdir = tempfile.mkdtemp()
+    try: # We name every file to transfer after its hash, so 1 rsync process delivers all of them to the incoming directory.
+        for sha256 in missing:
+            os.symlink(sources[sha256], fs.join(tmpdir, sha256))
+        if not (transfer.mkdir(wrapper, incoming) and transfer.rsync(wrapper, hostname, tmpdir+'/', incoming+'/', flags='-azL', silent=silent)):
+            return False
+    finally:
+        fs.rm(tmpdir, ignore_errors=True)
+    done, missing = remote_module.appcache_sync(store, app_dir, manifest, max_size, transfer_id)
+    if not done:
+        printe('Node {} still lacks {} file(s) after transfer.'.format(hostname, len(missing)))
+    return done
+
+
+def sync(connectionwrappers, module, paths, store, app_dir, max_size=None, silent=False):
+    '''Gets local files and directories in an application directory on many nodes, transferring only contents the nodes do not have yet.
+    Args:
+        connectionwrappers (dict(metareserve.Node, RemotoSSHWrapper)): Connections to nodes that need the files.
+        module (module): Generated module, including the remote app cache module file.
+        paths (list(str)): Absolute local paths to files and directories. Every path ends up in `app_dir`, under its basename.
+        store (str): Remote blob store location.
+        app_dir (str): Remote application directory.
+        max_size (optional int): If set, nodes evict unused blobs until their store holds at most this many bytes.
+        silent (optional bool): If set, we only print errors and critical info.
+
+    Returns:
+        `dict(metareserve.Node, bool)`, mapping every node to `True` if its application directory is up to date, `False` otherwise.'''
+    manifest, sources = local_manifest(paths)
+    with engine.executor(len(connectionwrappers)) as executor:
+        futures_sync = {node: executor.submit(_sync_node, wrapper, node.ip_public, module, manifest, sources, store, app_dir, max_size, silent) for node, wrapper in connectionwrappers.items()}
+        return {node: future.result() for node, future in futures_sync.items()}
\ No newline at end of file
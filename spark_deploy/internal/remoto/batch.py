@@ -0,0 +1,46 @@
+'''Batched remote execution. A batch ships a list of operations to a node, where they execute in 1 round-trip.
+The remote module must include `internal/remoto/modules/batch.py`.'''
+
+import spark_deploy.internal.remoto.aio as aio
+
+
+class Batch(object):
+    '''List of operations to execute on a remote in 1 round-trip. Example:
+        batch = Batch()
+        check = batch.shell('ls /some/file')
+        batch.shell('mkdir -p /some/dir')
+        results = batch.run(connection, module)
+        ok, (exitcode, output) = results[check]'''
+    def __init__(self):
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add(self, function, *args):
+        '''Adds a call to a function of the remote module. Arguments must be `repr`-able.
+        Returns:
+            Index of the result of this operation.'''
+        self.ops.append((function, args))
+        return len(self.ops) - 1
+
+    def shell(self, command, cwd=None):
+        '''Adds a shell command. Its result value is `(exitcode, output)`.
+        Returns:
+            Index of the result of this operation.'''
+        return self.add('batch_shell', command, cwd)
+
+    def run(self, connection, module, stop_on_error=False):
+        '''Executes all operations on a remote, in order.
+        Args:
+            connection (remoto.Connection): Connection to execute on.
+            module (module): Generated module, including the batch module file.
+            stop_on_error (optional bool): If set, skips all operations after the first operation raising an exception.
+
+        Returns:
+            `list` with an `(ok, value)` pair per operation (see `batch_run` in the remote batch module).'''
+        return connection.import_module(module).batch_run(self.ops, stop_on_error)
+
+    async def run_async(self, target, module, stop_on_error=False, progress=None):
+        '''asyncio variant of `run`, executing on an `AsyncTarget`.'''
+        return await aio.call(target, module, 'batch_run', self.ops, stop_on_error, progress=progress)
\ No newline at end of file
@@ -0,0 +1,180 @@
+'''Distribution engine, to get (large) local files on many nodes.
+In "direct" mode, we push files from the controller to every node. Total time grows linearly with the number of nodes, as the controller uplink is the bottleneck.
+In "tree" mode, we push files to a few seed nodes only. Afterwards, every node holding the files relays them to a node lacking them, over the cluster-internal network.
+The number of holders doubles every round, so total time grows roughly logarithmically with the number of nodes (binomial tree).'''
+
+import tarfile
+import tempfile
+
+import spark_deploy.internal.remoto.modulecache as modulecache
+import spark_deploy.internal.remoto.transfer as transfer
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.fs as fs
+from spark_deploy.internal.util.printer import *
+
+
+def _generate_module_relay(silent=False):
+    '''Generates artifact-relay module from available sources.'''
+    files = [
+        fs.join(fs.dirname(fs.dirname(fs.dirname(fs.abspath(__file__)))), 'internal', 'util', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'modules', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'modules', 'artifact_relay.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'modules', 'remoto_base.py'),
+    ]
+    return modulecache.get_module('artifact_relay', files, modules=[fs], silent=silent)
+
+
+def binomial_rounds(holders, targets):
+    '''Computes a binomial-tree relay schedule.
+    Args:
+        holders (list): Nodes that have the files at the start.
+        targets (list): Nodes that need the files.
+
+    Returns:
+        `list(list((src, dst)))`, a list of rounds. In every round, every source sends to at most 1 destination. Every destination is a source in all following rounds.'''
+    holders = list(holders)
+    targets = list(targets)
+    rounds = []
+    while any(targets) and any(holders):
+        pairs = list(zip(holders, targets))
+        rounds.append(pairs)
+        targets = targets[len(pairs):]
+        holders += [dst for (src, dst) in pairs]
+    return rounds
+
+
+def _push_direct(connectionwrappers, sources, dest_dir, silent=False):
+    with engine.executor(len(connectionwrappers)) as executor:
+        push_fun = lambda node, wrapper: transfer.mkdir(wrapper, dest_dir) and transfer.rsync(wrapper, node.ip_public, sources, dest_dir+'/', silent=silent)
+        futures_push = {node: executor.submit(push_fun, node, wrapper) for node, wrapper in connectionwrappers.items()}
+        return {node: future.result() for node, future in futures_push.items()}
+
+
+def _push_tree(connectionwrappers, sources, dest_dir, seeds, silent=False, retries=3):
+    nodes = list(connectionwrappers.keys())
+    seed_nodes = nodes[:max(1, seeds)]
+    state = _push_direct({x: connectionwrappers[x] for x in seed_nodes}, sources, dest_dir, silent=silent)
+    holders = [x for x in seed_nodes if state[x]]
+    remaining = [x for x in nodes if not x in seed_nodes] + [x for x in seed_nodes if not state[x]]
+    if not any(holders):
+        printe('Could not push files to any seed node.')
+        return {x: False for x in nodes}
+    if not silent:
+        print('Pushed files to {} seed node(s). Relaying to {} other node(s)...'.format(len(holders), len(remaining)))
+
+    module = _generate_module_relay(silent=silent)
+    names = [fs.basename(x) for x in sources]
+    servers = dict()
+    serve_fun = lambda node: connectionwrappers[node].connection.import_module(module).relay_serve(dest_dir, node.ip_local, names)
+    fetch_fun = lambda src, dst: connectionwrappers[dst].connection.import_module(module).relay_fetch(src.ip_local, servers[src][1], servers[src][2], names, dest_dir, retries)
+
+    with engine.executor(len(nodes)) as executor:
+        try:
+            for node, future in [(x, executor.submit(serve_fun, x)) for x in holders]:
+                servers[node] = future.result()
+            holders = [x for x in holders if servers[x][0] != None]
+
+            failures = 0
+            while any(remaining) and any(holders):
+                rounds = binomial_rounds(holders, remaining)
+                pairs = rounds[0] # We recompute the schedule every round, so failed relays are retried from other holders.
+                futures_fetch = {(src, dst): executor.submit(fetch_fun, src, dst) for (src, dst) in pairs}
+                received = [dst for (src, dst), future in futures_fetch.items() if future.result()]
+                failures += len(pairs) - len(received)
+                if failures > retries * len(nodes):
+                    printe('Too many failed relays. Giving up on relaying.')
+                    break
+
+                for node, future in [(x, executor.submit(serve_fun, x)) for x in received]:
+                    servers[node] = future.result()
+                remaining = [x for x in remaining if not x in received]
+                holders += [x for x in received if servers[x][0] != None]
+        finally:
+            futures_stop = [executor.submit(connectionwrappers[node].connection.import_module(module).relay_stop, pid) for node, (pid, port, token) in servers.items() if pid != None]
+            for x in futures_stop:
+                x.result()
+
+    if any(remaining): # Relaying failed for these nodes. We push directly as a last resort.
+        printw('Relaying failed for {} node(s). Pushing to them directly.'.format(len(remaining)))
+        state = _push_direct({x: connectionwrappers[x] for x in remaining}, sources, dest_dir, silent=silent)
+    else:
+        state = dict()
+    return {x: state.get(x, True) for x in nodes}
+
+
+def distribute(connectionwrappers, sources, dest_dir, mode='direct', seeds=2, silent=False, retries=3):
+    '''Gets local files on many nodes.
+    Args:
+        connectionwrappers (dict(metareserve.Node, RemotoSSHWrapper)): Connections to nodes that need the files.
+        sources (list(str)): Local files to distribute.
+        dest_dir (str): Remote directory to store files in.
+        mode (optional str): Distribution mode. "direct" pushes files from the controller to every node. "tree" pushes files to `seeds` nodes, which relay them to other nodes over their `ip_local`.
+        seeds (optional int): Number of nodes that receive files directly from the controller in "tree" mode.
+        silent (optional bool): If set, we only print errors and critical info.
+        retries (optional int): Number of tries we try to relay a file between 2 nodes.
+
+    Raises:
+        ValueError: When `mode` is unknown.
+
+    Returns:
+        `dict(metareserve.Node, bool)`, mapping every node to `True` if it received all files, `False` otherwise.'''
+    if mode != 'direct' and mode != 'tree':
+        raise ValueError('Only know of "direct" and "tree" distribution modes. Found: "{}"'.format(mode))
+    if not any(connectionwrappers) or not any(sources):
+        return {x: True for x in connectionwrappers.keys()}
+    if mode == 'direct' or len(connectionwrappers) <= seeds:
+        return _push_direct(connectionwrappers, sources, dest_dir, silent=silent)
+    return _push_tree(connectionwrappers, sources, dest_dir, seeds, silent=silent, retries=retries)
+
+
+def _pack(sources, archive):
+    '''Packs local files and directories in an uncompressed tar archive. Every source ends up in the root of the archive, and symlinks are followed (like `rsync -L`).'''
+    with tarfile.open(archive, mode='w', dereference=True) as f:
+        for source in sources:
+            f.add(source, arcname=fs.basename(source))
+
+
+def broadcast(connectionwrappers, sources, dest_dir, mode='direct', first=None, flags='-azL', silent=False, retries=3):
+    '''Gets local files and directories on many nodes, using 1 stream per node for all sources.
+    Args:
+        connectionwrappers (dict(metareserve.Node, RemotoSSHWrapper)): Connections to nodes that need the sources.
+        sources (list(str)): Local files and directories to send. Every source ends up in `dest_dir`, under its basename.
+        dest_dir (str): Remote directory to store sources in.
+        mode (optional str): Broadcast mode. "direct" sends all sources to every node with 1 rsync process per node.
+                             "relay" packs all sources in 1 archive, and sends it to node `first` only. That node relays the archive to the other nodes over the cluster-internal network (see `distribute`). Every node then unpacks the archive.
+        first (optional metareserve.Node): Node receiving the sources first in "relay" mode. If `None`, picks any node.
+        flags (optional str): rsync flags to use in "direct" mode.
+        silent (optional bool): If set, we only print errors and critical info.
+        retries (optional int): Number of tries we try to relay the archive between 2 nodes.
+
+    Raises:
+        ValueError: When `mode` is unknown.
+
+    Returns:
+        `dict(metareserve.Node, bool)`, mapping every node to `True` if it received all sources, `False` otherwise.'''
+    if mode != 'direct' and mode != 'relay':
+        raise ValueError('Only know of "direct" and "relay" broadcast modes. Found: "{}"'.format(mode))
+    if not any(connectionwrappers) or not any(sources):
+        return {x: True for x in connectionwrappers.keys()}
+
+    if mode == 'direct' or len(connectionwrappers) == 1:
+        with engine.executor(len(connectionwrappers)) as executor:
+            futures_rsync = {node: executor.submit(transfer.rsync, wrapper, node.ip_public, sources, dest_dir+'/', flags=flags, silent=silent) for node, wrapper in connectionwrappers.items()}
+            return {node: future.result() for node, future in futures_rsync.items()}
+
+    if first != None and first in connectionwrappers: # distribute() seeds the first node(s) of the mapping.
+        connectionwrappers = dict([(first, connectionwrappers[first])] + [(x, y) for x, y in connectionwrappers.items() if x != first])
+    staging_dir = fs.join(dest_dir, '.relay')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        archive = fs.join(tmpdir, 'broadcast.tar')
+        _pack(sources, archive)
+        state = distribute(connectionwrappers, [archive], staging_dir, mode='tree', seeds=1, silent=silent, retries=retries)
+    finally:
+        fs.rm(tmpdir, ignore_errors=True)
+
+    module = _generate_module_relay(silent=silent)
+    unpack_fun = lambda node: connectionwrappers[node].connection.import_module(module).relay_unpack(fs.join(staging_dir, 'broadcast.tar'), dest_dir)
+    with engine.executor(len(connectionwrappers)) as executor:
+        futures_unpack = {node: executor.submit(unpack_fun, node) for node, ok in state.items() if ok}
+        return {node: state[node] and futures_unpack[node].result() for node in state.keys()}
\ No newline at end of file
@@ -0,0 +1,70 @@
+'''Cache for generated remote modules. Modules are keyed by a hash over their input files, the generator version, and the interpreter, and stored in the user cache dir.'''
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+from spark_deploy.internal.remoto.modulegenerator import ModuleGenerator, GENERATOR_VERSION
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.importer as importer
+import spark_deploy.internal.util.location as loc
+
+
+_loaded = dict()
+_loaded_lock = threading.Lock()
+
+
+def _digest(paths):
+    '''Computes the cache key for a module generated from given files, in given order.'''
+    h = hashlib.sha256()
+    h.update('generator-{}\0'.format(GENERATOR_VERSION).encode('utf-8'))
+    h.update('{}\0{}\0'.format(sys.implementation.name, sys.version).encode('utf-8')) # The stl index, and thereby the generated imports, depend on the interpreter.
+    for x in paths:
+        h.update(x.encode('utf-8'))
+        h.update(b'\0')
+        with open(x, 'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _generate(paths, modules, files, generation_loc, silent=False):
+    '''Generates a module in a temporary file next to `generation_loc`, and atomically moves it into place.
+    This way, concurrent deployments never see (or import) a half-written module.'''
+    dest_dir = fs.dirname(generation_loc)
+    fs.mkdir(dest_dir, exist_ok=True)
+    fd, tmp_loc = tempfile.mkstemp(prefix='.tmp-', suffix='.py', dir=dest_dir)
+    os.close(fd)
+    try:
+        ModuleGenerator().with_modules(*modules).with_files(*files).generate(tmp_loc, silent=silent)
+        os.replace(tmp_loc, generation_loc)
+    except Exception as e:
+        fs.rm(tmp_loc, ignore_errors=True)
+        raise e
+
+
+def get_module(name, files, modules=[], silent=False):
+    '''Gets a remote module, generated from given modules and files. Reuses cached modules whenever the inputs did not change.
+    On a hit in this process, neither generation nor import happens. On a hit in the on-disk cache, we only import.
+    Args:
+        name (str): Name of the module. Used in the cached filename.
+        files (list(str)): Paths to files to include (see `ModuleGenerator.with_files`).
+        modules (optional list(module)): Python modules to include, in front of `files` (see `ModuleGenerator.with_modules`).
+        silent (optional bool): If set, skips printing warnings when non-standard imports are encountered during generation.
+
+    Returns:
+        Imported generated module, ready to be passed to `connection.import_module`.'''
+    paths = [x.__file__ for x in modules] + list(files)
+    key = _digest(paths)
+    with _loaded_lock:
+        if key in _loaded:
+            return _loaded[key]
+
+    generation_loc = fs.join(loc.cachedir(), 'modules', '{}-{}.py'.format(name, key[:32]))
+    if not fs.isfile(generation_loc):
+        _generate(paths, modules, files, generation_loc, silent=silent)
+    module = importer.import_full_path(generation_loc)
+    with _loaded_lock:
+        return _loaded.setdefault(key, module)
\ No newline at end of file
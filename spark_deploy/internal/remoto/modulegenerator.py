@@ -1,19 +1,27 @@
-import distutils.sysconfig as sysconfig
+import hashlib
 import itertools
+import os
 import re
 import sys
+import sysconfig
+import tempfile
+import threading
 import types
 
 import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
 from spark_deploy.internal.util.printer import *
 
 
+# Bump this whenever the output of `ModuleGenerator.generate` changes, to invalidate cached modules.
+GENERATOR_VERSION = 2
+
+
 def _generate_stl_libs():
     '''Generator for stl-names. Does a breadth-first search on the python installation directory. Adds built-in library names.
     Returns:
         `set(str)` containing all known standard-library files.'''
-    ret_list = set()
-    std_lib = sysconfig.get_python_lib(standard_lib=True)
+    std_lib = sysconfig.get_paths()['stdlib']
     std_lib_len = len(std_lib)
 
     found = set()
@@ -33,6 +41,51 @@ def _generate_stl_libs():
     return found
 
 
+def _stl_index_path():
+    '''Path to the on-disk stl index for the running interpreter. The filename is keyed by interpreter path and version.'''
+    key = hashlib.sha256('{}\0{}'.format(sys.executable, sys.version).encode('utf-8')).hexdigest()[:32]
+    return fs.join(loc.cachedir(), 'stl', '{}.txt'.format(key))
+
+
+def _load_stl_libs():
+    '''Builds the stl index. Uses `sys.stdlib_module_names` (Python 3.10+) when available.
+    Otherwise, reads the index from disk, or walks the stdlib directory tree once and persists the result for this interpreter.
+    Returns:
+        `frozenset(str)` containing all known standard-library names.'''
+    if hasattr(sys, 'stdlib_module_names'):
+        return frozenset(sys.stdlib_module_names).union(sys.builtin_module_names)
+
+    index_path = _stl_index_path()
+    try:
+        with open(index_path, 'r') as f:
+            return frozenset(x for x in f.read().split('\n') if x)
+    except OSError as e:
+        pass
+
+    found = _generate_stl_libs()
+    try: # Failing to persist only costs us the walk next time, so we do not care about errors here.
+        fs.mkdir(fs.dirname(index_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=fs.dirname(index_path))
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(sorted(found)))
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        pass
+    return frozenset(found)
+
+
+_stl_libs = None
+_stl_libs_lock = threading.Lock()
+
+def stl_libs():
+    '''Returns the stl index for this interpreter. It is built only once per process.'''
+    global _stl_libs
+    with _stl_libs_lock:
+        if _stl_libs == None:
+            _stl_libs = _load_stl_libs()
+        return _stl_libs
+
+
 class ModuleGenerator(object):
     '''Object to quickly construct self-contained modules, for use with remoto.
     Warning: We have several constraints for the input modules/files:
@@ -42,7 +95,6 @@ class ModuleGenerator(object):
         4. All uses of user-provided modules/files must be as if the user-provided modules.'''
     def __init__(self):
         self._files = []
-        self._stl_modules_cache = []
 
     def with_module(self, module):
         if not isinstance(module, types.ModuleType):
@@ -69,9 +121,8 @@ class ModuleGenerator(object):
         return self
 
     def _is_regular_python(self, name):
-        if not self._stl_modules_cache:
-            self._stl_modules_cache = list(_generate_stl_libs())
-        return name in self._stl_modules_cache
+        stl = stl_libs()
+        return name in stl or name.split('.', 1)[0] in stl # `sys.stdlib_module_names` only lists top-level names, e.g. "urllib" for "urllib.request".
 
 
     def _read_imports(self, allowed_imports=None, silent=False):
@@ -0,0 +1,150 @@
+'''In this file, we provide a content-addressed store for application data on nodes.
+Layout:
+    <store>/blobs/<sha256>   File contents, verified on insertion.
+    <store>/incoming/<id>/   Blobs transferred by the controller in transfer <id>, not yet verified.
+Application directories are built from hardlinks to blobs, so unchanged files are never transferred twice.
+Every application directory records the digest of every entry it holds in `.appcache.json`. Entries with an unchanged digest are not rebuilt.'''
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _ingest(store, transfer_id):
+    '''Moves verified blobs from the incoming directory of given transfer into the store, and removes that directory. Blobs with contents not matching their name are removed.
+    Every transfer has its own incoming directory, so we never touch files of a transfer still in progress.'''
+    incoming = join(store, 'incoming', transfer_id)
+    if not isdir(incoming):
+        return
+    mkdir(join(store, 'blobs'), exist_ok=True)
+    for name in os.listdir(incoming):
+        path = join(incoming, name)
+        if isfile(path) and _file_sha256(path) == name:
+            os.replace(path, join(store, 'blobs', name))
+        else:
+            printw('Dropping corrupt blob {}.'.format(name))
+    rm(incoming, ignore_errors=True)
+
+
+def _drop_abandoned(store, max_age=24*60*60):
+    '''Removes incoming directories of transfers that did not finish within `max_age` seconds, e.g. because the controller crashed.'''
+    incoming = join(store, 'incoming')
+    if not isdir(incoming):
+        return
+    deadline = time.time() - max_age
+    for name in os.listdir(incoming):
+        path = join(incoming, name)
+        try:
+            if os.stat(path).st_mtime < deadline:
+                rm(path, ignore_errors=True)
+        except FileNotFoundError: # Removed by a concurrent call.
+            pass
+
+
+def _read_state(app_dir):
+    try:
+        with open(join(app_dir, '.appcache.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        return dict()
+
+
+def _write_state(app_dir, state):
+    with open(join(app_dir, '.appcache.json.tmp'), 'w') as f:
+        json.dump(state, f)
+    os.replace(join(app_dir, '.appcache.json.tmp'), join(app_dir, '.appcache.json'))
+
+
+def _place(blob, dest, executable):
+    '''Places a blob at given destination, preferring a hardlink. We copy instead when linking is impossible (e.g. on another filesystem), or when the blob has a different executable bit.'''
+    blob_executable = bool(os.stat(blob).st_mode & stat.S_IXUSR)
+    if blob_executable == executable:
+        try:
+            os.link(blob, dest)
+            os.utime(blob) # Marks the blob as recently used, for `_evict`.
+            return
+        except OSError as e:
+            pass
+    shutil.copyfile(blob, dest)
+    os.chmod(dest, 0o755 if executable else 0o644)
+
+
+def _build(store, app_dir, name, entry):
+    '''Builds 1 entry (top-level file or directory) of an application directory from blobs, and atomically moves it in place.'''
+    tmp_root = join(app_dir, '.tmp-appcache-{}'.format(os.getpid()))
+    rm(tmp_root, ignore_errors=True)
+    mkdir(tmp_root)
+    try:
+        for path in entry['dirs']:
+            mkdir(join(tmp_root, path), exist_ok=True)
+        for path, sha256, executable in entry['files']:
+            mkdir(os.path.dirname(join(tmp_root, path)), exist_ok=True)
+            _place(join(store, 'blobs', sha256), join(tmp_root, path), executable)
+        dest = join(app_dir, name)
+        if os.path.lexists(dest):
+            old = join(app_dir, '.old-appcache-{}'.format(os.getpid()))
+            os.rename(dest, old)
+            rm(old, ignore_errors=True)
+        os.rename(join(tmp_root, name), dest)
+    finally:
+        rm(tmp_root, ignore_errors=True)
+
+
+def _evict(store, max_size):
+    '''Removes least-recently used blobs no application directory links to, until the store holds at most `max_size` bytes.'''
+    blobs = join(store, 'blobs')
+    entries = [(x.stat().st_mtime, x.stat().st_size, x.stat().st_nlink, x.path) for x in os.scandir(blobs) if x.is_file()]
+    total = sum(x[1] for x in entries)
+    for _, size, nlink, path in sorted(entries):
+        if total <= max_size:
+            break
+        if nlink > 1: # Still linked from an application directory.
+            continue
+        rm(path, ignore_errors=True)
+        total -= size
+
+
+def appcache_sync(store, app_dir, manifest, max_size=None, transfer_id=None):
+    '''Brings an application directory in line with given manifest, using only blobs available in the store.
+    Call this again after transferring missing blobs to `<store>/incoming/<transfer_id>/`.
+    Args:
+        store (str): Path to blob store. Created if it does not exist.
+        app_dir (str): Application directory to build. Created if it does not exist.
+        manifest (dict): Maps every top-level name to an entry `{"digest": str, "dirs": list(str), "files": list((path, sha256, executable))}`. Paths are relative to `app_dir`.
+        max_size (optional int): If set, evicts unused blobs afterwards, until the store holds at most this many bytes.
+        transfer_id (optional str): If set, first ingests blobs transferred to `<store>/incoming/<transfer_id>/`.
+
+    Returns:
+        `(True, [])` when the application directory is up to date. `(False, missing)` when we lack blobs, with `missing` the sha256 hashes to transfer.'''
+    store = os.path.expanduser(store)
+    app_dir = os.path.expanduser(app_dir)
+    mkdir(join(store, 'blobs'), exist_ok=True)
+    mkdir(app_dir, exist_ok=True)
+    if transfer_id != None:
+        _ingest(store, transfer_id)
+    _drop_abandoned(store)
+
+    state = _read_state(app_dir)
+    stale = {name: entry for name, entry in manifest.items() if state.get(name) != entry['digest'] or not os.path.lexists(join(app_dir, name))}
+    missing = sorted(set(sha256 for entry in stale.values() for _, sha256, _ in entry['files'] if not isfile(join(store, 'blobs', sha256))))
+    if any(missing):
+        return False, missing
+
+    for name, entry in stale.items():
+        _build(store, app_dir, name, entry)
+        state[name] = entry['digest']
+        _write_state(app_dir, state)
+    if max_size != None:
+        _evict(store, max_size)
+    return True, []
\ No newline at end of file
@@ -0,0 +1,135 @@
+'''In this file, we provide functions to relay files between nodes over the cluster-internal network.
+A node holding files serves them over HTTP, other nodes fetch them. This way, nodes need no ssh access to each other.'''
+
+import http.server
+import os
+import secrets
+import shutil
+import signal
+import tarfile
+import urllib.parse
+import urllib.request
+
+
+def _relay_handler(directory, token, names):
+    '''Returns a request handler serving only given filenames in `directory`, below the secret path "/<token>/". All other paths get a 404.'''
+    allowed = {'/{}/{}'.format(token, urllib.parse.quote(x)): join(directory, x) for x in names}
+    class _RelayHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = allowed.get(self.path)
+            if path == None or not isfile(path):
+                self.send_error(404)
+                return
+            with open(path, 'rb') as f:
+                self.send_response(200)
+                self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile, 1024*1024)
+
+        def log_message(self, format, *args):
+            pass
+    return _RelayHandler
+
+
+def relay_serve(directory, host, names):
+    '''Serves given files over HTTP, using a detached process. Files are only served below a random path, which we return.
+    Args:
+        directory (str): Directory containing the files.
+        host (str): Cluster-internal IP/hostname to listen on. We refuse to listen on all interfaces.
+        names (list(str)): Filenames in `directory` to serve.
+
+    Returns:
+        `(pid, port, token)` on success, `(None, None, None)` otherwise. Fetch files with `relay_fetch`, using the same token.'''
+    directory = os.path.expanduser(directory)
+    if host in (None, '', '0.0.0.0', '::'):
+        printe('Refusing to serve {} on all interfaces (host="{}").'.format(directory, host))
+        return None, None, None
+    token = secrets.token_urlsafe(16)
+    try: # We bind before forking, so the server is up once we return, and we never race for a port.
+        server = http.server.ThreadingHTTPServer((host, 0), _relay_handler(directory, token, names))
+    except Exception as e:
+        printe('Could not serve {} on {}: {}'.format(directory, host, e))
+        return None, None, None
+    port = server.server_address[1]
+
+    pid = os.fork()
+    if pid == 0:
+        try: # Detach from the remote channel, which uses our standard streams and other inherited descriptors.
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for x in (0, 1, 2):
+                os.dup2(devnull, x)
+            os.closerange(3, server.fileno())
+            os.closerange(server.fileno()+1, os.sysconf('SC_OPEN_MAX'))
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.server_close()
+    return pid, port, token
+
+
+def relay_stop(pid):
+    '''Stops a server started with `relay_serve`.'''
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0) # The server is our child, so we have to reap it.
+    except (OSError, ChildProcessError) as e:
+        pass
+    return True
+
+
+def relay_fetch(host, port, token, names, directory, retries=3):
+    '''Fetches files from a node serving them with `relay_serve`. Files are written to a temporary name first, and atomically moved in place.
+    Args:
+        host (str): IP/hostname of serving node.
+        port (int): Port of serving node.
+        token (str): Token returned by `relay_serve` on the serving node.
+        names (list(str)): Filenames to fetch.
+        directory (str): Local directory to store fetched files in.
+        retries (optional int): Number of tries we try to fetch every file.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    directory = os.path.expanduser(directory)
+    mkdir(directory, exist_ok=True)
+    for name in names:
+        url = 'http://{}:{}/{}/{}'.format(host, port, token, urllib.parse.quote(name))
+        dest = join(directory, name)
+        tmp_dest = join(directory, '.tmp-{}'.format(name))
+        for x in range(retries):
+            try:
+                urllib.request.urlretrieve(url, tmp_dest)
+                os.replace(tmp_dest, dest)
+                break
+            except Exception as e:
+                rm(tmp_dest, ignore_errors=True)
+                if x == retries-1:
+                    printe('Could not fetch {}: {}'.format(url, e))
+                    return False
+    return True
+
+def relay_unpack(archive, directory):
+    '''Extracts a tar archive (received with `relay_fetch`) into given directory. Afterwards, removes the archive, and its directory if that became empty.
+    Args:
+        archive (str): Path to archive.
+        directory (str): Directory to extract to. Created if it does not exist.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    archive = os.path.expanduser(archive)
+    directory = os.path.expanduser(directory)
+    kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else dict() # Python 3.12+ warns when we do not pick a filter.
+    try:
+        mkdir(directory, exist_ok=True)
+        with tarfile.open(archive, mode='r:') as f:
+            f.extractall(directory, **kwargs)
+        return True
+    except (OSError, tarfile.TarError) as e:
+        printe('Could not extract {} into {}: {}'.format(archive, directory, e))
+        return False
+    finally:
+        rm(archive, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(archive))
+        except OSError as e:
+            pass
\ No newline at end of file
@@ -0,0 +1,34 @@
+'''Code in this file executes a batch of operations in 1 remote call, saving a round-trip per operation.
+Include this file in a generated module to make every function of that module available as batch operation.'''
+
+import subprocess
+import traceback
+
+
+def batch_shell(command, cwd=None):
+    '''Runs a shell command, for use as batch operation.
+    Returns:
+        `(exitcode, output)`, where output contains both stdout and stderr.'''
+    proc = subprocess.run(command, shell=True, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return proc.returncode, proc.stdout.decode('utf-8', errors='replace')
+
+
+def batch_run(ops, stop_on_error=False):
+    '''Executes operations in order.
+    Args:
+        ops (list(tuple(str, tuple))): Operations to execute, as `(function_name, args)`. Function names refer to functions of this module.
+        stop_on_error (optional bool): If set, skips all operations after the first operation raising an exception.
+
+    Returns:
+        `list` with an `(ok, value)` pair per operation. `ok` is `True` when the operation returned, with `value` being its return value.
+        When the operation raised an exception, `ok` is `False` and `value` contains the traceback. Skipped operations produce `(False, None)`.'''
+    results = []
+    for name, args in ops:
+        if stop_on_error and any(not ok for ok, _ in results):
+            results.append((False, None))
+            continue
+        try:
+            results.append((True, globals()[name](*args)))
+        except Exception as e:
+            results.append((False, traceback.format_exc()))
+    return results
\ No newline at end of file
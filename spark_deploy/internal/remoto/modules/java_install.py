@@ -1,8 +1,8 @@
 import os
 import re
 import subprocess
+import tarfile
 import tempfile
-import urllib.request
 
 
 '''In this file, we provide functions to install Java.'''
@@ -50,7 +50,7 @@ def java_root_available():
     path = join(abspath(os.sep), 'usr', 'lib', 'jvm')
     if not isdir(path):
         return False
-    for x in _ls(path, only_dirs=True, full_paths=True):
+    for x in ls(path, only_dirs=True, full_paths=True):
         if java_installed(x):
             return True
     return False
@@ -132,13 +132,105 @@ def phase2(minversion, maxversion):
     return False
 
 
-def java_install_sudo(minversion, maxversion, silent=False, retries=5):
-    return java_install(None, None, minversion, maxversion, True, silent, retries)
+def java_available(minversion, maxversion):
+    '''Checks whether an acceptable Java installation is available, without installing anything. Sets `JAVA_HOME` if we find a suitable installation.
+    Returns:
+        `True` if we found an acceptable Java installation, `False` otherwise.'''
+    global env
+    env = Environment()
+    return phase0(minversion, maxversion) or phase1(minversion, maxversion) or phase2(minversion, maxversion)
+
+
+def java_detect(minversion, maxversion, manifest=None):
+    '''Checks whether an acceptable Java installation is available, without installing anything. Records it in the manifest if found.
+    Returns:
+        `True` if we found an acceptable Java installation, `False` otherwise.'''
+    if java_available(minversion, maxversion):
+        _java_record(manifest)
+        return True
+    return False
+
 
-def java_install_nonsudo(location, url, minversion, maxversion, silent=False, retries=5):
-    return java_install(location, url, minversion, maxversion, False, silent, retries)
+def _java_configure(location, minversion, maxversion, silent=False):
+    '''Points `JAVA_HOME` to a freshly extracted Java installation, and checks its version.
+    Returns:
+        `True` on success, `False` on failure.'''
+    set_java_home(abspath(location))
+    if java_acceptable_version(java_exec_get_versioninfo(java_home(), 'bin', 'java'), minversion, maxversion):
+        if not silent:
+            prints('installation completed.')
+        return True
+    else:
+        printe('Unexpected failure to configure newly downloaded "{}". Please point JAVA_HOME to the root installation directory yourself.'.format(location))
+        return False
+
+
+def _java_record(manifest, url=None, sha512=None):
+    '''Records the Java installation `JAVA_HOME` points to in the manifest, if we keep one. `url` is `None` for installations we did not download ourselves.'''
+    if not manifest:
+        return
+    try:
+        version = int(re.search(r'\d+', java_exec_get_versioninfo(java_home(), 'bin', 'java')).group())
+    except Exception as e:
+        printw('Could not determine version of Java in {}. Not recording it in the manifest.'.format(java_home()))
+        return
+    manifest_update(manifest, 'java', {'url': url, 'sha512': sha512, 'java_home': java_home(), 'version': version})
+
+
+def _java_stream(url, location, minversion, maxversion, silent=False, retries=5, manifest=None):
+    '''Downloads and extracts Java in one pass, writing every file directly to given `location`.
+    Returns:
+        `True` on success, `False` on failure.'''
+    if not silent:
+        print('Streaming Java from {}'.format(url))
+    sha512 = None
+    for x in range(retries):
+        rm(location, ignore_errors=True) # Remove (partial) earlier extractions.
+        try:
+            sha512 = stream_extract_url(url, location)
+            break
+        except Exception as e:
+            if x == retries-1:
+                printe('Could not download Java: {}'.format(e))
+            elif x == 0:
+                printw('Could not download Java. Retrying...')
+    if sha512 == None:
+        rm(location, ignore_errors=True)
+        return False
+    if not _java_configure(location, minversion, maxversion, silent=silent):
+        return False
+    _java_record(manifest, url, sha512)
+    return True
+
+
+def _java_extract(archiveloc, location, tmpdir, minversion, maxversion, silent=False):
+    '''Extracts a Java archive to given `location`, and points `JAVA_HOME` to it.
+    Returns:
+        `True` on success, `False` on failure.'''
+    try:
+        extractloc = join(tmpdir, 'extracted')
+        mkdir(extractloc, exist_ok=True)
+        unpack(archiveloc, extractloc)
+
+        extracted_dir = next(ls(extractloc, only_dirs=True, full_paths=True)) # find out what the extracted directory is called. There will be only 1 extracted directory.
+    except Exception as e:
+        printe('Could not extract zip file correctly: {}'.format(e))
+        return False
+    try:
+        rm(location, ignore_errors=True)
+        mv(extracted_dir, location)
+    except Exception as e:
+        printe('Could not move extracted contents ({}) to ({}): {}'.format(extracted_dir, location, e))
+    return _java_configure(location, minversion, maxversion, silent=silent)
 
-def java_install(location=None, url=None, minversion=11, maxversion=0, use_sudo=False, silent=False, retries=5):
+
+def java_install_sudo(minversion, maxversion, silent=False, retries=5, manifest=None):
+    return java_install(None, None, minversion, maxversion, True, silent, retries, False, 1, manifest)
+
+def java_install_nonsudo(location, url, minversion, maxversion, silent=False, retries=5, stream=False, streams=4, manifest=None):
+    return java_install(location, url, minversion, maxversion, False, silent, retries, stream, streams, manifest)
+
+def java_install(location=None, url=None, minversion=11, maxversion=0, use_sudo=False, silent=False, retries=5, stream=False, streams=4, manifest=None):
     '''Checks if Java is already available. If not, installs Java by downloading and installing from `.tgz`. Assumes extracted zip layout to look like:
     | some_dir/
     |           bin/
@@ -154,18 +246,20 @@ def java_install(location=None, url=None, minversion=11, maxversion=0, use_sudo=
         use_sudo (optional bool): If set, sudo user rights are used to install system-wide Java distribution. Otherwise, installs locally.
         retries (optional int): Number of retries to use when downloading, extracting.
         silent (optional bool): If set, prints less info.
+        stream (optional bool): If set, extracts the archive while downloading it, without storing the archive on disk. Ignored if `use_sudo`.
+        streams (optional int): Number of concurrent connections to download the archive with. Ignored if `use_sudo` or `stream` is set.
+        manifest (optional str): If set, records the Java installation we end up using in the manifest at this path (see `manifest_update`).
 
     Returns:
         `True` on success, `False` on failure.'''
-    location = os.path.expanduser(location)
-    
-    global env
-    env = Environment()
+    location = os.path.expanduser(location) if location else None
 
-    if phase0(minversion, maxversion) or phase1(minversion, maxversion) or phase2(minversion, maxversion):
+    if java_available(minversion, maxversion):
         if not silent:
             print('Acceptable existing Java installation detected. Skipping installation.')
+        _java_record(manifest)
         return True
+    manifest_update(manifest, 'java', None)
     if not silent:
         print('Beginning Java install procedure')
 
@@ -177,6 +271,7 @@ def java_install(location=None, url=None, minversion=11, maxversion=0, use_sudo=
         if subprocess.call(cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL) == 0:
             if phase1(minversion, maxversion) or phase2(minversion, maxversion):
                 if java_acceptable_version(java_exec_get_versioninfo(java_home(), 'bin', 'java'), minversion, maxversion):
+                    _java_record(manifest)
                     return True
                 else:
                     printe('Installed java does not meet dependencies. Picked Java version min={}, max={}, installed={}'.format(minversion, maxversion, max(maxversion, minversion, 15)))
@@ -187,45 +282,72 @@ def java_install(location=None, url=None, minversion=11, maxversion=0, use_sudo=
         else:
             printe('Unexpected error during execution of command: {}'.format(cmd))
             return False
+    elif stream: # Phase 3b: Java local installation, extracting while downloading
+        return _java_stream(url, location, minversion, maxversion, silent=silent, retries=retries, manifest=manifest)
     else: # Phase 3b: Java local installation
         with tempfile.TemporaryDirectory() as tmpdir: # We use a tempfile to store the downloaded archive.
             archiveloc = join(tmpdir, 'java.tar.gz')
             if not silent:
                 print('Fetching Java from {}'.format(url))
-            for x in range(retries):
-                try:
-                    rm(archiveloc, ignore_errors=True)
-                    urllib.request.urlretrieve(url, archiveloc)
-                    break
-                except Exception as e:
-                    if x == 0:
-                        printw('Could not download Java. Retrying...')
-                    elif x == retries-1:
-                        printe('Could not download Java: {}'.format(e))
-                        return False
             try:
-                extractloc = join(tmpdir, 'extracted')
-                mkdir(extractloc, exist_ok=True)
-                unpack(archiveloc, extractloc)
-
-                extracted_dir = next(ls(extractloc, only_dirs=True, full_paths=True)) # find out what the extracted directory is called. There will be only 1 extracted directory.
+                size, seconds = download(url, archiveloc, streams=streams, retries=retries) # Resumes failed chunks, instead of starting over.
+                if not silent:
+                    print('Fetched Java ({})'.format(throughput(size, seconds)))
             except Exception as e:
-                printe('Could not extract zip file correctly: {}'.format(e))
+                printe('Could not download Java: {}'.format(e))
                 return False
+            if not _java_extract(archiveloc, location, tmpdir, minversion, maxversion, silent=silent):
+                return False
+            _java_record(manifest, url, file_sha512(archiveloc))
+            return True
+
+
+def java_install_archive(location, archive, minversion=11, maxversion=0, silent=False, manifest=None, url=None):
+    '''Checks if Java is already available. If not, installs Java from an archive that is already present on this node (e.g. pushed by the controller).
+    The archive is removed afterwards. See `java_install` for the expected archive layout.
+    Args:
+        location (str): path to store local Java installation.
+        archive (str): Path to Java archive on this node.
+        minversion (optional int): Minimal acceptable java version. 0 means no limit.
+        maxversion (optional int): Maximal acceptable java version. 0 means no limit.
+        silent (optional bool): If set, prints less info.
+        manifest (optional str): If set, records the Java installation we end up using in the manifest at this path (see `manifest_update`).
+        url (optional str): URL the archive was originally downloaded from, to record in the manifest.
+
+    Returns:
+        `True` on success, `False` on failure.'''
+    location = os.path.expanduser(location)
+    archive = os.path.expanduser(archive)
+    try:
+        if java_available(minversion, maxversion):
+            if not silent:
+                print('Acceptable existing Java installation detected. Skipping installation.')
+            _java_record(manifest)
+            return True
+        if not isfile(archive):
+            printe('Could not find Java archive at {}.'.format(archive))
+            return False
+        manifest_update(manifest, 'java', None)
+        if not silent:
+            print('Installing Java in {}...'.format(location))
+        sha512 = file_sha512(archive) if manifest else None
+        if tarfile.is_tarfile(archive): # Extract directly into `location`, without a temporary copy.
+            rm(location, ignore_errors=True)
             try:
-                rm(location, ignore_errors=True)
-                mv(extracted_dir, location)
+                stream_extract_file(archive, location)
             except Exception as e:
-                printe('Could not move extracted contents ({}) to ({}): {}'.format(extracted_dir, location, e))
-
-            set_java_home(abspath(location))
-            if java_acceptable_version(java_exec_get_versioninfo(java_home(), 'bin', 'java'), minversion, maxversion):
-                if not silent:
-                    prints('installation completed.')
-                return True
-            else:
-                printe('Unexpected failure to configure newly downloaded "{}". Please point JAVA_HOME to the root installation directory yourself.'.format(location))
+                printe('Could not extract zip file correctly: {}'.format(e))
+                rm(location, ignore_errors=True)
                 return False
+            ok = _java_configure(location, minversion, maxversion, silent=silent)
+        else:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                ok = _java_extract(archive, location, tmpdir, minversion, maxversion, silent=silent)
+        if ok:
+            _java_record(manifest, url, sha512)
+        return ok
+    finally:
+        rm(archive, ignore_errors=True)
 
 
 if __name__ == '__channelexec__': # In case we use this module with remoto legacy connections (local, ssh), we need this footer.
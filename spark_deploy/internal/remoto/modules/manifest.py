@@ -0,0 +1,83 @@
+'''In this file, we provide functions to keep track of what we installed on a node.
+After every successful installation, we record the artifact URL, its hash, and (for Java) the version and `JAVA_HOME` in a manifest file.
+Before reinstalling, we remove the entry. A half-finished installation therefore never has a manifest entry.'''
+
+import fcntl
+import hashlib
+import json
+import os
+
+
+def manifest_read(path):
+    '''Reads the manifest at given path.
+    Returns:
+        `dict` with an entry per installed component. Empty if no (valid) manifest exists.'''
+    try:
+        with open(os.path.expanduser(path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        return dict()
+
+
+def manifest_update(path, component, entry):
+    '''Sets the manifest entry for a component. Safe to call concurrently for different components.
+    Args:
+        path (str): Path to manifest. Created if it does not exist.
+        component (str): Name of component (e.g. "spark", "java").
+        entry (dict, None): Entry to store. `None` removes the entry.'''
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    mkdir(os.path.dirname(path), exist_ok=True)
+    with open(path+'.lock', 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        manifest = manifest_read(path)
+        if entry == None:
+            manifest.pop(component, None)
+        else:
+            manifest[component] = entry
+        with open(path+'.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path+'.tmp', path)
+
+
+def file_sha512(path):
+    '''Computes the SHA-512 hexdigest of given file.'''
+    h = hashlib.sha512()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_check(path, spark_location, spark_url, java_url, java_min, java_max, use_sudo):
+    '''Checks whether the installations recorded in the manifest still match what we want to install. Only checks files, so this is fast.
+    Args:
+        path (str): Path to manifest.
+        spark_location (str): Location where Spark should be installed.
+        spark_url (str): URL of Spark archive we want installed.
+        java_url (str): URL of Java archive we would install.
+        java_min (int): Minimal acceptable Java version. 0 means no limit.
+        java_max (int): Maximal acceptable Java version. 0 means no limit.
+        use_sudo (bool): If set, we accept any recorded Java installation of an acceptable version.
+
+    Returns:
+        `(spark_ok, java_ok)`. `spark_ok` is `True` if the recorded Spark installation matches and is present. 
+        `java_ok` is `True` if the recorded Java installation matches and is present, `False` if it mismatches, and `None` if no Java installation is recorded.'''
+    manifest = manifest_read(path)
+    spark_location = os.path.expanduser(spark_location)
+
+    spark = manifest.get('spark')
+    spark_ok = bool(spark) and spark.get('url') == spark_url and spark.get('location') == spark_location and isfile(join(spark_location, 'sbin', 'start-master.sh')) and isfile(join(spark_location, 'bin', 'spark-submit'))
+
+    java = manifest.get('java')
+    if not java:
+        return spark_ok, None
+    try:
+        version = int(java.get('version'))
+        java_ok = isfile(join(java['java_home'], 'bin', 'java')) and (version >= java_min or java_min == 0) and (version <= java_max or java_max == 0)
+    except (KeyError, TypeError, ValueError) as e:
+        java_ok = False
+    if java_ok and not use_sudo and java.get('url') != None: # We installed this Java ourselves. Mismatches when we now want another archive.
+        java_ok = java['url'] == java_url
+    return spark_ok, java_ok
\ No newline at end of file
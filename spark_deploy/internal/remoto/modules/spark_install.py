@@ -1,6 +1,6 @@
 import os
+import tarfile
 import tempfile
-import urllib.request
 
 
 '''In this file, we provide functions to install Apache Spark.'''
@@ -11,7 +11,55 @@ def _is_installed(location):
     return isdir(location) and isdir(join(location, 'sbin'))
 
 
-def spark_install(location, url, force_reinstall=False, silent=False, retries=5):
+def _spark_extract(archiveloc, location, tmpdir, silent=False):
+    '''Extracts a Spark archive and moves its contents to given `location`.
+    Returns:
+        `True` on success, `False` on failure.'''
+    try:
+        extractloc = join(tmpdir, 'extracted')
+        mkdir(extractloc, exist_ok=True)
+        unpack(archiveloc, extractloc)
+
+        extracted_dir = next(ls(extractloc, only_dirs=True, full_paths=True)) # find out what the extracted directory is called. There will be only 1 extracted directory.
+        for x in ls(extracted_dir, full_paths=True): # Move every file and directory to the final location.
+            mv(x, location)
+        if not silent:
+            prints('Spark installation completed.')
+        return True
+    except Exception as e:
+        printe('Could not extract zip file correctly: {}'.format(e))
+        return False
+
+
+def _spark_record(manifest, location, url, sha512):
+    '''Records a successful Spark installation in the manifest, if we keep one.'''
+    manifest_update(manifest, 'spark', {'url': url, 'sha512': sha512, 'location': location})
+
+
+def _spark_stream(url, location, silent=False, retries=5, manifest=None):
+    '''Downloads and extracts Spark in one pass, writing every file directly to given `location`.
+    Returns:
+        `True` on success, `False` on failure.'''
+    for x in range(retries):
+        try:
+            if not silent:
+                print('Streaming spark from {}'.format(url))
+            sha512 = stream_extract_url(url, location)
+            _spark_record(manifest, location, url, sha512)
+            if not silent:
+                prints('Spark installation completed.')
+            return True
+        except Exception as e:
+            rm(location, ignore_errors=True) # Partial extraction. Start over.
+            mkdir(location)
+            if x == retries-1:
+                printe('Could not download Spark: {}'.format(e))
+            elif x == 0:
+                printe('Could not download Spark. Retrying...')
+    return False
+
+
+def spark_install(location, url, force_reinstall=False, silent=False, retries=5, stream=False, streams=4, manifest=None):
     '''Installs Spark by downloading and installing from `.tgz`. Assumes extracted archive layout to look like:
     | some_dir/
     |           conf/
@@ -25,6 +73,9 @@ def spark_install(location, url, force_reinstall=False, silent=False, retries=5)
         force_reinstall (optional bool): If set, reinstalls Spark if it is found. Otherwise, we skip installation if Spark is found.
         silent (optional bool): If set, prints less info.
         retries (optional int): Number of retries to use when downloading, extracting.
+        stream (optional bool): If set, extracts the archive while downloading it, without storing the archive on disk. Otherwise, downloads the archive to a temporary directory first.
+        streams (optional int): Number of concurrent connections to download the archive with. Ignored if `stream` is set.
+        manifest (optional str): If set, records the installation in the manifest at this path (see `manifest_update`).
     Returns:
         `True` on success, `False` on failure.'''
     location = os.path.expanduser(location)
@@ -33,37 +84,74 @@ def spark_install(location, url, force_reinstall=False, silent=False, retries=5)
             print('Existing Spark installation detected. Skipping installation.')
         return True
 
+    manifest_update(manifest, 'spark', None)
     rm(location, ignore_errors=True)
     mkdir(location)
     if not silent:
         print('Installing Spark in {}...'.format(location))
+    if stream:
+        return _spark_stream(url, location, silent=silent, retries=retries, manifest=manifest)
 
     with tempfile.TemporaryDirectory() as tmpdir: # We use a tempfile to store the downloaded zip.
         archiveloc = join(tmpdir, 'spark.tgz')
-        for x in range(retries):
-            try:
-                rm(archiveloc, ignore_errors=True)
-                if not silent:
-                    print('Fetching spark from {}'.format(url))
-                urllib.request.urlretrieve(url, archiveloc)
-                break
-            except Exception as e:
-                if x == 0:
-                    printe('Could not download Spark. Retrying...')
-                elif x == 4:
-                    printe('Could not download Spark: ', e)
-                    return False
         try:
-            extractloc = join(tmpdir, 'extracted')
-            mkdir(extractloc, exist_ok=True)
-            unpack(archiveloc, extractloc)
+            if not silent:
+                print('Fetching spark from {}'.format(url))
+            size, seconds = download(url, archiveloc, streams=streams, retries=retries) # Resumes failed chunks, instead of starting over.
+            if not silent:
+                print('Fetched spark ({})'.format(throughput(size, seconds)))
+        except Exception as e:
+            printe('Could not download Spark: {}'.format(e))
+            return False
+        if not _spark_extract(archiveloc, location, tmpdir, silent=silent):
+            return False
+        _spark_record(manifest, location, url, file_sha512(archiveloc))
+        return True
+
+
+def spark_install_archive(location, archive, force_reinstall=False, silent=False, manifest=None, url=None):
+    '''Installs Spark from an archive that is already present on this node (e.g. pushed by the controller). The archive is removed afterwards.
+    Args:
+        location (str): The location where final output will be available on success.
+        archive (str): Path to Spark archive on this node.
+        force_reinstall (optional bool): If set, reinstalls Spark if it is found. Otherwise, we skip installation if Spark is found.
+        silent (optional bool): If set, prints less info.
+        manifest (optional str): If set, records the installation in the manifest at this path (see `manifest_update`).
+        url (optional str): URL the archive was originally downloaded from, to record in the manifest.
+    Returns:
+        `True` on success, `False` on failure.'''
+    location = os.path.expanduser(location)
+    archive = os.path.expanduser(archive)
+    try:
+        if _is_installed(location) and not force_reinstall: # Already installed
+            if not silent:
+                print('Existing Spark installation detected. Skipping installation.')
+            return True
+        if not isfile(archive):
+            printe('Could not find Spark archive at {}.'.format(archive))
+            return False
 
-            extracted_dir = next(ls(extractloc, only_dirs=True, full_paths=True)) # find out what the extracted directory is called. There will be only 1 extracted directory.
-            for x in ls(extracted_dir, full_paths=True): # Move every file and directory to the final location.
-                mv(x, location)
+        manifest_update(manifest, 'spark', None)
+        rm(location, ignore_errors=True)
+        mkdir(location)
+        if not silent:
+            print('Installing Spark in {}...'.format(location))
+        sha512 = file_sha512(archive) if manifest else None
+        if tarfile.is_tarfile(archive): # Extract directly into `location`, without a temporary copy.
+            try:
+                stream_extract_file(archive, location)
+            except Exception as e:
+                printe('Could not extract zip file correctly: {}'.format(e))
+                rm(location, ignore_errors=True)
+                return False
             if not silent:
                 prints('Spark installation completed.')
+            _spark_record(manifest, location, url, sha512)
             return True
-        except Exception as e:
-            printe('Could not extract zip file correctly: ', e)
-            return False
\ No newline at end of file
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if not _spark_extract(archive, location, tmpdir, silent=silent):
+                return False
+        _spark_record(manifest, location, url, sha512)
+        return True
+    finally:
+        rm(archive, ignore_errors=True)
\ No newline at end of file
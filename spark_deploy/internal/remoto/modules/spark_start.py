@@ -1,6 +1,9 @@
+import json
 import os
+import socket
 import subprocess
 import time
+import urllib.request
 
 
 def java_home_available():
@@ -11,9 +14,203 @@ def java_home():
     return os.getenv('JAVA_HOME')
 
 
-def start_master(sparkloc, host, host_webui, port=7077, webui_port=8080, use_sudo=False, silent=False, retries=5, retries_sleep=5):
-    '''Boots master on given node.
-    Note: Spark works with Daemons, so expect to return quickly, probably even before the worker is actually ready.
+def _backoff(attempt, maximum, initial=0.1):
+    '''Returns the number of seconds to sleep before the next try, doubling every attempt, up to `maximum`.'''
+    return min(maximum, initial * 2**attempt)
+
+
+def _probe_host(host):
+    '''Returns the address to probe a service listening on given host. Services listening on all interfaces are probed locally.'''
+    return '127.0.0.1' if host in ('0.0.0.0', '', '::') else host
+
+
+def wait_port(host, port, timeout=60, maximum_sleep=2):
+    '''Waits until a TCP port accepts connections, with exponential backoff between probes.
+    Args:
+        host (str): IP/hostname to connect to.
+        port (int): Port to connect to.
+        timeout (optional int): Maximal number of seconds to wait.
+        maximum_sleep (optional int): Maximal number of seconds between probes.
+
+    Returns:
+        `True` if the port accepts connections before the deadline, `False` otherwise.'''
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError as e:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(min(_backoff(attempt, maximum_sleep), max(0, deadline - time.monotonic())))
+        attempt += 1
+
+
+def master_status(host, webui_port, timeout=5):
+    '''Fetches the status of a Spark master from its JSON endpoint.
+    Returns:
+        `dict` with master status on success, `None` otherwise.'''
+    try:
+        with urllib.request.urlopen('http://{}:{}/json/'.format(_probe_host(host), webui_port), timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except Exception as e:
+        return None
+
+
+def alive_workers(host, webui_port):
+    '''Returns the ids of all alive workers registered at the master, or `None` if the master is unreachable.'''
+    status = master_status(host, webui_port)
+    if status == None:
+        return None
+    return [x.get('id') for x in status.get('workers', []) if x.get('state') == 'ALIVE']
+
+
+def wait_new_workers(host, webui_port, known, expected, timeout=60, maximum_sleep=2):
+    '''Waits until given number of workers registered at the master, by polling the master's JSON status endpoint with exponential backoff.
+    Only counts workers with ids not in `known`. Restarted workers register with a new id, so this also detects workers re-registering after a restart.
+    Args:
+        host (str): IP/hostname the master listens on.
+        webui_port (int): Port of the master webUI.
+        known (list(str)): Ids of workers to ignore.
+        expected (int): Number of new workers we expect to be alive.
+        timeout (optional int): Maximal number of seconds to wait.
+        maximum_sleep (optional int): Maximal number of seconds between polls.
+
+    Returns:
+        `(ok, alive)`: `ok` is `True` if at least `expected` new workers are alive before the deadline. `alive` is the last observed number of new alive workers.'''
+    known = set(known)
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    alive = 0
+    while True:
+        ids = alive_workers(host, webui_port)
+        if ids != None:
+            alive = len([x for x in ids if not x in known])
+            if alive >= expected:
+                return True, alive
+        if time.monotonic() >= deadline:
+            return False, alive
+        time.sleep(min(_backoff(attempt, maximum_sleep), max(0, deadline - time.monotonic())))
+        attempt += 1
+
+
+def wait_workers(host, webui_port, expected, timeout=60, maximum_sleep=2):
+    '''Waits until given number of workers registered at the master. See `wait_new_workers`.
+    Returns:
+        `(ok, alive)`: `ok` is `True` if at least `expected` workers are alive before the deadline. `alive` is the last observed number of alive workers.'''
+    return wait_new_workers(host, webui_port, [], expected, timeout, maximum_sleep)
+
+
+def _block_device(device):
+    '''Returns the sysfs directory of the whole disk holding given device (e.g. "/dev/nvme0n1p1"), or `None` if unknown.'''
+    sysloc = os.path.realpath(join('/sys/class/block', os.path.basename(os.path.realpath(device))))
+    if not isdir(sysloc):
+        return None
+    return os.path.dirname(sysloc) if isfile(join(sysloc, 'partition')) else sysloc
+
+
+def _mount_disk(device, mountpoint):
+    '''Returns the sysfs directory of the whole disk holding a mounted filesystem, or `None` if unknown.
+    Devices without a sysfs entry (e.g. "/dev/root") are looked up by the device number of the mountpoint.'''
+    found = _block_device(device)
+    if found != None:
+        return found
+    try:
+        dev = os.stat(mountpoint).st_dev
+    except OSError as e:
+        return None
+    sysloc = os.path.realpath('/sys/dev/block/{}:{}'.format(os.major(dev), os.minor(dev)))
+    if not isdir(sysloc):
+        return None
+    return os.path.dirname(sysloc) if isfile(join(sysloc, 'partition')) else sysloc
+
+
+def _disk_speed_class(device):
+    '''Returns the speed class of the disk holding given device: 0 for NVMe, 1 for other non-rotational disks, 2 for rotational or unknown disks.'''
+    sysloc = _block_device(device)
+    if sysloc == None:
+        return 2
+    if os.path.basename(sysloc).startswith('nvme'):
+        return 0
+    try:
+        with open(join(sysloc, 'queue', 'rotational'), 'r') as f:
+            return 2 if f.read().strip() == '1' else 1
+    except OSError as e:
+        return 2
+
+
+def detect_resources():
+    '''Detects the resources of this node.
+    Returns:
+        `dict` with "cpus" (usable cores), "memory" (total memory in megabytes, or `None` if unknown),
+        and "disks" (`list` of `(mountpoint, speed_class)` for writable local disks other than the root disk, see `_disk_speed_class`).'''
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    memory = None
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    memory = int(line.split()[1]) // 1024
+                    break
+    except (OSError, ValueError) as e:
+        pass
+
+    disks = []
+    try:
+        with open('/proc/mounts', 'r') as f:
+            mounts = [x.split() for x in f if len(x.split()) >= 4]
+    except OSError as e:
+        mounts = []
+    # We compare whole disks, not partitions: another partition of the root disk shares its bandwidth, so it is no separate spill disk.
+    seen = set(_mount_disk(x[0], x[1]) or x[0] for x in mounts if x[1] == '/' or x[1].startswith('/boot'))
+    for mount in sorted(mounts, key=lambda x: len(x[1])):
+        device, mountpoint, options = mount[0], mount[1], mount[3].split(',')
+        if not device.startswith('/dev/') or device.startswith('/dev/loop') or 'ro' in options:
+            continue
+        if '\\' in mountpoint or ',' in mountpoint: # Escaped whitespace and commas cannot be used in SPARK_LOCAL_DIRS.
+            continue
+        disk = _mount_disk(device, mountpoint) or device
+        if disk in seen:
+            continue
+        seen.add(disk)
+        disks.append((mountpoint, _disk_speed_class(device)))
+    return {'cpus': cpus, 'memory': memory, 'disks': disks}
+
+
+def size_worker(resources, reserved_cores=1, reserved_memory=2048, memory_fraction=0.8):
+    '''Computes worker resources from detected node resources.
+    Args:
+        resources (dict): Node resources, as returned by `detect_resources`.
+        reserved_cores (optional int): Number of cores we leave for the OS and other services.
+        reserved_memory (optional int): Number of megabytes we leave at least for the OS page cache and other services.
+        memory_fraction (optional float): Maximal fraction of total memory we give to the worker.
+
+    Returns:
+        `(cores, memory_mb, local_dirs)`. `cores` and `memory_mb` are `None` if unknown, and `memory_mb` is `None` if the node has no memory left after `reserved_memory`. `local_dirs` contains a spill directory on each of the fastest available local disks (NVMe first), and is empty if there are none.'''
+    cores = max(1, resources['cpus'] - reserved_cores) if resources['cpus'] else None
+    memory_mb = None
+    if resources['memory'] and resources['memory'] > reserved_memory: # Otherwise, we cannot honour the reservation, and keep the Spark default.
+        memory_mb = min(int(resources['memory'] * memory_fraction), resources['memory'] - reserved_memory)
+        memory_mb = memory_mb if memory_mb > 0 else None
+    local_dirs = []
+    if any(resources['disks']):
+        fastest = min(x[1] for x in resources['disks']) # Spark spreads spills round-robin over all dirs, so a single slow disk would slow down every spill.
+        for mountpoint, speed_class in resources['disks']:
+            if speed_class != fastest:
+                continue
+            local_dir = join(mountpoint, 'spark_local')
+            try:
+                mkdir(local_dir, exist_ok=True)
+                local_dirs.append(local_dir)
+            except OSError as e:
+                pass
+    return cores, memory_mb, local_dirs
+
+
+def start_master(sparkloc, host, host_webui, port=7077, webui_port=8080, use_sudo=False, silent=False, retries=5, retries_sleep=5, ready_timeout=60):
+    '''Boots master on given node, and waits until its RPC and webUI ports accept connections.
 
     Args:
         sparkloc (str): Location in which Spark is installed.
@@ -27,7 +224,8 @@ def start_master(sparkloc, host, host_webui, port=7077, webui_port=8080, use_sud
         use_sudo (optional bool): If set, uses sudo when starting.
         silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
         retries (optional int): Number of tries we try to connect to the master.
-        retries_sleep (optional int): Number of seconds we sleep between tries.
+        retries_sleep (optional int): Maximal number of seconds we sleep between tries. Sleep time starts small, and doubles every try.
+        ready_timeout (optional int): Maximal number of seconds we wait for the master ports to accept connections, after booting the master.
 
     Returns:
         `(True, master_url)` on success, `(False, None)` otherwise.'''
@@ -59,6 +257,9 @@ def start_master(sparkloc, host, host_webui, port=7077, webui_port=8080, use_sud
     for x in range(retries):
         try:
             output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True).decode('utf-8').strip()
+            if not (wait_port(_probe_host(host), port, timeout=ready_timeout) and wait_port(_probe_host(host), webui_port, timeout=ready_timeout)):
+                printe('Master did not open ports {} and {} within {} seconds.'.format(port, webui_port, ready_timeout))
+                return False, None
             printc('MASTER ready on {} (webui address: http://{}:{})'.format(master_url, host_webui, webui_port), Color.CAN)
             return True, master_url
         except subprocess.CalledProcessError as e:
@@ -67,13 +268,13 @@ def start_master(sparkloc, host, host_webui, port=7077, webui_port=8080, use_sud
                 stop_all(sparkloc, workdir=None, use_sudo=use_sudo, silent=True, retries=retries, retries_sleep=retries_sleep)
                 continue
             if x == 0:
-                printw('Could not boot master (exitcode={}): {}'.format(e.exitcode, stdout))
-        time.sleep(retries_sleep)
+                printw('Could not boot master (exitcode={}): {}'.format(e.returncode, stdout))
+        time.sleep(_backoff(x, retries_sleep))
     printe('Could not boot master.')
     return False, None
 
 
-def start_worker(sparkloc, workdir, master_node, master_port=7077, use_sudo=False, silent=False, retries=5, retries_sleep=5):
+def start_worker(sparkloc, workdir, master_node, master_port=7077, use_sudo=False, silent=False, retries=5, retries_sleep=5, autosize=None):
     '''Boots a worker.
     Note: Spark works with Daemons, so expect to return quickly, probably even before the worker is actually ready.
 
@@ -85,7 +286,9 @@ def start_worker(sparkloc, workdir, master_node, master_port=7077, use_sudo=Fals
         use_sudo (optional bool): If set, uses sudo when starting.
         silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
         retries (optional int): Number of tries we try to connect to the master.
-        retries_sleep (optional int): Number of seconds we sleep between tries.
+        retries_sleep (optional int): Maximal number of seconds we sleep between tries. Sleep time starts small, and doubles every try.
+        autosize (optional dict): If set, sizes the worker cores, memory and spill directories (`SPARK_LOCAL_DIRS`) to the resources of this node. Contains keyword arguments for `size_worker`.
+                                  Otherwise, Spark claims all cores and all memory minus 1GB.
 
     Returns:
         `True` on success, `False` otherwise.'''
@@ -111,11 +314,24 @@ def start_worker(sparkloc, workdir, master_node, master_port=7077, use_sudo=Fals
         return False
 
     master_url = 'spark://{}:{}'.format(master_node, master_port)
+    gc_tombstones(workdir)
 
     if not silent:
         print('Spawning worker')
 
-    cmd = '{} {} --work-dir {} {}'.format(scriptloc, master_url, workdir, '> /dev/null 2>&1' if silent else '')
+    cmd = '{} {} --work-dir {}'.format(scriptloc, master_url, workdir)
+    if autosize != None:
+        cores, memory_mb, local_dirs = size_worker(detect_resources(), **autosize)
+        if cores != None:
+            cmd += ' --cores {}'.format(cores)
+        if memory_mb != None:
+            cmd += ' --memory {}M'.format(memory_mb)
+        if any(local_dirs):
+            cmd = 'SPARK_LOCAL_DIRS={} {}'.format(','.join(local_dirs), cmd) # Placed in front, so sudo passes it on as well.
+        if not silent:
+            print('Sizing worker: cores={}, memory={}M, local dirs={}'.format(cores, memory_mb, ','.join(local_dirs) if any(local_dirs) else 'default'))
+    if silent:
+        cmd += ' > /dev/null 2>&1'
     if use_sudo:
         cmd = 'sudo '+cmd
     for x in range(retries):
@@ -132,7 +348,7 @@ def start_worker(sparkloc, workdir, master_node, master_port=7077, use_sudo=Fals
                 stop_all(sparkloc, workdir=workdir, use_sudo=use_sudo, silent=True, retries=retries, retries_sleep=retries_sleep)
                 continue
             if x == 0:
-                printw('Could not boot worker (exitcode={}): {}'.format(e.exitcode, stdout))
-        time.sleep(retries_sleep)
-    printe('Could not boot worker (failed {} times, {} sleeptime between executions)'.format(retries, retries_sleep))
+                printw('Could not boot worker (exitcode={}): {}'.format(e.returncode, stdout))
+        time.sleep(_backoff(x, retries_sleep))
+    printe('Could not boot worker (failed {} times, at most {} sleeptime between executions)'.format(retries, retries_sleep))
     return False
\ No newline at end of file
@@ -0,0 +1,61 @@
+'''Code in this file reports the state of a node: which Spark daemons run, what is installed, and how loaded the node is.'''
+
+import glob
+import os
+import re
+import time
+
+
+def _daemon_running(sparkloc, daemon):
+    '''Returns `True` if a Spark daemon of given class, belonging to the installation at `sparkloc`, runs on this node, according to its PID files and /proc.
+    We do not know which user started the daemon, so we look at the PID files of all users.'''
+    for pidfile in glob.glob(join(glob.escape(_pid_dir(sparkloc)), 'spark-*-{}-*.pid'.format(daemon))):
+        pid = _read_pid(pidfile)
+        if pid != None and _pid_alive(pid) and _pid_is_spark(pid, sparkloc):
+            return True
+    return False
+
+
+def _spark_version(sparkloc):
+    '''Returns the Spark version from the RELEASE file of an installation, or `None` if unknown.'''
+    try:
+        with open(join(sparkloc, 'RELEASE'), 'r') as f:
+            found = re.search(r'Spark (\S+)', f.read())
+            return found.group(1) if found else None
+    except OSError as e:
+        return None
+
+
+def _meminfo():
+    '''Returns `(total, available)` memory in bytes, or `(None, None)` if /proc/meminfo is unreadable.'''
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            info = {x.split(':')[0]: int(x.split()[1])*1024 for x in f if len(x.split()) >= 2}
+        return info.get('MemTotal'), info.get('MemAvailable')
+    except (OSError, ValueError) as e:
+        return None, None
+
+
+def node_status(sparkloc, manifest=None):
+    '''Reports the state of this node.
+    Args:
+        sparkloc (str): Location in which Spark is installed.
+        manifest (optional str): Path to the install manifest.
+
+    Returns:
+        `dict` with the node state. Memory values are in bytes.'''
+    sparkloc = os.path.expanduser(sparkloc)
+    installed = manifest_read(manifest) if manifest else dict()
+    memory_total, memory_available = _meminfo()
+    return {
+        'spark_installed': isdir(sparkloc),
+        'spark_version': _spark_version(sparkloc),
+        'java_version': installed.get('java', dict()).get('version'),
+        'java_home': installed.get('java', dict()).get('java_home'),
+        'master_running': _daemon_running(sparkloc, 'org.apache.spark.deploy.master.Master'),
+        'worker_running': _daemon_running(sparkloc, 'org.apache.spark.deploy.worker.Worker'),
+        'cpus': os.cpu_count(),
+        'load': list(os.getloadavg()),
+        'memory_total': memory_total,
+        'memory_available': memory_available,
+    }
\ No newline at end of file
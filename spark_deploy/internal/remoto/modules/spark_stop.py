@@ -1,5 +1,10 @@
+import concurrent.futures
+import getpass
+import glob
 import os
 import re
+import shutil
+import signal
 import subprocess
 import sys
 import time
@@ -29,11 +34,11 @@ def _terminate_daemon(scriptloc, use_sudo, silent, retries, retries_sleep):
     return False
 
 
-def _terminate_daemons(sparkloc, use_sudo, silent, retries, retries_sleep):
+def _terminate_daemons(sparkloc, use_sudo, silent, retries, retries_sleep, master=True):
     if not isdir(sparkloc):
         printw('Could not find Spark installation at {}. We presume no daemons are running.'.format(sparkloc))
         return True
-    scripts = [join(sparkloc, 'sbin', 'stop-master.sh')]
+    scripts = [join(sparkloc, 'sbin', 'stop-master.sh')] if master else []
     if isfile(join(sparkloc, 'sbin', 'stop-worker.sh')): # We run Spark 3.1.1 or newer.
         scripts.append(join(sparkloc, 'sbin', 'stop-worker.sh'))
     elif isfile(join(sparkloc, 'sbin', 'stop-slave.sh')): # We run Spark 3.0.2 or older.
@@ -41,32 +46,217 @@ def _terminate_daemons(sparkloc, use_sudo, silent, retries, retries_sleep):
     else:
         printw('Could not find script at "{}", nor at "{}". Did Spark not install successfully?'.format(join(sparkloc, 'sbin', 'stop-worker.sh'), join(sparkloc, 'sbin', 'stop-slave.sh')))
         return False
-    return all(_terminate_daemon(x, use_sudo, silent, retries, retries_sleep) for x in scripts)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(scripts)) as executor:
+        return all(executor.map(lambda x: _terminate_daemon(x, use_sudo, silent, retries, retries_sleep), scripts))
 
 
-def stop_all(sparkloc, workdir=None, use_sudo=False, silent=False, retries=5, retries_sleep=5):
-    '''Stops all Spark daemons on current node. Cleans up workdir location too, if `workdir` given.
-    Args:
-        sparkloc (str): Location in which Spark is installed.
-        workdir (optional str): Workdir location. If set, deletes given location.
-        use_sudo (optional bool): If set, uses sudo when stopping.
-        silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
-        retries (optional int): Number of tries we try to connect to the master.
-        retries_sleep (optional int): Number of seconds we sleep between tries.
+def _spark_env(sparkloc, name):
+    '''Returns the value of a variable Spark daemons see, from our environment or "conf/spark-env.sh", or `None` if it is not set.'''
+    if os.getenv(name):
+        return os.getenv(name)
+    try:
+        with open(join(sparkloc, 'conf', 'spark-env.sh'), 'r') as f:
+            found = re.findall(r'^\s*(?:export\s+)?{}=["\']?([^"\'\s]+)'.format(name), f.read(), re.MULTILINE)
+            if found:
+                return os.path.expanduser(found[-1])
+    except OSError as e:
+        pass
+    return None
+
+
+def _pid_dir(sparkloc):
+    '''Returns the directory Spark daemons write their PID files to. Like Spark's daemon script, we use `SPARK_PID_DIR` (possibly set in "conf/spark-env.sh"), or "/tmp".'''
+    return _spark_env(sparkloc, 'SPARK_PID_DIR') or '/tmp'
+
+
+def _pid_idents(sparkloc, use_sudo):
+    '''Returns the ident strings Spark's daemon script puts in PID filenames: `SPARK_IDENT_STRING`, or the user starting the daemon.'''
+    ident = _spark_env(sparkloc, 'SPARK_IDENT_STRING')
+    if ident:
+        return [ident]
+    idents = [os.getenv('USER') or getpass.getuser()]
+    if use_sudo: # Daemons started with sudo run as root.
+        idents.append('root')
+    return idents
+
+
+def _pid_files(sparkloc, use_sudo, master=True):
+    '''Returns all Spark worker PID files, and master PID files if `master` is set.
+    The PID dir (often "/tmp") is shared by all users and Spark installations on a node, so we only match the names Spark's daemon script writes for our user.'''
+    piddir = _pid_dir(sparkloc)
+    daemons = ('org.apache.spark.deploy.master.Master', 'org.apache.spark.deploy.worker.Worker') if master else ('org.apache.spark.deploy.worker.Worker',)
+    found = []
+    for ident in _pid_idents(sparkloc, use_sudo):
+        for daemon in daemons:
+            prefix = 'spark-{}-{}-'.format(ident, daemon)
+            found += [x for x in glob.glob(join(glob.escape(piddir), glob.escape(prefix)+'*.pid')) if re.fullmatch(r'[0-9]+\.pid', os.path.basename(x)[len(prefix):])]
+    return found
+
+
+def _read_pid(pidfile):
+    '''Returns the PID stored in given file, or `None` if the file is unreadable.'''
+    try:
+        with open(pidfile, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError) as e:
+        return None
 
+
+def _pid_alive(pid):
+    '''Returns `True` if the process with given PID exists and is not a zombie, according to /proc.'''
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z' # Process names may contain spaces and parentheses, so we split after the last ')'.
+    except (OSError, IndexError) as e:
+        return False
+
+
+def _pid_is_spark(pid, sparkloc):
+    '''Returns `True` if the process with given PID runs a Spark daemon of the installation at `sparkloc`.
+    Protects against PID files pointing to reused PIDs, and against signalling daemons of other Spark installations.'''
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            cmdline = f.read()
+    except OSError as e:
+        return False
+    if not b'org.apache.spark.deploy.' in cmdline:
+        return False
+    locations = set(os.path.join(x, '').encode('utf-8') for x in (os.path.abspath(sparkloc), os.path.realpath(sparkloc))) # The daemon classpath contains "<sparkloc>/jars/*".
+    return any(x in cmdline for x in locations)
+
+
+def _signal(pid, sig, use_sudo):
+    '''Sends a signal to a process, using sudo if we are not allowed to signal it ourselves and `use_sudo` is set.'''
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError as e:
+        pass
+    except PermissionError as e:
+        if use_sudo:
+            subprocess.call(['sudo', 'kill', '-{}'.format(int(sig)), str(pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait_exit(pids, deadline):
+    '''Waits until all given processes exited, or the deadline passed.
     Returns:
-        `True` on success, `False` otherwise.'''
+        `list` of PIDs still alive.'''
+    sleeptime = 0.05
+    while True:
+        pids = [x for x in pids if _pid_alive(x)]
+        if not pids or time.monotonic() >= deadline:
+            return pids
+        time.sleep(min(sleeptime, max(0, deadline - time.monotonic())))
+        sleeptime = min(1, sleeptime*2)
+
+
+def _terminate_daemons_fast(sparkloc, use_sudo, silent, timeout, master=True):
+    '''Stops all Spark daemons by signalling the JVMs from their PID files directly, without Spark's stop scripts.
+    All daemons receive SIGTERM at the same time. Daemons still alive after `timeout` seconds receive SIGKILL.
+    Returns:
+        `True` if all daemons exited, `False` otherwise.'''
+    pidfiles = {x: _read_pid(x) for x in _pid_files(sparkloc, use_sudo, master=master)}
+    pidfiles = {x: pid for x, pid in pidfiles.items() if pid == None or not _pid_alive(pid) or _pid_is_spark(pid, sparkloc)} # Daemons of other Spark installations keep running, and keep their PID files.
+    pids = [pid for pid in pidfiles.values() if pid != None and _pid_alive(pid)]
+    if pids:
+        for pid in pids:
+            _signal(pid, signal.SIGTERM, use_sudo)
+        survivors = _wait_exit(pids, time.monotonic() + timeout)
+        if survivors:
+            if not silent:
+                printw('{} daemon(s) did not exit within {} seconds. Killing...'.format(len(survivors), timeout))
+            for pid in survivors:
+                _signal(pid, signal.SIGKILL, use_sudo)
+            survivors = _wait_exit(survivors, time.monotonic() + 5)
+            if survivors:
+                printe('Could not kill Spark daemons with PIDs: {}'.format(', '.join(str(x) for x in survivors)))
+                return False
+    for pidfile in pidfiles.keys(): # Like Spark's stop scripts, we remove PID files of stopped (or no longer existing) daemons.
+        try:
+            os.remove(pidfile)
+        except OSError as e:
+            if use_sudo:
+                subprocess.call(['sudo', 'rm', '-f', pidfile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return True
+
+
+def _delete_detached(paths):
+    '''Deletes given paths in a detached process with idle I/O priority and lowest CPU priority. Returns immediately.'''
+    cmd = ['nice', '-n', '19', 'rm', '-rf', '--'] + list(paths)
+    if shutil.which('ionice'):
+        cmd = ['ionice', '-c', '3'] + cmd
+    subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
+
+
+def _tombstones(workdir):
+    '''Returns all tombstones of given workdir.'''
+    return glob.glob(glob.escape(workdir.rstrip(os.sep))+'.tombstone-*')
+
+
+def remove_async(workdir):
+    '''Atomically renames a workdir to a tombstone next to it, and deletes the tombstone in a detached background process.
+    The workdir location can be reused immediately.
+    Returns:
+        `True` on success, `False` if we could not rename the workdir.'''
+    workdir = workdir.rstrip(os.sep)
+    if not os.path.lexists(workdir):
+        return True
+    tombstone = '{}.tombstone-{}-{}'.format(workdir, time.time_ns(), os.getpid())
+    try:
+        os.rename(workdir, tombstone)
+    except OSError as e:
+        return False
+    _delete_detached([tombstone])
+    return True
+
+
+def gc_tombstones(workdir):
+    '''Deletes tombstones of given workdir left behind by earlier background deletes (e.g. interrupted by a reboot), in a detached background process.'''
+    found = _tombstones(os.path.expanduser(workdir))
+    if found:
+        _delete_detached(found)
+
+
+def _stop(sparkloc, workdir, master, use_sudo, silent, retries, retries_sleep, fast, stop_timeout, async_cleanup):
     sparkloc = os.path.expanduser(sparkloc)
     workdir = os.path.expanduser(workdir) if workdir else None
     if not silent:
         print('Terminating daemons...')
-    if not _terminate_daemons(sparkloc, use_sudo, silent, retries, retries_sleep):
+    if fast:
+        if not _terminate_daemons_fast(sparkloc, use_sudo, silent, stop_timeout, master=master):
+            return False
+    elif not _terminate_daemons(sparkloc, use_sudo, silent, retries, retries_sleep, master=master):
         return False
 
     if workdir:
         if not silent:
             print('Cleaning workdir...')
-        rm(workdir, ignore_errors=True)
+        if not (async_cleanup and remove_async(workdir)):
+            rm(workdir, ignore_errors=True)
     if not silent:
         prints('All daemons terminated.')
-    return True
\ No newline at end of file
+    return True
+
+
+def stop_worker(sparkloc, workdir=None, use_sudo=False, silent=False, retries=5, retries_sleep=5, fast=False, stop_timeout=10, async_cleanup=False):
+    '''Stops the Spark worker daemon on current node, leaving any master running. Arguments are the same as for `stop_all`.
+    Returns:
+        `True` on success, `False` otherwise.'''
+    return _stop(sparkloc, workdir, False, use_sudo, silent, retries, retries_sleep, fast, stop_timeout, async_cleanup)
+
+
+def stop_all(sparkloc, workdir=None, use_sudo=False, silent=False, retries=5, retries_sleep=5, fast=False, stop_timeout=10, async_cleanup=False):
+    '''Stops all Spark daemons on current node. Cleans up workdir location too, if `workdir` given.
+    Args:
+        sparkloc (str): Location in which Spark is installed.
+        workdir (optional str): Workdir location. If set, deletes given location.
+        use_sudo (optional bool): If set, uses sudo when stopping.
+        silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
+        retries (optional int): Number of tries we try to connect to the master.
+        retries_sleep (optional int): Number of seconds we sleep between tries.
+        fast (optional bool): If set, signals daemons from their PID files directly, instead of using Spark's stop scripts. `retries` and `retries_sleep` are ignored.
+        stop_timeout (optional int): Number of seconds daemons get to exit after SIGTERM in `fast` mode, before we send SIGKILL.
+        async_cleanup (optional bool): If set, renames `workdir` to a tombstone and deletes it in a detached, low-priority background process, instead of waiting for the delete.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    return _stop(sparkloc, workdir, True, use_sudo, silent, retries, retries_sleep, fast, stop_timeout, async_cleanup)
\ No newline at end of file
@@ -1,4 +1,11 @@
+import os
+import queue
+import re
+import shlex
+import signal
 import subprocess
+import threading
+import time
 
 
 def submit(run_cmd, cwd):
@@ -11,4 +18,202 @@ def submit(run_cmd, cwd):
         return True
     except subprocess.CalledProcessError as e:
         print('Could not submit application:\n\tExitcode: {}\n\tOutput: {}'.format(e.returncode, e.output.decode('utf-8')))
-        return False
\ No newline at end of file
+        return False
+
+
+def _pump_lines(stream, name, lines):
+    '''Puts every line of given stream in `lines`, followed by `(name, None)` on EOF. Blocks when `lines` is full, which in turn blocks the writing process.'''
+    for line in iter(stream.readline, b''):
+        lines.put((name, line.decode('utf-8', errors='replace').rstrip('\n')))
+    lines.put((name, None))
+
+
+def submit_stream(run_cmd, cwd, queue_size=1024, window=8, batch_size=256):
+    '''Runs spark-submit, and sends its output over the execnet channel while it arrives.
+    We send `('lines', [(stream, line), ...])` messages, with `stream` being "stdout" or "stderr". The caller must send 1 acknowledgement per message.
+    At most `window` messages are unacknowledged. Beyond that, we stop reading output, and spark-submit blocks when writing more than `queue_size` lines.
+    This way, remote memory use stays bounded, no matter how slow the caller is.
+    Args:
+        run_cmd (str): Command to run.
+        cwd (str): Directory to run command in.
+        queue_size (optional int): Maximal number of lines we buffer.
+        window (optional int): Maximal number of unacknowledged messages.
+        batch_size (optional int): Maximal number of lines per message.
+
+    Returns:
+        `('exit', exitcode)` when spark-submit exits.'''
+    env = Environment()
+    env.load_to_env()
+
+    proc = subprocess.Popen(run_cmd, shell=True, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = queue.Queue(maxsize=queue_size)
+    for stream, name in ((proc.stdout, 'stdout'), (proc.stderr, 'stderr')):
+        threading.Thread(target=_pump_lines, args=(stream, name, lines), daemon=True).start()
+
+    open_streams = 2
+    unacknowledged = 0
+    while open_streams > 0:
+        batch = [lines.get()]
+        while len(batch) < batch_size: # Sends all lines available right now in 1 message.
+            try:
+                batch.append(lines.get_nowait())
+            except queue.Empty as e:
+                break
+        open_streams -= len([x for x in batch if x[1] == None])
+        batch = [x for x in batch if x[1] != None]
+        if any(batch):
+            if unacknowledged >= window:
+                channel.receive()
+                unacknowledged -= 1
+            channel.send(('lines', batch))
+            unacknowledged += 1
+    exitcode = proc.wait()
+    for x in range(unacknowledged): # Consumes all acknowledgements, so they do not end up as next call on this channel.
+        channel.receive()
+    return ('exit', exitcode)
+
+
+def _proc_starttime(pid):
+    '''Returns the start time of a live (non-zombie) process from /proc, or `None` if there is no such process.'''
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split() # The process name may contain spaces and parentheses.
+        return None if fields[0] == 'Z' else fields[19]
+    except (OSError, IndexError) as e:
+        return None
+
+
+def _job_read(job_dir, name):
+    try:
+        with open(join(job_dir, name), 'r') as f:
+            return f.read().strip()
+    except OSError as e:
+        return None
+
+
+def submit_detached(run_cmd, cwd, job_dir):
+    '''Launches spark-submit in a new session, detached from this connection. Output goes to "<job_dir>/log". On exit, we write the exitcode to "<job_dir>/exitcode".
+    Args:
+        run_cmd (str): Command to run.
+        cwd (str): Directory to run command in.
+        job_dir (str): Directory to store job state in. Must not exist yet.
+
+    Returns:
+        `(pid, log_path)` on success, `(None, None)` otherwise. `pid` is the process group leader of the job.'''
+    env = Environment()
+    env.load_to_env()
+    job_dir = os.path.abspath(os.path.expanduser(job_dir))
+    try:
+        mkdir(job_dir)
+        exitcode_path = join(job_dir, 'exitcode')
+        wrapped = '{}\necho $? > {} && mv {} {}'.format(run_cmd, shlex.quote(exitcode_path+'.tmp'), shlex.quote(exitcode_path+'.tmp'), shlex.quote(exitcode_path))
+        with open(join(job_dir, 'log'), 'wb') as log:
+            # A new session has no controlling terminal, so the job survives the end of this connection without nohup.
+            proc = subprocess.Popen(['sh', '-c', wrapped], cwd=os.path.expanduser(cwd), stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        with open(join(job_dir, 'pid'), 'w') as f:
+            f.write('{} {}'.format(proc.pid, _proc_starttime(proc.pid)))
+        return proc.pid, join(job_dir, 'log')
+    except OSError as e:
+        printe('Could not launch detached job: {}'.format(e))
+        return None, None
+
+
+def _job_pid(job_dir):
+    '''Returns the pid of a job if its process still runs, `None` otherwise. We compare process start times, so reused pids do not count.'''
+    content = _job_read(job_dir, 'pid')
+    if not content:
+        return None
+    pid, starttime = content.split()
+    return int(pid) if _proc_starttime(int(pid)) == starttime else None
+
+
+def job_poll(job_dir):
+    '''Reports the state of a detached job.
+    Returns:
+        `dict` with "state" ("running", "finished", "killed", or "lost" if the job vanished without an exitcode), "exitcode" (`int` or `None`),
+        and "submission_id" (the driver id Spark printed in cluster deploy mode, or `None`).'''
+    job_dir = os.path.expanduser(job_dir)
+    exitcode = _job_read(job_dir, 'exitcode')
+    if exitcode == None and _job_pid(job_dir) != None:
+        state = 'running'
+    elif _job_read(job_dir, 'killed') != None:
+        state = 'killed'
+    elif exitcode != None:
+        state = 'finished'
+    else:
+        state = 'lost'
+
+    submission_id = _job_read(job_dir, 'submission_id')
+    if submission_id == None:
+        try:
+            with open(join(job_dir, 'log'), 'r', errors='replace') as f:
+                found = re.search(r'(driver-\d{14}-\d{4})', f.read(1024*1024))
+            if found:
+                submission_id = found.group(1)
+                with open(join(job_dir, 'submission_id'), 'w') as f:
+                    f.write(submission_id)
+        except OSError as e:
+            pass
+    return {'state': state, 'exitcode': int(exitcode) if exitcode not in (None, '') else None, 'submission_id': submission_id}
+
+
+def job_tail(job_dir, lines=100, offset=None):
+    '''Reads output of a detached job.
+    Args:
+        job_dir (str): Job state directory.
+        lines (optional int): Number of last lines to return. Ignored when `offset` is set.
+        offset (optional int): If set, returns all output after this byte offset instead (e.g. to follow output).
+
+    Returns:
+        `(text, end_offset)`, with `end_offset` being the byte offset to pass next time to only get new output.'''
+    path = join(os.path.expanduser(job_dir), 'log')
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if offset != None:
+            f.seek(min(offset, end))
+            return f.read().decode('utf-8', errors='replace'), end
+        position = end
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines: # Reads backwards in blocks, so huge logs cost no more than the lines we return.
+            step = min(64*1024, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    text = data.decode('utf-8', errors='replace')
+    return '\n'.join(text.rstrip('\n').split('\n')[-lines:]) if lines > 0 else '', end
+
+
+def job_kill(job_dir, kill_cmd=None, timeout=10):
+    '''Stops a detached job. Sends SIGTERM to the process group of the job, and SIGKILL if it did not exit within `timeout` seconds.
+    Args:
+        job_dir (str): Job state directory.
+        kill_cmd (optional str): If set, command to run first (e.g. "spark-submit --kill <submission_id>", to stop a driver running in cluster deploy mode).
+        timeout (optional int): Number of seconds the job gets to exit.
+
+    Returns:
+        `True` if the job does not run anymore, `False` otherwise.'''
+    job_dir = os.path.expanduser(job_dir)
+    if kill_cmd:
+        env = Environment()
+        env.load_to_env()
+        subprocess.call(kill_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    pid = _job_pid(job_dir)
+    if pid == None:
+        return True
+    for sig, wait in ((signal.SIGTERM, timeout), (signal.SIGKILL, 5)):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError as e:
+            break
+        except PermissionError as e: # Job runs as another user (e.g. submitted with sudo).
+            subprocess.call(['sudo', '-n', 'kill', '-{}'.format(int(sig)), '--', '-{}'.format(pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline and _job_pid(job_dir) != None:
+            time.sleep(0.1)
+        if _job_pid(job_dir) == None:
+            break
+    if _job_pid(job_dir) != None:
+        return False
+    with open(join(job_dir, 'killed'), 'w') as f: # Only now we know the job is gone, and that it did not stop by itself.
+        f.write(str(time.time()))
+    return True
\ No newline at end of file
@@ -0,0 +1,85 @@
+'''In this file, we provide functions to extract archives while they stream in, without storing them on disk first.
+Every byte gets written to disk only once, directly in its final location. Peak disk usage equals the size of the extracted archive.'''
+
+import hashlib
+import os
+import tarfile
+import urllib.request
+
+
+def _strip_top(name):
+    '''Splits a member name into its top-level directory and the remainder.'''
+    if name.startswith('./'):
+        name = name[2:]
+    return name.lstrip('/').split('/', 1)
+
+
+def _strip_member(member):
+    '''Strips the top-level directory from an archive member, e.g. "spark-3.1.2-bin-hadoop2.7/bin/spark-submit" becomes "bin/spark-submit".
+    Returns:
+        Stripped member, or `None` if the member is the top-level directory itself, or if it points outside the extraction directory.'''
+    parts = _strip_top(member.name)
+    if len(parts) < 2 or not parts[1]:
+        return None
+    name = os.path.normpath(parts[1])
+    if os.path.isabs(name) or name == '..' or name.startswith('..'+os.sep):
+        return None
+    member.name = name
+    if member.islnk(): # Hardlinks point to other members, which we stripped as well.
+        link_parts = _strip_top(member.linkname)
+        if len(link_parts) < 2:
+            return None
+        member.linkname = os.path.normpath(link_parts[1])
+    return member
+
+
+def stream_extract(fileobj, location):
+    '''Extracts a (compressed) tar stream into given `location`, stripping the top-level directory of the archive. Assumes archive layout to look like:
+    | some_dir/
+    |           bin/
+    |           ...
+    The contents from `some_dir` are extracted to `location`.
+    Args:
+        fileobj (file-like): Readable stream of a `.tar`, `.tgz`, `.tar.gz`, `.tar.bz2` or `.tar.xz` archive. Need not be seekable.
+        location (str): Directory to extract to. Created if it does not exist.
+
+    Raises:
+        tarfile.TarError: When the stream is not a valid archive.
+        OSError: When we cannot read the stream, or write to `location`.'''
+    mkdir(location, exist_ok=True)
+    kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else dict() # Python 3.12+ warns when we do not pick a filter.
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive: # In stream mode, we must extract every member when we encounter it, as we cannot seek back.
+            member = _strip_member(member)
+            if member:
+                archive.extract(member, location, **kwargs)
+
+
+class _HashingReader(object):
+    '''Wraps a readable stream, hashing everything read from it.'''
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.hash = hashlib.sha512()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+
+def stream_extract_url(url, location, timeout=60):
+    '''Downloads an archive and extracts it while it streams in. See `stream_extract` for details.
+    Returns:
+        SHA-512 hexdigest of the downloaded archive.'''
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        reader = _HashingReader(response)
+        stream_extract(reader, location)
+        for chunk in iter(lambda: reader.read(1024*1024), b''): # Archives may contain padding after their last member.
+            pass
+        return reader.hash.hexdigest()
+
+
+def stream_extract_file(archive, location):
+    '''Extracts an archive on this node. Unlike `unpack`, needs no temporary extraction directory. See `stream_extract` for details.'''
+    with open(archive, 'rb') as f:
+        stream_extract(f, location)
\ No newline at end of file
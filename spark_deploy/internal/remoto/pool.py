@@ -0,0 +1,251 @@
+'''Pool of reusable remoto connections. Opening an execnet connection over ssh costs several seconds per node, so workflows should open every node only once.'''
+
+import contextlib
+import threading
+import time
+
+from spark_deploy.internal.remoto.ssh_wrapper import get_wrapper, close_wrappers, RemotoSSHWrapper
+import spark_deploy.internal.util.engine as engine
+from spark_deploy.internal.util.printer import *
+
+
+def default_ssh_params(key_path=None):
+    '''Returns a callable producing the ssh config options we use by default for a node.
+    Args:
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+
+    Returns:
+        Callable taking 1 `metareserve.Node` as argument, returning a `dict` with ssh config options.'''
+    ssh_kwargs = {'IdentitiesOnly': 'yes', 'StrictHostKeyChecking': 'no'}
+    if key_path:
+        ssh_kwargs['IdentityFile'] = key_path
+    def _params(node):
+        z = ssh_kwargs.copy()
+        z['User'] = node.extra_info['user']
+        return z
+    return _params
+
+
+def _freeze(ssh_params):
+    '''Converts ssh parameters to a hashable representation, usable as part of a dict key.'''
+    return tuple(sorted((str(k), str(v)) for k, v in ssh_params.items())) if ssh_params else None
+
+
+def is_healthy(wrapper):
+    '''Checks whether given wrapper still has a working connection to its remote.
+    Args:
+        wrapper (RemotoSSHWrapper): Wrapper to check.
+
+    Returns:
+        `True` if the remote responds, `False` otherwise.'''
+    if not wrapper or not wrapper.open:
+        return False
+    try:
+        if not wrapper.connection.has_connection():
+            return False
+        wrapper.connection.gateway.remote_status()
+        return True
+    except Exception as e:
+        return False
+
+
+class _PoolEntry(object):
+    '''Simple container for a pooled wrapper, the number of leases on it, and the last time it was released.'''
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self.retired = False # Set when the wrapper left the pool while leased. We close it once the last lease is released.
+
+
+class ConnectionPool(object):
+    '''Pool of `RemotoSSHWrapper` connections, keyed by node, hostname and ssh parameters.
+    Connections are opened on first use, health-checked on every reuse, and closed after being idle for too long.
+    Every handed out wrapper is leased until it is given back with `release`. Leased connections are never evicted, and count as idle only from their last release.
+    A "with" clause is supported to close all pooled connections on exit. Example:
+        with ConnectionPool(key_path='~/.ssh/key') as pool:
+            with pool.lease(reservation.nodes) as connectionwrappers:
+                install(reservation, connectionwrappers=connectionwrappers)
+                start(reservation, connectionwrappers=connectionwrappers)
+            ...
+    Note: Wrappers handed out by the pool belong to the pool. Do not close them yourself.'''
+    def __init__(self, key_path=None, hostname=lambda node: node.ip_public, ssh_params=None, max_idle=600, health_check=True, multiplex=False, silent=False):
+        '''Args:
+            key_path (optional str): Path to SSH key, which we use to connect to nodes. Ignored if `ssh_params` is set.
+            hostname (optional str, callable): Name to register connections to. Callables must take 1 node as argument, and output the hostname (`str`).
+            ssh_params (optional dict, callable): ssh config options to open connections with. Can be a callable taking 1 node as argument, outputting the options for that node.
+                                                  If `None`, uses the default options for nodes (see `default_ssh_params`).
+            max_idle (optional int): Number of seconds a connection may stay unused before it is closed. `None` means connections are never evicted.
+            health_check (optional bool): If set, checks whether a pooled connection is still alive before handing it out, and reconnects if it is not.
+            multiplex (optional bool): If set, every pooled connection opens an OpenSSH master connection, shared by all ssh sessions (remoto, rsync) to that node.
+            silent (optional bool): If set, connections are silent (except when reporting errors).'''
+        if not key_path and not ssh_params:
+            printw('Connections have no assigned ssh key. Prepare to fill in your password often.')
+        self._hostname = hostname
+        self._ssh_params = ssh_params if ssh_params else default_ssh_params(key_path)
+        self._max_idle = max_idle
+        self._health_check = health_check
+        self._multiplex = multiplex
+        self._silent = silent
+
+        self._entries = dict()
+        self._leased = dict() # Maps `id(wrapper)` to the entry of every leased wrapper, also of retired ones.
+        self._lock = threading.RLock()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+    def _key(self, node):
+        hostname = self._hostname(node) if callable(self._hostname) else self._hostname
+        ssh_params = self._ssh_params(node) if callable(self._ssh_params) else self._ssh_params
+        return (node, hostname, _freeze(ssh_params)), hostname, ssh_params
+
+
+    def _checkout(self, entry):
+        '''Leases the wrapper of given entry. Caller must hold the lock.'''
+        entry.leases += 1
+        self._leased[id(entry.wrapper)] = entry
+        return entry.wrapper
+
+
+    def _take(self, key):
+        '''Returns a usable pooled wrapper for given key, leased to the caller, or `None` if we have to build a new one. Unhealthy wrappers are removed from the pool.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            self._checkout(entry) # Holding a lease keeps other threads from evicting the wrapper while we check it.
+        if self._health_check and not is_healthy(entry.wrapper):
+            if not self._silent:
+                printw('Pooled connection to {} is no longer alive. Reconnecting...'.format(key[1]))
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                entry.retired = True
+            self.release(entry.wrapper)
+            return None
+        return entry.wrapper
+
+
+    def _put(self, key, wrapper):
+        '''Adds a freshly built wrapper to the pool, leased to the caller. If another thread was faster, closes the given wrapper and returns the pooled one.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                entry = _PoolEntry(wrapper)
+                self._entries[key] = entry
+                return self._checkout(entry)
+            wrapper_pooled = self._checkout(entry)
+        close_wrappers(wrapper)
+        return wrapper_pooled
+
+
+    def get_wrapper(self, node):
+        '''Gets a connection wrapper for given node, opening a connection only if we have no healthy one yet.
+        The wrapper is leased to the caller. Give it back with `release` when done, or use `lease`.
+        Args:
+            node (metareserve.Node): Node to get a connection for.
+
+        Returns:
+            `RemotoSSHWrapper` on success, `None` otherwise. Failed connections are not pooled.'''
+        self.evict_idle()
+        key, hostname, ssh_params = self._key(node)
+        wrapper = self._take(key)
+        if wrapper:
+            return wrapper
+        wrapper = get_wrapper(node, hostname, ssh_params=ssh_params, multiplex=self._multiplex, silent=self._silent)
+        if not wrapper.open:
+            close_wrappers(wrapper)
+            return None
+        return self._put(key, wrapper)
+
+
+    def get_wrappers(self, nodes, parallel=True):
+        '''Gets connection wrappers for multiple nodes at once. Missing connections are opened in parallel.
+        Args:
+            nodes (iterable of metareserve.Node): Nodes to get connections for.
+            parallel (optional bool): If set, opens missing connections in parallel. Otherwise, opens them sequentially.
+
+        Returns:
+            `dict(metareserve.Node, RemotoSSHWrapper)`, in the same format as `get_wrappers` in `ssh_wrapper`. Wrapper can be `None`, indicating failure to connect to key node.'''
+        nodes = list(nodes)
+        if not nodes:
+            return dict()
+        if parallel:
+            with engine.executor(len(nodes)) as executor:
+                futures_get_wrappers = {x: executor.submit(self.get_wrapper, x) for x in nodes}
+                return {k: v.result() for k, v in futures_get_wrappers.items()}
+        return {x: self.get_wrapper(x) for x in nodes}
+
+
+    def release(self, wrappers):
+        '''Gives leased wrappers back to the pool. From now on, a wrapper counts as idle if nobody else leases it.
+        Args:
+            wrappers (RemotoSSHWrapper, iterable(RemotoSSHWrapper), dict(metareserve.Node, RemotoSSHWrapper)): Wrapper(s) to release. `None` values are ignored.'''
+        if isinstance(wrappers, dict):
+            wrappers = wrappers.values()
+        elif wrappers == None or isinstance(wrappers, RemotoSSHWrapper):
+            wrappers = [wrappers]
+        to_close = []
+        with self._lock:
+            for wrapper in wrappers:
+                entry = self._leased.get(id(wrapper)) if wrapper != None else None
+                if entry == None:
+                    continue
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+                if entry.leases <= 0:
+                    del self._leased[id(wrapper)]
+                    if entry.retired:
+                        to_close.append(entry.wrapper)
+        if any(to_close):
+            close_wrappers(to_close)
+
+
+    @contextlib.contextmanager
+    def lease(self, nodes, parallel=True):
+        '''Context manager leasing connection wrappers for given nodes (see `get_wrappers`), and releasing them on exit.'''
+        wrappers = self.get_wrappers(nodes, parallel=parallel)
+        try:
+            yield wrappers
+        finally:
+            self.release(wrappers)
+
+
+    def evict_idle(self, max_idle=None):
+        '''Closes connections that nobody leases, and that were not used for a while.
+        Args:
+            max_idle (optional int): Number of seconds a connection may stay unused. If `None`, uses the value given at pool construction.
+
+        Returns:
+            Number of closed connections.'''
+        max_idle = max_idle if max_idle != None else self._max_idle
+        if max_idle == None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            evicted = [k for k, v in self._entries.items() if v.leases == 0 and now - v.last_used > max_idle]
+            wrappers = [self._entries.pop(k).wrapper for k in evicted]
+        if any(wrappers):
+            close_wrappers(wrappers)
+        return len(wrappers)
+
+
+    def close(self):
+        '''Closes all pooled connections, also leased ones.'''
+        with self._lock:
+            wrappers = [x.wrapper for x in self._entries.values()]
+            self._entries = dict()
+            self._leased = dict()
+        if any(wrappers):
+            close_wrappers(wrappers)
\ No newline at end of file
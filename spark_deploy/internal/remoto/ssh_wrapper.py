@@ -1,4 +1,5 @@
-import concurrent.futures
+import shutil
+import subprocess
 import tempfile
 import uuid
 
@@ -7,15 +8,20 @@ from spark_deploy.thirdparty.sshconf import *
 import logging
 import remoto
 
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.fs as fs
 from spark_deploy.internal.util.printer import *
 
 
 
 class RemotoSSHWrapper(object):
-    '''Simple wrapper containing a remoto connection and the file it is using as ssh config.'''
-    def __init__(self, connection, ssh_config=None):
+    '''Simple wrapper containing a remoto connection and the file it is using as ssh config.
+    When multiplexing, the wrapper also owns the OpenSSH master connection (and its control socket directory), which is shut down on exit.'''
+    def __init__(self, connection, ssh_config=None, hostname=None, control_dir=None):
         self._connection = connection
         self._ssh_config = ssh_config
+        self._hostname = hostname
+        self._control_dir = control_dir
         self._open = True
 
     def __enter__(self):
@@ -33,6 +39,20 @@ class RemotoSSHWrapper(object):
     def ssh_config_path(self):
         return self._ssh_config.name
 
+    @property
+    def hostname(self):
+        return self._hostname
+
+    @property
+    def multiplexed(self):
+        '''If set, all ssh sessions using our ssh config (remoto, rsync, ssh) share 1 master connection.'''
+        return self._control_dir != None
+
+    @property
+    def ssh_command(self):
+        '''ssh command to use for external programs (e.g. `rsync -e "<ssh_command>"`), so they use the same options (and master connection) as this wrapper.'''
+        return 'ssh -F {}'.format(self._ssh_config.name) if self._ssh_config else 'ssh'
+
     @property
     def open(self):
         '''If set, connection is open. Otherwise, Connection is closed'''
@@ -47,25 +67,33 @@ class RemotoSSHWrapper(object):
     def exit(self):
         if self._connection:
             self._connection.exit()
+        if self._control_dir:
+            _stop_control_master(self._hostname, self._ssh_config.name)
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
         if self._ssh_config:
             self._ssh_config.close()
         self._open = False
 
 
 
-def _build_ssh_config(hostname, ssh_params):
+def _build_ssh_config(hostname, ssh_params, control_dir=None):
     '''Writes a temporary ssh config with provided parameters.
     Warning: Returned value must be closed properly.
     Args:
         hostname (str): Hostname to register.
         ssh_params (dict): Parameters to set for hostname. A valid dict would be e.g: {"IdentityFile": "/some/key.rsa", "IdentitiesOnly": "yes", "Port": 22}
+        control_dir (optional str): If set, configures OpenSSH multiplexing, with the control socket in given directory.
 
     Returns:
         TemporaryFile containing the ssh config.'''
-    if callable(ssh_params):
-        ssh_params = ssh_params(node)
     if not isinstance(ssh_params, dict):
         raise ValueError('ssh_params must be a dict, mapping ssh options to values. E.g: {{"IdentityFile": "/some/key.rsa", "IdentitiesOnly": "yes", "Port": 22}}')
+    if control_dir:
+        ssh_params = ssh_params.copy()
+        ssh_params['ControlMaster'] = 'auto'
+        ssh_params['ControlPath'] = fs.join(control_dir, '%C') # %C is a hash of the connection parameters, which keeps the socket path short.
+        ssh_params['ControlPersist'] = '10m'
     conf = empty_ssh_config_file()
     conf.add(hostname, **ssh_params)
     tmpfile = tempfile.NamedTemporaryFile()
@@ -73,6 +101,20 @@ def _build_ssh_config(hostname, ssh_params):
     return tmpfile
 
 
+def _start_control_master(hostname, ssh_configpath):
+    '''Opens a backgrounded OpenSSH master connection. Every following ssh session using the same config multiplexes over it.
+    Returns:
+        `True` on success, `False` otherwise.'''
+    cmd = ['ssh', '-F', ssh_configpath, '-o', 'ControlMaster=yes', '-f', '-N', hostname]
+    return subprocess.call(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+
+def _stop_control_master(hostname, ssh_configpath):
+    '''Tells a running OpenSSH master connection to exit.'''
+    cmd = ['ssh', '-F', ssh_configpath, '-O', 'exit', hostname]
+    subprocess.call(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
 def _build_conn(hostname, loggername, silent, ssh_configpath=None):
     '''Returns a remoto-wrapped execnet connection.
     Warning: The `remoto.Connection` objects created here must be properly closed.
@@ -99,7 +141,7 @@ def _build_conn(hostname, loggername, silent, ssh_configpath=None):
         return None
 
 
-def get_wrapper(node, hostname, ssh_params=None, loggername=None, silent=False):
+def get_wrapper(node, hostname, ssh_params=None, loggername=None, multiplex=False, silent=False):
     '''Gets a connection wrapper.
     Warning: The `RemotoSSHWrapper` objects created here must be properly closed. A "with" clause is supported to close all wrappers on function exit.
     Args:
@@ -108,6 +150,7 @@ def get_wrapper(node, hostname, ssh_params=None, loggername=None, silent=False):
         ssh_params (optional dict, callable): If set, builds a temporary ssh config file with provided options to open connection with.
                                                        Can be a callable (i.e. function/lambda), which takes 1 node as argument, and outputs the dict with ssh config options (or `None`) for that node.
         loggername (optional str, callable): Name for logger. Can be either a `str` or a callable. Callables must take 1 node as argument, and output the logger name (`str`) to use for that node. If not set, uses random logger name.
+        multiplex (optional bool): If set, opens an OpenSSH master connection first. The remoto connection, and every program using the wrapper's ssh config (e.g. rsync), share it.
         silent (optional bool): If set, connection is silent (except when reporting errors).
 
     Returns:
@@ -123,12 +166,23 @@ def get_wrapper(node, hostname, ssh_params=None, loggername=None, silent=False):
     if callable(ssh_params):
         ssh_params = ssh_params(node)
 
-    ssh_config = _build_ssh_config(hostname, ssh_params) if ssh_params else None
+    engine.ssh_connect_permit() # Every wrapper opens at least 1 new ssh session (the master connection, or the remoto connection).
+    control_dir = None
+    if multiplex:
+        control_dir = tempfile.mkdtemp(prefix='spark-deploy-') # Unix sockets have a short maximum path length, so we keep this in the (short) temp dir.
+        ssh_config = _build_ssh_config(hostname, ssh_params or dict(), control_dir=control_dir)
+        if not _start_control_master(hostname, ssh_config.name):
+            printw('Could not open multiplexed connection to {}. Falling back to regular connections.'.format(hostname))
+            ssh_config.close()
+            shutil.rmtree(control_dir, ignore_errors=True)
+            control_dir = None
+    if not control_dir:
+        ssh_config = _build_ssh_config(hostname, ssh_params) if ssh_params else None
     conn = _build_conn(hostname, loggername, silent, ssh_configpath=ssh_config.name if ssh_config else None)
-    return RemotoSSHWrapper(conn, ssh_config=ssh_config)
+    return RemotoSSHWrapper(conn, ssh_config=ssh_config, hostname=hostname, control_dir=control_dir)
 
 
-def get_wrappers(nodes, hostnames, ssh_params=None, loggername=None, parallel=True, silent=False):
+def get_wrappers(nodes, hostnames, ssh_params=None, loggername=None, parallel=True, multiplex=False, silent=False):
     '''Gets multiple wrappers at once.
     Warning: The `RemotoSSHWrapper` objects created here must be properly closed.
     Args:
@@ -138,17 +192,19 @@ def get_wrappers(nodes, hostnames, ssh_params=None, loggername=None, parallel=Tr
                                                        Can be a callable (i.e. function/lambda), which takes 1 node as argument, and outputs the dict with ssh config options (or `None`) for that node.
         loggername (optional callable): Callable must take 1 node as argument, and output the logger name (`str`) to use for that node. If not set, uses random logger names.
         parallel (optional bool): If set, creates wrappers in parallel. Otherwise, creates sequentially.
+        multiplex (optional bool): If set, every wrapper opens an OpenSSH master connection, shared by all ssh sessions to that node (see `get_wrapper`).
         silent (optional bool): If set, connections are silent (except when reporting errors).
 
     Returns:
         `dict(metareserve.Node, RemotoSSHWrapper)`, Maps metareserve.Node to open remoto connection wrapper. Wrapper can be `None`, indicating failure to connect to key node'''
+    nodes = list(nodes)
     hostnames = hostnames if isinstance(hostnames, dict) else {x: hostnames(x) for x in nodes}
     if parallel:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-            futures_get_wrappers = {x: executor.submit(get_wrapper, x, hostnames[x], ssh_params=ssh_params, loggername=loggername, silent=silent) for x in nodes}
+        with engine.executor(len(nodes)) as executor:
+            futures_get_wrappers = {x: executor.submit(get_wrapper, x, hostnames[x], ssh_params=ssh_params, loggername=loggername, multiplex=multiplex, silent=silent) for x in nodes}
             return {k: v.result() for k,v in futures_get_wrappers.items()}
     else:
-        return {x: get_wrapper(x, hostnames[x], ssh_params=ssh_params, loggername=loggername, silent=silent) for x in nodes}
+        return {x: get_wrapper(x, hostnames[x], ssh_params=ssh_params, loggername=loggername, multiplex=multiplex, silent=silent) for x in nodes}
 
 
 def close_wrappers(wrappers, parallel=True):
@@ -170,7 +226,7 @@ def close_wrappers(wrappers, parallel=True):
     else:
         raise ValueError('Cannot close given wrappers: No dict, list, or single wrapper passed: {}'.format(wrappers))
     if parallel:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(closables)) as executor:
+        with engine.executor(len(closables)) as executor:
             futures_close = [executor.submit(x.exit) for x in closables]
             for x in futures_close:
                 x.result()
@@ -0,0 +1,44 @@
+'''Functions to transfer local files to remote nodes, using the ssh options (and multiplexed master connection, if any) of a `RemotoSSHWrapper`.'''
+
+import shlex
+import subprocess
+
+import remoto.process
+
+import spark_deploy.internal.util.engine as engine
+from spark_deploy.internal.util.printer import *
+
+
+def remote_path(path):
+    '''Converts a user-relative remote path (e.g. "~/deps") to a path rsync resolves relative to the remote home directory.'''
+    if path == '~' or path == '~/':
+        return '.'
+    return path[2:] if path.startswith('~/') else path
+
+
+def mkdir(wrapper, path):
+    '''Creates a directory (and all parents) on the remote.
+    Returns:
+        `True` on success, `False` otherwise.'''
+    return remoto.process.check(wrapper.connection, 'mkdir -p {}'.format(shlex.quote(remote_path(path))), shell=True)[2] == 0
+
+
+def rsync(wrapper, hostname, sources, dest, flags='-aL', silent=False):
+    '''Transfers local sources to a remote destination, using 1 rsync process for all sources.
+    Args:
+        wrapper (RemotoSSHWrapper): Wrapper of the connection to the remote. We use its ssh options.
+        hostname (str): Hostname the wrapper is registered to.
+        sources (str, list(str)): Local path(s) to transfer.
+        dest (str): Remote destination. When transferring multiple sources, this should be a directory.
+        flags (optional str): rsync flags to use.
+        silent (optional bool): If set, does not print rsync errors.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    if isinstance(sources, str):
+        sources = [sources]
+    cmd = 'rsync -e {} {} {} {}:{}'.format(shlex.quote(wrapper.ssh_command), flags, ' '.join(shlex.quote(x) for x in sources), hostname, shlex.quote(remote_path(dest)))
+    kwargs = {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL} if silent else {}
+    if not wrapper.multiplexed: # Without a master connection, rsync opens a new ssh session.
+        engine.ssh_connect_permit()
+    return subprocess.call(cmd, shell=True, **kwargs) == 0
\ No newline at end of file
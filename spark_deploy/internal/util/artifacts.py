@@ -0,0 +1,225 @@
+'''Controller-side, content-addressed store for downloaded install artifacts (e.g. Spark, Java archives), so we fetch every artifact from the internet only once.
+Layout:
+    <cachedir>/artifacts/blobs/<sha512>/<name>   Artifact contents, verified on insertion.
+    <cachedir>/artifacts/index.json             Maps every URL to its blob, size, and last use time.
+The store is size-limited. When it grows too large, we evict least-recently used blobs.'''
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import spark_deploy.internal.util.download as download
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+
+
+def artifact_name(url):
+    '''Returns the filename of the artifact behind given url. We keep this name, as extraction relies on the file extension.'''
+    return fs.basename(urllib.parse.urlparse(url).path)
+
+
+def _store_dir():
+    return fs.join(loc.cachedir(), 'artifacts')
+
+
+def _blob_path(sha512, name):
+    return fs.join(_store_dir(), 'blobs', sha512, name)
+
+
+@contextlib.contextmanager
+def _locked_index():
+    '''Context manager yielding the store index, holding an exclusive lock on it. Changes to the yielded dict are persisted on exit.'''
+    fs.mkdir(_store_dir(), exist_ok=True)
+    with open(fs.join(_store_dir(), '.lock'), 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        index_path = fs.join(_store_dir(), 'index.json')
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            index = dict()
+        yield index
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=_store_dir())
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+
+def _parse_checksum(text, length):
+    '''Parses published checksum files. We support "<hex>  <filename>" (sha*sum), and "<filename>: <HEX HEX ...>" (gpg --print-md, used by Apache) formats.
+    Returns:
+        Lowercase hex digest on success, `None` otherwise.'''
+    regex = re.compile(r'[0-9a-fA-F]{{{}}}'.format(length))
+    tokens = text.strip().split()
+    if any(tokens) and regex.fullmatch(tokens[0]):
+        return tokens[0].lower()
+    if ':' in text:
+        digits = re.sub(r'\s+', '', text.split(':', 1)[1])
+        if regex.fullmatch(digits):
+            return digits.lower()
+    return None
+
+
+def published_checksum(url, retries=3):
+    '''Fetches the checksum published next to an artifact (e.g. "<url>.sha512", as published by Apache). Falls back to "<url>.sha256".
+    Returns:
+        `(algorithm, hexdigest)` on success, `(None, None)` if no checksum is published.'''
+    for algorithm, length in (('sha512', 128), ('sha256', 64)):
+        for x in range(retries):
+            try:
+                with urllib.request.urlopen('{}.{}'.format(url, algorithm), timeout=30) as response:
+                    digest = _parse_checksum(response.read().decode('utf-8', errors='replace'), length)
+                if digest:
+                    return algorithm, digest
+                break
+            except urllib.error.HTTPError as e: # Checksum file does not exist.
+                break
+            except Exception as e:
+                continue
+    return None, None
+
+
+def _download(url, dest_dir, streams=4, retries=5):
+    '''Downloads given url to a file in `dest_dir`, and hashes its contents. Failed downloads of the same url resume in a later call.
+    Concurrent downloads of the same url take turns on the shared partial download, and each end up with their own file.
+    Returns:
+        `(path, {"sha512": hexdigest, "sha256": hexdigest}, throughput)`.'''
+    partial_loc = fs.join(dest_dir, '.tmp-{}'.format(hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]))
+    with open(partial_loc+'.lock', 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        size, seconds = download.download(url, partial_loc, streams=streams, retries=retries)
+        fd, tmp_loc = tempfile.mkstemp(prefix='.tmp-', dir=dest_dir)
+        os.close(fd)
+        os.replace(partial_loc, tmp_loc)
+    hashes = {'sha512': hashlib.sha512(), 'sha256': hashlib.sha256()}
+    try:
+        with open(tmp_loc, 'rb') as f:
+            while True:
+                chunk = f.read(1024*1024)
+                if not chunk:
+                    break
+                for h in hashes.values():
+                    h.update(chunk)
+    except Exception as e:
+        fs.rm(tmp_loc, ignore_errors=True)
+        raise e
+    return tmp_loc, {k: v.hexdigest() for k, v in hashes.items()}, download.throughput(size, seconds)
+
+
+def _lookup(url, sha512=None):
+    '''Finds a stored artifact for given url, or with given content hash. Marks it as used.
+    Returns:
+        Path to stored artifact if found, `None` otherwise.'''
+    name = artifact_name(url)
+    with _locked_index() as index:
+        entry = index.get(url)
+        if entry and (sha512 == None or entry['sha512'] == sha512) and fs.isfile(_blob_path(entry['sha512'], entry['name'])):
+            entry['last_used'] = time.time()
+            return _blob_path(entry['sha512'], entry['name'])
+        if sha512 and fs.isfile(_blob_path(sha512, name)): # Same content, known under a different URL.
+            index[url] = {'sha512': sha512, 'name': name, 'size': fs.sizeof(_blob_path(sha512, name)), 'last_used': time.time()}
+            return _blob_path(sha512, name)
+    return None
+
+
+def evict(max_size, keep=None):
+    '''Evicts least-recently used blobs until the store holds at most `max_size` bytes.
+    Args:
+        max_size (int): Maximal number of bytes to keep.
+        keep (optional str): Path to a stored artifact we must not evict, even when it is the least-recently used one.
+
+    Returns:
+        Number of evicted blobs.'''
+    with _locked_index() as index:
+        blobs = dict() # Multiple urls may point to the same blob. A blob is as recent as its most recently used url.
+        for url, entry in index.items():
+            key = (entry['sha512'], entry['name'])
+            size, last_used = blobs.get(key, (entry['size'], 0))
+            blobs[key] = (size, max(last_used, entry['last_used']))
+
+        total = sum(size for size, _ in blobs.values())
+        evicted = set()
+        for key, (size, _) in sorted(blobs.items(), key=lambda x: x[1][1]):
+            if total <= max_size:
+                break
+            if _blob_path(*key) == keep:
+                continue
+            fs.rm(fs.dirname(_blob_path(*key)), ignore_errors=True)
+            total -= size
+            evicted.add(key)
+        for url in [url for url, entry in index.items() if (entry['sha512'], entry['name']) in evicted]:
+            del index[url]
+    return len(evicted)
+
+
+def fetch(url, sha512=None, verify=True, offline=False, max_size=None, streams=4, silent=False, retries=5):
+    '''Fetches an artifact into the local artifact store, unless it is stored already.
+    Args:
+        url (str): URL of artifact to fetch.
+        sha512 (optional str): Expected SHA-512 hexdigest of the artifact. If `None` and `verify` is set, we use the checksum published next to the artifact, if any.
+        verify (optional bool): If set, we look for published checksums, and refuse artifacts not matching them.
+        offline (optional bool): If set, we never access the network. Fails when the artifact is not stored already.
+        max_size (optional int): If set, evicts least-recently used artifacts afterwards, until the store holds at most this many bytes.
+        streams (optional int): Number of concurrent connections to download the artifact with, if the server supports HTTP Range requests.
+        silent (optional bool): If set, prints less info.
+        retries (optional int): Number of tries we try to download the artifact.
+
+    Returns:
+        Path to local artifact on success, `None` otherwise.'''
+    sha512 = sha512.lower() if sha512 else None
+    found = _lookup(url, sha512=sha512)
+    if found:
+        if not silent:
+            print('Using cached artifact {}'.format(found))
+        return found
+    if offline:
+        printe('Artifact {} is not available in the local artifact store, and we are offline.'.format(url))
+        return None
+
+    algorithm, expected = ('sha512', sha512) if sha512 else (published_checksum(url) if verify else (None, None))
+    if verify and not expected:
+        printw('No checksum published for {}. Cannot verify download.'.format(url))
+    if algorithm == 'sha512':
+        found = _lookup(url, sha512=expected)
+        if found:
+            return found
+
+    fs.mkdir(_store_dir(), exist_ok=True)
+    for x in range(retries):
+        try:
+            if not silent:
+                print('Fetching {}'.format(url))
+            tmp_loc, digests, speed = _download(url, _store_dir(), streams=streams, retries=retries)
+            if not silent:
+                print('Fetched {} ({})'.format(url, speed))
+        except Exception as e:
+            if x == 0:
+                printw('Could not download {}. Retrying...'.format(url))
+            elif x == retries-1:
+                printe('Could not download {}: {}'.format(url, e))
+            continue
+        if expected and digests[algorithm] != expected:
+            fs.rm(tmp_loc, ignore_errors=True)
+            printw('Checksum mismatch for {} ({} expected={}, found={}). Retrying...'.format(url, algorithm, expected, digests[algorithm]))
+            continue
+
+        name = artifact_name(url)
+        dest = _blob_path(digests['sha512'], name)
+        fs.mkdir(fs.dirname(dest), exist_ok=True)
+        os.replace(tmp_loc, dest) # Concurrent fetches of the same artifact each write their own file, and atomically move it in place.
+        with _locked_index() as index:
+            index[url] = {'sha512': digests['sha512'], 'name': name, 'size': fs.sizeof(dest), 'last_used': time.time()}
+        if max_size != None:
+            evict(max_size, keep=dest)
+        return dest
+    printe('Could not fetch a valid copy of {}.'.format(url))
+    return None
\ No newline at end of file
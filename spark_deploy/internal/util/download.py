@@ -0,0 +1,179 @@
+'''Download engine for (large) install artifacts. This file only depends on the Python standard library, so it can be shipped inside generated remote modules.
+When a server supports HTTP Range requests, we split the file in chunks and fetch them over several concurrent connections.
+Progress is kept in a "<dest>.state" file next to the partial "<dest>.part" file, so a failed download resumes where it stopped, even in a later call.
+Servers without Range support get a regular single-stream download.'''
+
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def _download_probe(url, timeout):
+    '''Requests headers for given url.
+    Returns:
+        `(size, accepts_ranges, validator)`. `size` is `None` when unknown. `validator` is the ETag or Last-Modified header, or `None`.'''
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout) as response:
+            headers = response.headers
+    except urllib.error.HTTPError as e: # Some servers refuse HEAD requests. We then just try a regular download.
+        return None, False, None
+    size = headers.get('Content-Length')
+    accepts_ranges = headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return (int(size) if size else None), accepts_ranges, headers.get('ETag') or headers.get('Last-Modified')
+
+
+def _download_load_state(state_path, url, size, validator):
+    '''Loads the set of completed chunks of an earlier attempt. Returns an empty set if the earlier attempt downloaded something else.'''
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if state['url'] == url and state['size'] == size and state['validator'] == validator:
+            return set(state['done'])
+    except (OSError, ValueError, KeyError) as e:
+        pass
+    return set()
+
+
+def _download_save_state(state_path, url, size, validator, done):
+    tmp_path = state_path+'.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'url': url, 'size': size, 'validator': validator, 'done': sorted(done)}, f)
+    os.replace(tmp_path, state_path)
+
+
+def _download_range(url, fd, start, end, validator, timeout, progress):
+    '''Fetches bytes [`start`, `end`] of given url and writes them at the same offsets in `fd`.
+    Raises:
+        ValueError: When the server ignores our Range request (e.g. because the file changed).'''
+    offset = start
+    request = urllib.request.Request(url, headers={'Range': 'bytes={}-{}'.format(offset, end)})
+    if validator:
+        request.add_header('If-Range', validator)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if response.status != 206:
+            raise ValueError('Server did not respect range request (status={}).'.format(response.status))
+        while offset <= end:
+            data = response.read(min(1024*1024, end-offset+1))
+            if not data:
+                raise OSError('Connection closed at byte {} of range {}-{}.'.format(offset, start, end))
+            os.pwrite(fd, data, offset)
+            offset += len(data)
+            progress(len(data))
+
+
+def _download_single(url, part_path, timeout, progress):
+    '''Regular single-stream download, for servers without Range support.'''
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(part_path, 'wb') as f:
+        while True:
+            data = response.read(1024*1024)
+            if not data:
+                break
+            f.write(data)
+            progress(len(data))
+
+
+def download(url, dest, streams=4, chunk_size=8*1024*1024, retries=5, timeout=60, progress=None):
+    '''Downloads given url to `dest`, using concurrent HTTP Range requests when the server supports them.
+    Args:
+        url (str): URL to download.
+        dest (str): Local path to store the download. Only created when the download completes.
+        streams (optional int): Maximal number of concurrent connections.
+        chunk_size (optional int): Number of bytes fetched per Range request.
+        retries (optional int): Number of tries we try every chunk (or the full file, for servers without Range support).
+        timeout (optional int): Number of seconds a connection may stall before we consider it failed.
+        progress (optional callable): If set, called with `(downloaded_bytes, total_bytes, elapsed_seconds)` at most once per second. `total_bytes` is `None` when unknown.
+
+    Raises:
+        Exception: When we could not download the file. Partial progress is kept, and used by a later call with the same url and `dest`.
+
+    Returns:
+        `(size, seconds)`: Number of bytes downloaded in this call, and the time it took.'''
+    part_path = dest+'.part'
+    state_path = dest+'.state'
+    size, accepts_ranges, validator = _download_probe(url, timeout)
+
+    lock = threading.Lock()
+    counters = {'bytes': 0, 'reported': 0.0}
+    start_time = time.monotonic()
+    def _progress(amount):
+        with lock:
+            counters['bytes'] += amount
+            now = time.monotonic()
+            if progress and now - counters['reported'] >= 1:
+                counters['reported'] = now
+                progress(counters['bytes'], size, now - start_time)
+
+    if not (accepts_ranges and size):
+        for x in range(retries):
+            try:
+                _download_single(url, part_path, timeout, _progress)
+                break
+            except Exception as e:
+                if x == retries-1:
+                    raise e
+                time.sleep(min(2**x, 30))
+    else:
+        chunks = [(x, min(x+chunk_size, size)-1) for x in range(0, size, chunk_size)]
+        done = _download_load_state(state_path, url, size, validator)
+        if not (done and os.path.isfile(part_path)):
+            done = set()
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        todo = queue.Queue()
+        for idx in range(len(chunks)):
+            if not idx in done:
+                todo.put((idx, 0))
+        errors = []
+        fd = os.open(part_path, os.O_WRONLY)
+        def _worker():
+            while not errors:
+                try:
+                    idx, attempt = todo.get_nowait()
+                except queue.Empty as e:
+                    return
+                try:
+                    _download_range(url, fd, chunks[idx][0], chunks[idx][1], validator, timeout, _progress)
+                    with lock:
+                        done.add(idx)
+                        _download_save_state(state_path, url, size, validator, done)
+                except ValueError as e: # Retrying does not help here.
+                    errors.append(e)
+                except Exception as e:
+                    if attempt+1 >= retries:
+                        errors.append(e)
+                    else:
+                        time.sleep(min(2**attempt, 30))
+                        todo.put((idx, attempt+1))
+        try:
+            while not (todo.empty() or errors): # Workers may exit while another worker puts a failed chunk back. We restart workers until all chunks are done.
+                threads = [threading.Thread(target=_worker, daemon=True) for x in range(max(1, min(streams, todo.qsize())))]
+                for x in threads:
+                    x.start()
+                for x in threads:
+                    x.join()
+        finally:
+            os.close(fd)
+        if errors:
+            if isinstance(errors[0], ValueError): # File changed on the server. Our partial progress is useless.
+                for x in (part_path, state_path):
+                    if os.path.exists(x):
+                        os.remove(x)
+            raise errors[0]
+
+    os.replace(part_path, dest)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    elapsed = time.monotonic() - start_time
+    if progress:
+        progress(counters['bytes'], size, elapsed)
+    return counters['bytes'], elapsed
+
+
+def throughput(size, seconds):
+    '''Formats a download throughput for humans.'''
+    return '{:.1f} MiB/s'.format(size / (1024*1024) / max(seconds, 0.001))
\ No newline at end of file
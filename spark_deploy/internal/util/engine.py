@@ -0,0 +1,120 @@
+'''Shared execution engine for all operations running on many nodes at once.
+We bound concurrency in 3 ways:
+    1. A global limit on the number of tasks running at the same time, shared by all operations in this process.
+    2. A per-operation limit on the number of threads any single operation uses.
+    3. A rate limit on opening new ssh connections, so we do not trip the sshd `MaxStartups` limit on targets.
+Tasks submitted from within a running task (e.g. a transfer started by an install task) share the slot of their parent.
+Otherwise, parents waiting for their children could hold all slots, and deadlock.'''
+
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+import spark_deploy.internal.defaults.engine as defaults
+
+
+class RateLimiter(object):
+    '''Token bucket rate limiter. Allows bursts of `burst` events, and `rate` events per second on average.'''
+    def __init__(self, rate, burst):
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '''Reserves an event, without blocking.
+        Returns:
+            Number of seconds the caller must wait before performing the event. 0 if the event is allowed right away, or when `rate` is `None` or 0.'''
+        if not self._rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate) - 1
+            self._last = now
+            return 0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    def acquire(self):
+        '''Blocks until an event is allowed. Never blocks when `rate` is `None` or 0.'''
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class _State(object):
+    '''Current engine configuration.'''
+    def __init__(self, max_workers, per_operation, connect_rate, connect_burst):
+        self.max_workers = max_workers
+        self.per_operation = per_operation
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.connect_limiter = RateLimiter(connect_rate, connect_burst)
+
+
+_state = _State(defaults.max_workers(), defaults.per_operation(), defaults.connect_rate(), defaults.connect_burst())
+_local = threading.local()
+
+
+def configure(max_workers=None, per_operation=None, connect_rate=None, connect_burst=None):
+    '''Configures the shared execution engine. Unset arguments keep their current value. Operations that are already running keep their old limits.
+    Args:
+        max_workers (optional int): Maximal number of tasks running at the same time, over all operations.
+        per_operation (optional int): Maximal number of threads a single operation (e.g. starting all workers) uses.
+        connect_rate (optional float): Maximal average number of new ssh connections per second. 0 means no limit.
+        connect_burst (optional int): Maximal number of new ssh connections opened in a burst, before `connect_rate` applies.
+
+    Raises:
+        ValueError: When `max_workers` or `per_operation` is smaller than 1, or `connect_rate` is negative.'''
+    global _state
+    max_workers = max_workers if max_workers != None else _state.max_workers
+    per_operation = per_operation if per_operation != None else _state.per_operation
+    connect_rate = connect_rate if connect_rate != None else _state.connect_limiter._rate
+    connect_burst = connect_burst if connect_burst != None else _state.connect_limiter._burst
+    if max_workers < 1 or per_operation < 1:
+        raise ValueError('Concurrency limits must be at least 1 (found max_workers={}, per_operation={}).'.format(max_workers, per_operation))
+    if connect_rate < 0:
+        raise ValueError('Connection rate must not be negative (found {}).'.format(connect_rate))
+    _state = _State(max_workers, per_operation, connect_rate, connect_burst)
+
+
+def max_workers():
+    '''Returns the current maximal number of tasks running at the same time, over all operations.'''
+    return _state.max_workers
+
+
+def ssh_connect_permit():
+    '''Blocks until we are allowed to open a new ssh connection.'''
+    _state.connect_limiter.acquire()
+
+
+def ssh_connect_delay():
+    '''Reserves a new ssh connection, without blocking. Useful for callers that cannot block, e.g. asyncio coroutines.
+    Returns:
+        Number of seconds to wait before opening the connection.'''
+    return _state.connect_limiter.reserve()
+
+
+def _run(fn, slots, args, kwargs):
+    '''Runs a task. Takes a slot of the global limit, unless `slots` is `None` (meaning the submitting task already holds one).'''
+    with slots if slots != None else contextlib.nullcontext():
+        _local.slotted = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.slotted = False
+
+
+class _Executor(concurrent.futures.ThreadPoolExecutor):
+    '''Thread pool whose tasks take a slot of the global limit while running.'''
+    def submit(self, fn, *args, **kwargs):
+        slots = None if getattr(_local, 'slotted', False) else _state.slots
+        return super().submit(_run, fn, slots, args, kwargs)
+
+
+@contextlib.contextmanager
+def executor(tasks):
+    '''Returns an executor for an operation consisting of `tasks` parallel tasks. Use in a "with" clause, like a regular `ThreadPoolExecutor`.
+    Args:
+        tasks (int): Number of tasks the operation will submit. We never start more threads than this.'''
+    with _Executor(max_workers=max(1, min(tasks, _state.per_operation, _state.max_workers))) as pool:
+        yield pool
\ No newline at end of file
@@ -1,3 +1,5 @@
+import os
+
 import spark_deploy.internal.util.fs as fs
 
 
@@ -8,4 +10,27 @@ def sparkdir(install_dir):
 
 def java_nonroot_dir(install_dir):
     '''Path to non-root java installation. Warning: If this system detected java is already installed, it will not install java again, and this dir will not exist.'''
-    return fs.join(install_dir, 'java')
\ No newline at end of file
+    return fs.join(install_dir, 'java')
+
+
+def cachedir():
+    '''Path to local (controller-side) cache directory. Respects `XDG_CACHE_HOME`.'''
+    return fs.join(os.getenv('XDG_CACHE_HOME') or fs.join(os.path.expanduser('~'), '.cache'), 'spark_deploy')
+
+
+def stagingdir(install_dir):
+    '''Path to the directory where the controller pushes install artifacts to, before nodes install them.'''
+    return fs.join(install_dir, '.staging')
+
+def manifest(install_dir):
+    '''Path to the manifest recording what we installed on a node.'''
+    return fs.join(install_dir, '.manifest.json')
+
+def appstore(install_dir):
+    '''Path to the content-addressed store for application data on nodes.'''
+    return fs.join(install_dir, '.appstore')
+
+
+def jobsdir(install_dir):
+    '''Path to the directory holding the state of detached jobs on the master.'''
+    return fs.join(install_dir, '.jobs')
\ No newline at end of file
@@ -0,0 +1,111 @@
+'''Handles to Spark applications submitted in detached mode (see `submit`). Handles hold no connections. Every operation connects to the master when needed, unless a connection is provided.'''
+
+import contextlib
+import time
+
+from spark_deploy.internal.remoto.pool import default_ssh_params
+from spark_deploy.internal.remoto.ssh_wrapper import get_wrapper, close_wrappers
+from spark_deploy.internal.util.printer import *
+
+
+class JobHandle(object):
+    '''Handle to a detached Spark application, running on the master node.
+    Attributes:
+        node (metareserve.Node): Node running spark-submit (the master).
+        job_id (str): Unique id of the job.
+        job_dir (str): Remote directory holding the job state.
+        pid (int): Remote pid of the process group running spark-submit.
+        log_path (str): Remote path to the spark-submit output.
+        submission_id (str): Driver id assigned by Spark in cluster deploy mode, once known (see `poll`). `None` otherwise.'''
+    def __init__(self, node, job_id, job_dir, pid, log_path, module, submit_bin, master_url=None, key_path=None):
+        self.node = node
+        self.job_id = job_id
+        self.job_dir = job_dir
+        self.pid = pid
+        self.log_path = log_path
+        self.submission_id = None
+        self._module = module
+        self._submit_bin = submit_bin
+        self._master_url = master_url
+        self._key_path = key_path
+        self._offset = 0
+
+    def __repr__(self):
+        return 'JobHandle(job_id={}, node={}, pid={}, log_path={})'.format(self.job_id, self.node, self.pid, self.log_path)
+
+    @contextlib.contextmanager
+    def _remote(self, connectionwrapper):
+        '''Context manager yielding the remote module on the master. Uses given connection, or a temporary one.'''
+        wrapper = connectionwrapper or get_wrapper(self.node, self.node.ip_public, ssh_params=default_ssh_params(self._key_path), silent=True)
+        if wrapper == None:
+            raise ConnectionError('Could not connect to node {}.'.format(self.node))
+        try:
+            yield wrapper.connection.import_module(self._module)
+        finally:
+            if connectionwrapper == None:
+                close_wrappers(wrapper)
+
+    def poll(self, connectionwrapper=None):
+        '''Fetches the state of the job.
+        Args:
+            connectionwrapper (optional RemotoSSHWrapper): If set, uses this connection to the master instead of making a new one.
+
+        Returns:
+            `dict` with "state" ("running", "finished", "killed" or "lost"), "exitcode" (`int`, or `None` when not finished) and "submission_id".'''
+        with self._remote(connectionwrapper) as remote_module:
+            status = remote_module.job_poll(self.job_dir)
+        if status['submission_id']:
+            self.submission_id = status['submission_id']
+        return status
+
+    def wait(self, timeout=None, interval=5, connectionwrapper=None):
+        '''Waits until the job stops running. Uses 1 connection for the whole wait.
+        Args:
+            timeout (optional float): Maximal number of seconds to wait. If `None`, waits forever.
+            interval (optional float): Maximal number of seconds between polls. Polls start frequent, and slow down to this interval.
+            connectionwrapper (optional RemotoSSHWrapper): If set, uses this connection to the master instead of making a new one.
+
+        Returns:
+            Final state `dict` (see `poll`), or `None` if the job still runs after `timeout` seconds.'''
+        deadline = None if timeout == None else time.monotonic() + timeout
+        with self._remote(connectionwrapper) as remote_module:
+            sleep = 0.5
+            while True:
+                status = remote_module.job_poll(self.job_dir)
+                if status['submission_id']:
+                    self.submission_id = status['submission_id']
+                if status['state'] != 'running':
+                    return status
+                if deadline != None and time.monotonic() >= deadline:
+                    return None
+                time.sleep(sleep if deadline == None else max(0, min(sleep, deadline - time.monotonic())))
+                sleep = min(interval, sleep*2)
+
+    def tail(self, lines=100, follow=False, connectionwrapper=None):
+        '''Reads output of the job.
+        Args:
+            lines (optional int): Number of last lines to return.
+            follow (optional bool): If set, returns all output produced since the previous call with `follow` set (all output on the first call), instead of the last `lines` lines.
+            connectionwrapper (optional RemotoSSHWrapper): If set, uses this connection to the master instead of making a new one.
+
+        Returns:
+            Output `str`.'''
+        with self._remote(connectionwrapper) as remote_module:
+            text, end = remote_module.job_tail(self.job_dir, lines, self._offset if follow else None)
+        if follow:
+            self._offset = end
+        return text
+
+    def kill(self, timeout=10, connectionwrapper=None):
+        '''Stops the job. In cluster deploy mode, also asks the Spark master to kill the driver, if we know its submission id.
+        Args:
+            timeout (optional int): Number of seconds spark-submit gets to exit after SIGTERM, before we send SIGKILL.
+            connectionwrapper (optional RemotoSSHWrapper): If set, uses this connection to the master instead of making a new one.
+
+        Returns:
+            `True` if the job does not run anymore, `False` otherwise.'''
+        with self._remote(connectionwrapper) as remote_module:
+            if not self.submission_id:
+                self.submission_id = remote_module.job_poll(self.job_dir)['submission_id']
+            kill_cmd = '{} --master {} --kill {}'.format(self._submit_bin, self._master_url, self.submission_id) if self.submission_id and self._master_url else None
+            return remote_module.job_kill(self.job_dir, kill_cmd, timeout)
\ No newline at end of file
@@ -0,0 +1,246 @@
+'''Functions to change the workers of a running Spark cluster, without restarting the master.'''
+
+import spark_deploy.internal.defaults.install as install_defaults
+import spark_deploy.internal.defaults.start as defaults
+import spark_deploy.internal.defaults.stop as stop_defaults
+from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+from spark_deploy.start import _autosize_policy, _generate_module_start, _get_master_and_workers, _merge_kwargs, _start_spark_worker
+
+
+def _stop_spark_worker(remote_connection, module, install_dir, workdir, use_sudo=False, fast=False, stop_timeout=10, async_cleanup=False, silent=False, retries=5):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.stop_worker(loc.sparkdir(install_dir), workdir, use_sudo, silent, retries, 5, fast, stop_timeout, async_cleanup)
+
+
+def _alive_workers(remote_connection, module, host, webui_port):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.alive_workers(host, webui_port)
+
+
+def _wait_new_workers(remote_connection, module, host, webui_port, known, expected, timeout=60):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.wait_new_workers(host, webui_port, known, expected, timeout)
+
+
+def _pick_nodes(reservation, worker_ids, master_picked):
+    '''Returns the nodes with given ids.
+    Raises:
+        ValueError: When no ids are given, when ids are unknown, or when the master is among them.'''
+    if not worker_ids:
+        raise ValueError('No worker ids given.')
+    nodes = [reservation.get_node(node_id=x) for x in worker_ids]
+    unknown = [x for x, node in zip(worker_ids, nodes) if node == None]
+    if len(unknown) > 0: # Node id 0 is falsy, so we cannot use `any`.
+        raise ValueError('Worker ids contain unknown node ids: {}'.format(unknown))
+    if master_picked in nodes:
+        raise ValueError('Node {} is the master node. It cannot be added or removed as worker.'.format(master_picked.node_id))
+    return nodes
+
+
+def _connect(nodes, key_path, connectionwrappers, silent):
+    '''Returns connections to given nodes, and whether we made them ourselves (meaning we must close them).'''
+    if connectionwrappers != None:
+        return connectionwrappers, False
+    ssh_kwargs = {'IdentitiesOnly': 'yes', 'StrictHostKeyChecking': 'no'}
+    if key_path:
+        ssh_kwargs['IdentityFile'] = key_path
+    return get_wrappers(nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=silent), True
+
+
+def _resolve_master_host(master_host, master_picked):
+    if master_host == None:
+        return master_picked.ip_local
+    return master_host(master_picked) if callable(master_host) else master_host
+
+
+def _start_workers(executor, connectionwrappers, module, nodes, install_dir, worker_workdir, master_picked, master_port, use_sudo, autosize, silent, retries):
+    '''Starts workers on given nodes in parallel.
+    Returns:
+        `list` of nodes where the worker started.'''
+    futures = {node: executor.submit(_start_spark_worker, connectionwrappers[node].connection, module, install_dir, worker_workdir, master_picked, master_port=master_port, use_sudo=use_sudo, silent=silent, retries=retries, autosize=autosize) for node in nodes}
+    started = []
+    for node, future in futures.items():
+        if future.result():
+            started.append(node)
+        else:
+            printe('Could not start Spark worker on remote: {}'.format(node))
+    return started
+
+
+def _stop_workers(executor, connectionwrappers, module, nodes, install_dir, worker_workdir, use_sudo, fast, stop_timeout, async_cleanup, silent, retries):
+    '''Stops workers on given nodes in parallel.
+    Returns:
+        `list` of nodes where the worker stopped.'''
+    futures = {node: executor.submit(_stop_spark_worker, connectionwrappers[node].connection, module, install_dir, worker_workdir, use_sudo=use_sudo, fast=fast, stop_timeout=stop_timeout, async_cleanup=async_cleanup, silent=silent, retries=retries) for node in nodes}
+    stopped = []
+    for node, future in futures.items():
+        if future.result():
+            stopped.append(node)
+        else:
+            printe('Could not stop Spark worker on remote: {}'.format(node))
+    return stopped
+
+
+def add_workers(reservation, worker_ids, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, master_host=lambda x: x.ip_local, master_port=defaults.masterport(), webui_port=defaults.webuiport(), worker_workdir=defaults.workdir(), use_sudo=False, wait=True, wait_timeout=defaults.wait_timeout(), autosize=False, reserved_cores=defaults.reserved_cores(), reserved_memory=defaults.reserved_memory(), memory_fraction=defaults.memory_fraction(), silent=False, retries=defaults.retries()):
+    '''Starts workers on given nodes, registering them at the running master. Other daemons keep running.
+    Args:
+        reservation (`metareserve.Reservation`): Reservation object with all nodes of the cluster, including the master.
+        worker_ids (list(int)): Ids of the nodes to start workers on. Must not include the master.
+        install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        master_id (optional int): Node id of the master. If `None`, the node with lowest public ip value (string comparison) is the master, like in `start`.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections (for the master and given workers) instead of making new ones.
+        master_host (str or function or lambda): IP/Hostname the master listens on. See `start`.
+        master_port (optional int): port the master uses.
+        webui_port (optional int): port of the Spark webUI.
+        worker_workdir (optional str): Path to Spark workdir location for the new worker daemons.
+        use_sudo (optional bool): If set, uses sudo when starting.
+        wait (optional bool): If set, waits until all new workers registered at the master.
+        wait_timeout (optional int): Maximal number of seconds to wait for workers to register.
+        autosize (optional bool): If set, sizes the new workers to the resources of their node. See `start`.
+        reserved_cores (optional int): Number of cores per node we leave for other services when using `autosize`.
+        reserved_memory (optional int): Number of megabytes per node we leave at least for other services when using `autosize`.
+        memory_fraction (optional float): Maximal fraction of the memory of a node we give to its worker when using `autosize`.
+        silent (optional bool): If set, we only print errors and critical info. Otherwise, more verbose output.
+        retries (optional int): Number of tries we try to start a worker.
+
+    Raises:
+        ValueError: When `worker_ids` is empty, contains unknown node ids, or contains the master.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    master_picked, _ = _get_master_and_workers(reservation, master_id)
+    nodes = _pick_nodes(reservation, worker_ids, master_picked)
+    master_host = _resolve_master_host(master_host, master_picked)
+    autosize = _autosize_policy(autosize, reserved_cores, reserved_memory, memory_fraction)
+
+    connectionwrappers, local_connections = _connect([master_picked]+nodes, key_path, connectionwrappers, silent)
+    module = _generate_module_start()
+    try:
+        known = _alive_workers(connectionwrappers[master_picked].connection, module, master_host, webui_port) if wait else []
+        if known == None:
+            printe('Could not reach the Spark master on node {}. Is the cluster running?'.format(master_picked))
+            return False
+        with engine.executor(len(nodes)) as executor:
+            started = _start_workers(executor, connectionwrappers, module, nodes, install_dir, worker_workdir, master_picked, master_port, use_sudo, autosize, silent, retries)
+        if wait and any(started):
+            workers_ok, alive = _wait_new_workers(connectionwrappers[master_picked].connection, module, master_host, webui_port, known, len(started), wait_timeout)
+            if not workers_ok:
+                printe('Only {}/{} new workers registered at the master within {} seconds.'.format(alive, len(started), wait_timeout))
+                return False
+        if len(started) != len(nodes):
+            return False
+        prints('Added {} workers.'.format(len(nodes)))
+        return True
+    finally:
+        if local_connections:
+            close_wrappers(connectionwrappers)
+
+
+def remove_workers(reservation, worker_ids, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, worker_workdir=defaults.workdir(), use_sudo=False, fast=False, stop_timeout=stop_defaults.stop_timeout(), async_cleanup=False, silent=False, retries=stop_defaults.retries()):
+    '''Stops workers on given nodes. The master and other workers keep running.
+    Args:
+        reservation (`metareserve.Reservation`): Reservation object with all nodes of the cluster, including the master.
+        worker_ids (list(int)): Ids of the nodes to stop workers on. Must not include the master.
+        install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        master_id (optional int): Node id of the master. If `None`, the node with lowest public ip value (string comparison) is the master, like in `start`.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        worker_workdir (optional str): Path to Spark workdir location of the worker daemons. Removed after stopping.
+        use_sudo (optional bool): If set, uses sudo when stopping.
+        fast (optional bool): If set, signals the worker JVMs directly (see `stop`).
+        stop_timeout (optional int): Number of seconds workers get to exit in `fast` mode, before we kill them.
+        async_cleanup (optional bool): If set, deletes workdirs in the background (see `stop`).
+        silent (optional bool): If set, we only print errors and critical info. Otherwise, more verbose output.
+        retries (optional int): Number of tries we try to stop a worker.
+
+    Raises:
+        ValueError: When `worker_ids` is empty, contains unknown node ids, or contains the master.
+
+    Returns:
+        `True` on success, `False` otherwise.'''
+    master_picked, _ = _get_master_and_workers(reservation, master_id)
+    nodes = _pick_nodes(reservation, worker_ids, master_picked)
+
+    connectionwrappers, local_connections = _connect(nodes, key_path, connectionwrappers, silent)
+    module = _generate_module_start()
+    try:
+        with engine.executor(len(nodes)) as executor:
+            stopped = _stop_workers(executor, connectionwrappers, module, nodes, install_dir, worker_workdir, use_sudo, fast, stop_timeout, async_cleanup, silent, retries)
+        if len(stopped) != len(nodes):
+            return False
+        prints('Removed {} workers.'.format(len(nodes)))
+        return True
+    finally:
+        if local_connections:
+            close_wrappers(connectionwrappers)
+
+
+def rolling_restart(reservation, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, master_host=lambda x: x.ip_local, master_port=defaults.masterport(), webui_port=defaults.webuiport(), worker_workdir=defaults.workdir(), use_sudo=False, batch_size=defaults.rolling_batch_size(), fast=False, stop_timeout=stop_defaults.stop_timeout(), wait_timeout=defaults.wait_timeout(), autosize=False, reserved_cores=defaults.reserved_cores(), reserved_memory=defaults.reserved_memory(), memory_fraction=defaults.memory_fraction(), silent=False, retries=defaults.retries()):
+    '''Restarts all workers in batches, while the master keeps running and serving jobs.
+    We only restart the next batch after all workers of the current batch registered at the master again, so at most `batch_size` workers are unavailable at any time.
+    Args:
+        reservation (`metareserve.Reservation`): Reservation object with all nodes of the cluster, including the master.
+        install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        master_id (optional int): Node id of the master. If `None`, the node with lowest public ip value (string comparison) is the master, like in `start`.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        master_host (str or function or lambda): IP/Hostname the master listens on. See `start`.
+        master_port (optional int): port the master uses.
+        webui_port (optional int): port of the Spark webUI.
+        worker_workdir (optional str): Path to Spark workdir location for all worker daemons.
+        use_sudo (optional bool): If set, uses sudo when stopping and starting.
+        batch_size (optional int): Number of workers we restart at the same time.
+        fast (optional bool): If set, signals the worker JVMs directly when stopping (see `stop`).
+        stop_timeout (optional int): Number of seconds workers get to exit in `fast` mode, before we kill them.
+        wait_timeout (optional int): Maximal number of seconds to wait for the workers of a batch to register again.
+        autosize (optional bool): If set, sizes the restarted workers to the resources of their node. See `start`.
+        reserved_cores (optional int): Number of cores per node we leave for other services when using `autosize`.
+        reserved_memory (optional int): Number of megabytes per node we leave at least for other services when using `autosize`.
+        memory_fraction (optional float): Maximal fraction of the memory of a node we give to its worker when using `autosize`.
+        silent (optional bool): If set, we only print errors and critical info. Otherwise, more verbose output.
+        retries (optional int): Number of tries we try to stop or start a worker.
+
+    Raises:
+        ValueError: When `batch_size` is smaller than 1.
+
+    Returns:
+        `True` on success, `False` otherwise. We stop at the first batch that fails.'''
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1 (found {}).'.format(batch_size))
+    autosize = _autosize_policy(autosize, reserved_cores, reserved_memory, memory_fraction)
+    master_picked, workers_picked = _get_master_and_workers(reservation, master_id)
+    if not any(workers_picked):
+        printw('Cluster has no workers to restart.')
+        return True
+    master_host = _resolve_master_host(master_host, master_picked)
+
+    connectionwrappers, local_connections = _connect(reservation.nodes, key_path, connectionwrappers, silent)
+    module = _generate_module_start()
+    try:
+        with engine.executor(min(batch_size, len(workers_picked))) as executor:
+            for idx in range(0, len(workers_picked), batch_size):
+                batch = workers_picked[idx:idx+batch_size]
+                if not silent:
+                    print('Restarting workers {}-{} of {}...'.format(idx+1, idx+len(batch), len(workers_picked)))
+                known = _alive_workers(connectionwrappers[master_picked].connection, module, master_host, webui_port)
+                if known == None:
+                    printe('Could not reach the Spark master on node {}. Is the cluster running?'.format(master_picked))
+                    return False
+                # Workdirs are deleted in the background, so restarted workers do not wait for the delete.
+                if len(_stop_workers(executor, connectionwrappers, module, batch, install_dir, worker_workdir, use_sudo, fast, stop_timeout, True, silent, retries)) != len(batch):
+                    return False
+                if len(_start_workers(executor, connectionwrappers, module, batch, install_dir, worker_workdir, master_picked, master_port, use_sudo, autosize, silent, retries)) != len(batch):
+                    return False
+                workers_ok, alive = _wait_new_workers(connectionwrappers[master_picked].connection, module, master_host, webui_port, known, len(batch), wait_timeout)
+                if not workers_ok:
+                    printe('Only {}/{} restarted workers registered at the master within {} seconds.'.format(alive, len(batch), wait_timeout))
+                    return False
+        prints('Restarted {} workers.'.format(len(workers_picked)))
+        return True
+    finally:
+        if local_connections:
+            close_wrappers(connectionwrappers)
\ No newline at end of file
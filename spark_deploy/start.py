@@ -1,28 +1,35 @@
-import concurrent.futures
-
 import spark_deploy.internal.defaults.install as install_defaults
 import spark_deploy.internal.defaults.start as defaults
-from spark_deploy.internal.remoto.modulegenerator import ModuleGenerator
+import spark_deploy.internal.remoto.modulecache as modulecache
 from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
 import spark_deploy.internal.util.fs as fs
 import spark_deploy.internal.util.location as loc
-import spark_deploy.internal.util.importer as importer
 from spark_deploy.internal.util.printer import *
 
 
-def _start_spark_master(remote_connection, module, install_dir, host, host_webui, port=7077, webui_port=2205, use_sudo=False, silent=False, retries=5):
+def _start_spark_master(remote_connection, module, install_dir, host, host_webui, port=7077, webui_port=2205, use_sudo=False, silent=False, retries=5, ready_timeout=60):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.start_master(loc.sparkdir(install_dir), host, host_webui, port, webui_port, use_sudo, silent, retries, 5, ready_timeout)
+
+
+def _start_spark_worker(remote_connection, module, install_dir, workdir, master_picked, master_port=7077, use_sudo=False, silent=False, retries=5, autosize=None):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.start_worker(loc.sparkdir(install_dir), workdir, master_picked.ip_local, master_port, use_sudo, silent, retries, 5, autosize)
+
+
+def _stop_spark_worker(remote_connection, module, install_dir, workdir, use_sudo=False, retries=5):
     remote_module = remote_connection.import_module(module)
-    return remote_module.start_master(loc.sparkdir(install_dir), host, host_webui, port, webui_port, use_sudo, silent, retries)
+    return remote_module.stop_all(loc.sparkdir(install_dir), workdir, use_sudo, True, retries)
 
 
-def _start_spark_worker(remote_connection, module, install_dir, workdir, master_picked, master_port=7077, use_sudo=False, silent=False, retries=5):
+def _wait_spark_workers(remote_connection, module, host, webui_port, expected, timeout=60):
     remote_module = remote_connection.import_module(module)
-    return remote_module.start_worker(loc.sparkdir(install_dir), workdir, master_picked.ip_local, master_port, use_sudo, silent, retries)
+    return remote_module.wait_workers(host, webui_port, expected, timeout)
 
 
 def _generate_module_start(silent=False):
     '''Generates Spark-start module from available sources.'''
-    generation_loc = fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'generated', 'start_spark.py')
     files = [
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
@@ -31,8 +38,7 @@ def _generate_module_start(silent=False):
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_start.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
     ]
-    ModuleGenerator().with_module(fs).with_files(*files).generate(generation_loc, silent)
-    return importer.import_full_path(generation_loc)
+    return modulecache.get_module('start_spark', files, modules=[fs], silent=silent)
 
 
 def _get_master_and_workers(reservation, master_id=None):
@@ -58,14 +64,30 @@ def _merge_kwargs(x, y):
     return z
 
 
-def start(reservation, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, master_host=lambda x: x.ip_local, master_port=defaults.masterport(), webui_port=defaults.webuiport(), worker_workdir=defaults.workdir(), use_sudo=False, silent=False, retries=defaults.retries()):
+def _autosize_policy(autosize, reserved_cores, reserved_memory, memory_fraction):
+    '''Builds the worker sizing policy we send to nodes.
+    Raises:
+        ValueError: When a policy value is out of range.
+
+    Returns:
+        `dict` with the policy if `autosize` is set, `None` otherwise.'''
+    if not autosize:
+        return None
+    if reserved_cores < 0 or reserved_memory < 0:
+        raise ValueError('reserved_cores and reserved_memory must not be negative (found {} and {}).'.format(reserved_cores, reserved_memory))
+    if not 0 < memory_fraction <= 1:
+        raise ValueError('memory_fraction must be in (0, 1] (found {}).'.format(memory_fraction))
+    return {'reserved_cores': reserved_cores, 'reserved_memory': reserved_memory, 'memory_fraction': memory_fraction}
+
+
+def start(reservation, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, master_host=lambda x: x.ip_local, master_port=defaults.masterport(), webui_port=defaults.webuiport(), worker_workdir=defaults.workdir(), use_sudo=False, wait=True, wait_timeout=defaults.wait_timeout(), pipelined=False, autosize=False, reserved_cores=defaults.reserved_cores(), reserved_memory=defaults.reserved_memory(), memory_fraction=defaults.memory_fraction(), silent=False, retries=defaults.retries()):
     '''Boot Spark on an existing reservation.
     Args:
         reservation (`metareserve.Reservation`): Reservation object with all nodes to start Spark on.
         install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
         key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
         master_id (optional int): Node id that must become the master. If `None`, the node with lowest public ip value (string comparison) will be picked.
-        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
         master_host (str or function or lambda): IP/Hostname to listen to. 
             Warning: If a globally accessible ip/hostname is set (e.g. 0.0.0.0), then Spark is reachable from the public internet.
                      In such cases, make sure that the Spark `master_port` is not accessible in your firewall, so others cannot submit jobs to run on your hardware.
@@ -76,6 +98,16 @@ def start(reservation, install_dir=install_defaults.install_dir(), key_path=None
         webui_port (optional int): port for Spark webUI to use.
         worker_workdir (optional str): Path to Spark workdir location for all worker daemons.
         use_sudo (optional bool): If set, uses sudo when starting.
+        wait (optional bool): If set, waits until all workers registered at the master, by polling the master's status. Otherwise, returns as soon as all daemons are launched.
+        wait_timeout (optional int): Maximal number of seconds to wait for the master ports to open, and for all workers to register.
+        pipelined (optional bool): If set, launches workers at the same time as the master, instead of after the master is ready.
+                                   The master URL is known beforehand, and workers keep trying to register until the master is up. Use with `wait` to confirm all workers registered.
+        autosize (optional bool): If set, sizes every worker to the resources of its node, instead of letting Spark claim all cores and all memory minus 1GB.
+                                  Workers get all cores minus `reserved_cores`, `memory_fraction` of the memory (keeping at least `reserved_memory` free),
+                                  and spill directories (`SPARK_LOCAL_DIRS`) on the fastest local disks other than the root disk (NVMe first).
+        reserved_cores (optional int): Number of cores per node we leave for the OS and other services when using `autosize`.
+        reserved_memory (optional int): Number of megabytes per node we leave at least for the OS page cache and other services when using `autosize`.
+        memory_fraction (optional float): Maximal fraction of the memory of a node we give to its worker when using `autosize`.
         silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
         retries (optional int): Number of tries we try to connect to the master.
 
@@ -86,8 +118,9 @@ def start(reservation, install_dir=install_defaults.install_dir(), key_path=None
 
     if master_host == None:
         master_host = lambda x: x.ip_local
+    autosize = _autosize_policy(autosize, reserved_cores, reserved_memory, memory_fraction)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(reservation)) as executor:
+    with engine.executor(len(reservation)) as executor:
 
         master_picked, workers_picked = _get_master_and_workers(reservation, master_id)
         printc('Picked master node: {}. Deploying 1 master and {} workers'.format(master_picked, len(workers_picked)), Color.CAN)
@@ -106,22 +139,41 @@ def start(reservation, install_dir=install_defaults.install_dir(), key_path=None
             connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=silent)
         module = _generate_module_start()
 
-        future_spark_master = executor.submit(_start_spark_master, connectionwrappers[master_picked].connection, module, install_dir, master_host, master_picked.ip_public, port=master_port, webui_port=webui_port, use_sudo=use_sudo, silent=silent, retries=5)
+        future_spark_master = executor.submit(_start_spark_master, connectionwrappers[master_picked].connection, module, install_dir, master_host, master_picked.ip_public, port=master_port, webui_port=webui_port, use_sudo=use_sudo, silent=silent, retries=5, ready_timeout=wait_timeout)
+        submit_workers = lambda: {node: executor.submit(_start_spark_worker, conn_wrapper.connection, module, install_dir, worker_workdir, master_picked, master_port=master_port, use_sudo=use_sudo, silent=silent, retries=retries, autosize=autosize) for node, conn_wrapper in connectionwrappers.items() if node != master_picked}
+        if pipelined:
+            futures_spark_workers = submit_workers()
 
         state_ok, master_url = future_spark_master.result()
         if not state_ok:
             printe('Could not start Spark master on node: {}'.format(master_picked))
+            if pipelined: # Workers would keep trying to reach a master that never comes up.
+                for x in futures_spark_workers.values():
+                    x.result()
+                futures_stop = [executor.submit(_stop_spark_worker, connectionwrappers[node].connection, module, install_dir, worker_workdir, use_sudo=use_sudo, retries=retries) for node in futures_spark_workers.keys()]
+                for x in futures_stop:
+                    x.result()
             if local_connections:
                 close_wrappers(connectionwrappers)
             return False, None, None
 
-        futures_spark_workers = {node: executor.submit(_start_spark_worker, conn_wrapper.connection, module, install_dir, worker_workdir, master_picked, master_port=master_port, use_sudo=use_sudo, silent=silent, retries=retries) for node, conn_wrapper in connectionwrappers.items() if node != master_picked}
+        if not pipelined:
+            futures_spark_workers = submit_workers()
         state_ok = True
         for node, worker_future in futures_spark_workers.items():
             if not worker_future.result():
                 printe('Could not start Spark worker on remote: {}'.format(node))
                 state_ok = False
 
+        if state_ok and wait and any(futures_spark_workers):
+            workers_ok, alive = _wait_spark_workers(connectionwrappers[master_picked].connection, module, master_host, webui_port, len(futures_spark_workers), wait_timeout)
+            if workers_ok:
+                if not silent:
+                    print('All {} workers registered at the master.'.format(alive))
+            else:
+                printe('Only {}/{} workers registered at the master within {} seconds.'.format(alive, len(futures_spark_workers), wait_timeout))
+                state_ok = False
+
         if local_connections:
             close_wrappers(connectionwrappers)  
         if state_ok:
@@ -0,0 +1,169 @@
+'''Functions to report the state of a Spark cluster. Snapshots are cached locally, so repeated calls within the cache TTL need no remote access.'''
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import spark_deploy.internal.defaults.install as install_defaults
+import spark_deploy.internal.defaults.start as start_defaults
+import spark_deploy.internal.defaults.status as defaults
+import spark_deploy.internal.remoto.modulecache as modulecache
+from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+from spark_deploy.start import _get_master_and_workers, _merge_kwargs
+
+
+def _master_status(remote_connection, module, host, webui_port):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.master_status(host, webui_port)
+
+
+def _node_status(remote_connection, module, install_dir):
+    remote_module = remote_connection.import_module(module)
+    return remote_module.node_status(loc.sparkdir(install_dir), loc.manifest(install_dir))
+
+
+def _probe_result(node, future):
+    '''Returns the status a node reported, or `None` if we could not probe the node. 1 failing node does not fail the whole status report.'''
+    if future == None:
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        printw('Could not probe node {}: {}'.format(node, e))
+        return None
+
+
+def _generate_module_status(silent=False):
+    '''Generates Spark-status module from available sources.'''
+    files = [
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'env.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'manifest.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_stop.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_start.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_status.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
+    ]
+    return modulecache.get_module('status_spark', files, modules=[fs], silent=silent)
+
+
+def _cache_path(nodes, install_dir, master_picked, master_host, webui_port, probe):
+    '''Returns the path of the cached snapshot for given query. Every distinct query gets its own snapshot.'''
+    h = hashlib.sha256()
+    h.update(repr((sorted((str(x.node_id), str(x.ip_public)) for x in nodes), install_dir, master_picked.node_id, master_host, webui_port, probe)).encode('utf-8'))
+    return fs.join(loc.cachedir(), 'status', '{}.json'.format(h.hexdigest()[:32]))
+
+
+def _cache_read(path, ttl):
+    '''Returns the cached snapshot at given path, or `None` if there is none, or it is older than `ttl` seconds.'''
+    try:
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        return None
+    return snapshot if time.time() - snapshot.get('time', 0) <= ttl else None
+
+
+def _cache_write(path, snapshot):
+    '''Atomically stores a snapshot, so concurrent readers never see a half-written file.'''
+    fs.mkdir(fs.dirname(path), exist_ok=True)
+    fd, tmp_loc = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=fs.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_loc, path)
+    except Exception as e:
+        fs.rm(tmp_loc, ignore_errors=True)
+        raise e
+
+
+def _summarize_master(master_picked, master_host, raw):
+    '''Converts the master JSON status to our snapshot format.'''
+    if raw == None:
+        return None, []
+    master = {
+        'node_id': master_picked.node_id,
+        'host': master_host,
+        'url': raw.get('url'),
+        'status': raw.get('status'),
+        'cores': raw.get('cores'),
+        'coresused': raw.get('coresused'),
+        'memory': raw.get('memory'),
+        'memoryused': raw.get('memoryused'),
+        'aliveworkers': raw.get('aliveworkers', len([x for x in raw.get('workers', []) if x.get('state') == 'ALIVE'])),
+        'activeapps': len(raw.get('activeapps', [])),
+    }
+    workers = [{key: x.get(key) for key in ('id', 'host', 'port', 'state', 'cores', 'coresused', 'memory', 'memoryused')} for x in raw.get('workers', [])]
+    return master, workers
+
+
+def status(reservation, install_dir=install_defaults.install_dir(), key_path=None, master_id=None, connectionwrappers=None, master_host=lambda x: x.ip_local, webui_port=start_defaults.webuiport(), probe=False, cache_ttl=defaults.cache_ttl(), refresh=False, silent=False):
+    '''Reports the state of a Spark cluster. Queries the master's JSON endpoint once and, if `probe` is set, every node in parallel.
+    Snapshots are cached locally. Calls with the same arguments within `cache_ttl` seconds return the cached snapshot, without remote access.
+    Snapshots of an unreachable master are not cached.
+    Args:
+        reservation (`metareserve.Reservation`): Reservation object with all nodes of the cluster.
+        install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
+        key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        master_id (optional int): Node id of the master. If `None`, the node with lowest public ip value (string comparison) is the master, like in `start`.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
+        master_host (str or function or lambda): IP/Hostname the master listens on. See `start`.
+        webui_port (optional int): port of the Spark webUI.
+        probe (optional bool): If set, also reports the state of every node (running daemons, installed versions, load, memory).
+        cache_ttl (optional int): Maximal age (in seconds) of a cached snapshot we return. 0 disables reading from the cache.
+        refresh (optional bool): If set, always queries the cluster, and refreshes the cached snapshot.
+        silent (optional bool): If set, we only print errors and critical info.
+
+    Returns:
+        `dict` snapshot with keys:
+            "time": Time of the snapshot (seconds since the epoch).
+            "master": Master state, or `None` if the master is unreachable. Includes "url", "status", "cores", "coresused", "memory" and "memoryused" (memory in megabytes, like Spark reports it), "aliveworkers" and "activeapps".
+            "workers": `list` of workers registered at the master, with "id", "host", "port", "state", "cores", "coresused", "memory" and "memoryused".
+            "nodes": If `probe` is set, `dict` mapping node id (as `str`) to the state of that node (see `node_status` in the remote status module), or `None` for unreachable nodes.'''
+    if not reservation or len(reservation) == 0:
+        raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+    nodes = list(reservation.nodes)
+    master_picked, _ = _get_master_and_workers(reservation, master_id)
+    if master_host == None:
+        master_host = master_picked.ip_local
+    elif callable(master_host):
+        master_host = master_host(master_picked)
+
+    cache_path = _cache_path(nodes, install_dir, master_picked, master_host, webui_port, probe)
+    if not refresh and cache_ttl > 0:
+        snapshot = _cache_read(cache_path, cache_ttl)
+        if snapshot:
+            return snapshot
+
+    local_connections = connectionwrappers == None
+    if local_connections:
+        ssh_kwargs = {'IdentitiesOnly': 'yes', 'StrictHostKeyChecking': 'no'}
+        if key_path:
+            ssh_kwargs['IdentityFile'] = key_path
+        connectionwrappers = get_wrappers(nodes if probe else [master_picked], lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=True)
+    module = _generate_module_status()
+    try:
+        with engine.executor(len(nodes) if probe else 1) as executor:
+            future_master = executor.submit(_master_status, connectionwrappers[master_picked].connection, module, master_host, webui_port) if connectionwrappers.get(master_picked) else None
+            futures_nodes = {node: executor.submit(_node_status, connectionwrappers[node].connection, module, install_dir) for node in nodes if connectionwrappers.get(node)} if probe else dict()
+            master, workers = _summarize_master(master_picked, master_host, future_master.result() if future_master else None)
+            snapshot = {'time': time.time(), 'master': master, 'workers': workers}
+            if probe:
+                snapshot['nodes'] = {str(node.node_id): _probe_result(node, futures_nodes.get(node)) for node in nodes}
+    finally:
+        if local_connections:
+            close_wrappers(connectionwrappers)
+
+    if master == None: # We do not cache failures, so the next call retries.
+        if not silent:
+            printw('Could not reach the Spark master on node {}.'.format(master_picked))
+        return snapshot
+    _cache_write(cache_path, snapshot)
+    return snapshot
\ No newline at end of file
@@ -1,33 +1,28 @@
-import concurrent.futures
-
-
 import spark_deploy.internal.defaults.install as install_defaults
 import spark_deploy.internal.defaults.start as start_defaults
 import spark_deploy.internal.defaults.stop as defaults
-from spark_deploy.internal.remoto.modulegenerator import ModuleGenerator
+import spark_deploy.internal.remoto.modulecache as modulecache
 from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
 import spark_deploy.internal.util.fs as fs
-import spark_deploy.internal.util.importer as importer
 import spark_deploy.internal.util.location as loc
 from spark_deploy.internal.util.printer import *
 
 
-def _stop_spark(remote_connection, module, install_dir, workdir=None, use_sudo=False, silent=False, retries=5):
+def _stop_spark(remote_connection, module, install_dir, workdir=None, use_sudo=False, fast=False, stop_timeout=10, async_cleanup=False, silent=False, retries=5):
     remote_module = remote_connection.import_module(module)
-    return remote_module.stop_all(loc.sparkdir(install_dir), workdir, use_sudo, silent, retries)
+    return remote_module.stop_all(loc.sparkdir(install_dir), workdir, use_sudo, silent, retries, 5, fast, stop_timeout, async_cleanup)
 
 
 def _generate_module_stop(silent=False):
     '''Generates Spark-stop module from available sources.'''
-    generation_loc = fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'generated', 'start_spark.py')
     files = [
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_stop.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
     ]
-    ModuleGenerator().with_module(fs).with_files(*files).generate(generation_loc, silent)
-    return importer.import_full_path(generation_loc)
+    return modulecache.get_module('stop_spark', files, modules=[fs], silent=silent)
 
 
 def _merge_kwargs(x, y):
@@ -36,15 +31,19 @@ def _merge_kwargs(x, y):
     return z
 
 
-def stop(reservation, install_dir=install_defaults.install_dir(), key_path=None, connectionwrappers=None, worker_workdir=start_defaults.workdir(), use_sudo=False, silent=False, retries=defaults.retries()):
+def stop(reservation, install_dir=install_defaults.install_dir(), key_path=None, connectionwrappers=None, worker_workdir=start_defaults.workdir(), use_sudo=False, fast=False, stop_timeout=defaults.stop_timeout(), async_cleanup=False, silent=False, retries=defaults.retries()):
     '''Stop Spark on an existing reservation.
     Args:
         reservation (`metareserve.Reservation`): Reservation object with all nodes to start Spark on.
         install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
         key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
-        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
         worker_workdir (optional str): Path to Spark workdir location for all worker daemons.
         use_sudo (optional bool): If set, uses sudo when stopping.
+        fast (optional bool): If set, signals the daemon JVMs from their PID files directly (all at once), instead of running Spark's stop scripts one after another.
+        stop_timeout (optional int): Number of seconds daemons get to exit in `fast` mode, before we kill them.
+        async_cleanup (optional bool): If set, workers rename their workdir to a tombstone, and delete it in the background. We do not wait for the delete.
+                                       Tombstones left behind are removed on the next start.
         silent (optional bool): If set, we only print errors and critical info (e.g. spark master url). Otherwise, more verbose output.
         retries (optional int): Number of tries we try to connect to the master.
 
@@ -60,10 +59,10 @@ def stop(reservation, install_dir=install_defaults.install_dir(), key_path=None,
             ssh_kwargs['IdentityFile'] = key_path
         connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=silent)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(reservation)) as executor:
+    with engine.executor(len(reservation)) as executor:
         stop_module = _generate_module_stop()
 
-        futures_spark_stop = {node: executor.submit(_stop_spark, conn_wrapper.connection, stop_module, install_dir, workdir=worker_workdir, use_sudo=use_sudo, silent=silent, retries=retries) for node, conn_wrapper in connectionwrappers.items()}
+        futures_spark_stop = {node: executor.submit(_stop_spark, conn_wrapper.connection, stop_module, install_dir, workdir=worker_workdir, use_sudo=use_sudo, fast=fast, stop_timeout=stop_timeout, async_cleanup=async_cleanup, silent=silent, retries=retries) for node, conn_wrapper in connectionwrappers.items()}
         state_ok = True
         for node, worker_future in futures_spark_stop.items():
             if not worker_future.result():
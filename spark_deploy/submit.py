@@ -1,19 +1,23 @@
-import concurrent.futures
-from multiprocessing import cpu_count
 import os
 import re
-import subprocess
+import shlex
+import time
+import uuid
 
 import remoto.process
 
 import spark_deploy.internal.defaults.install as install_defaults
 import spark_deploy.internal.defaults.submit as defaults
-from spark_deploy.internal.remoto.modulegenerator import ModuleGenerator
+import spark_deploy.internal.remoto.appcache as appcache
+from spark_deploy.internal.remoto.batch import Batch
+from spark_deploy.internal.remoto.distribute import broadcast
+import spark_deploy.internal.remoto.modulecache as modulecache
 from spark_deploy.internal.remoto.ssh_wrapper import get_wrapper, get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
 import spark_deploy.internal.util.fs as fs
-import spark_deploy.internal.util.importer as importer
 import spark_deploy.internal.util.location as loc
 from spark_deploy.internal.util.printer import *
+from spark_deploy.jobs import JobHandle
 
 
 def _submit_spark(remote_connection, module, command, cwd, silent=False):
@@ -23,18 +27,85 @@ def _submit_spark(remote_connection, module, command, cwd, silent=False):
     return remote_module.submit(command, cwd)
 
 
+def _submit_spark_stream(remote_connection, module, command, cwd, output, silent=False):
+    '''Runs spark-submit, passing every line of output to `output(stream, line)` while it arrives (see `submit_stream` in the remote submit module).
+    The connection may be shared (e.g. from a `ConnectionPool`), so we never leave it with unread messages:
+    When `output` raises, we read the remaining output until spark-submit exits, and re-raise. When we are interrupted, we close the connection.
+    Returns:
+        Exitcode of spark-submit.'''
+    remote_module = remote_connection.import_module(module)
+    if not silent:
+        print('Executing: {}'.format(command))
+    channel = remote_module.channel # We talk to the remote directly, as we receive many messages for 1 call.
+    channel.send('submit_stream({}, {})'.format(repr(command), repr(cwd)))
+    in_sync = False
+    try:
+        while True:
+            kind, value = channel.receive()
+            if kind == 'exit':
+                in_sync = True
+                return value
+            channel.send(None) # Acknowledges the message, so the remote sends more.
+            try:
+                for stream, line in value:
+                    output(stream, line)
+            except Exception as e:
+                printe('Could not process spark-submit output: {}. Discarding output until spark-submit exits.'.format(e))
+                while True:
+                    kind, value = channel.receive()
+                    if kind == 'exit':
+                        in_sync = True
+                        raise e
+                    channel.send(None)
+    finally:
+        if not in_sync: # Unread messages remain on the channel. Closing the connection keeps others from reading them as replies.
+            remote_connection.exit()
+
+
+def _launch_detached(remote_connection, module, master_picked, install_dir, command, run_cmd, cwd, key_path=None, silent=False):
+    '''Launches spark-submit detached from the connection (see `submit_detached` in the remote submit module).
+    Returns:
+        `JobHandle` on success, `None` otherwise.'''
+    job_id = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+    job_dir = fs.join(loc.jobsdir(install_dir), job_id)
+    if not silent:
+        print('Executing (detached): {}'.format(run_cmd))
+    pid, log_path = remote_connection.import_module(module).submit_detached(run_cmd, cwd, job_dir)
+    if pid == None:
+        return None
+    master_url = re.search(r'--master[\s=]+["\']?(spark://[^\s"\']+)', command)
+    if not silent:
+        prints('Application launched as job {} (log: {}).'.format(job_id, log_path))
+    return JobHandle(master_picked, job_id, job_dir, pid, log_path, module, fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit'), master_url=master_url.group(1) if master_url else None, key_path=key_path)
+
+
+def _output_sink(output, silent=False):
+    '''Builds the function receiving streamed spark-submit output.
+    Args:
+        output (None, str, callable): If `None`, prints lines (unless `silent` is set). If `str`, appends lines to the file at that path. Otherwise, calls `output(stream, line)`.
+
+    Returns:
+        `(sink, close)`, with `sink(stream, line)` receiving output, and `close()` releasing resources afterwards.'''
+    if output == None:
+        return (lambda stream, line: None) if silent else (lambda stream, line: print(line)), lambda: None
+    if isinstance(output, str):
+        f = open(fs.abspath(output), 'a', buffering=1)
+        return (lambda stream, line: f.write(line+'\n')), f.close
+    return output, lambda: None
+
+
 def _generate_module_submit(silent=False):
     '''Generates Spark-submit module from available sources.'''
-    generation_loc = fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'generated', 'submit_spark.py')
     files = [
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'env.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_submit.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'app_cache.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'batch.py'),
         fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
     ]
-    ModuleGenerator().with_module(fs).with_files(*files).generate(generation_loc, silent)
-    return importer.import_full_path(generation_loc)
+    return modulecache.get_module('submit_spark', files, modules=[fs], silent=silent)
 
 
 
@@ -67,6 +138,60 @@ def _validate_jvm_bytes(string):
     return regex.fullmatch(string) != None
 
 
+def _submit_options(command):
+    '''Returns the spark-submit options in a command string, as `list((name, value))`. Flags without a value have value `None`.
+    We stop at the application jar/file. Everything after it are arguments of the application itself.'''
+    try:
+        tokens = shlex.split(command)
+    except ValueError as e:
+        tokens = command.split()
+    options = []
+    idx = 0
+    while idx < len(tokens) and tokens[idx].startswith('-'):
+        name, has_value, value = tokens[idx].partition('=')
+        if name in ('--verbose', '-v', '--version', '--help', '-h', '--supervise'): # spark-submit options without a value.
+            options.append((name, None))
+            idx += 1
+            continue
+        if not has_value:
+            value = tokens[idx+1] if idx+1 < len(tokens) else None
+            idx += 1
+        idx += 1
+        options.append((name, value))
+    return options
+
+
+def _deploy_mode(command):
+    '''Returns the deploy mode of a spark-submit command ("client" or "cluster"). Like spark-submit, we default to client mode.'''
+    if isinstance(command, SubmitCommandBuilder):
+        return command.deploymode
+    found = [value for name, value in _submit_options(command) if name == '--deploy-mode' and value in ('client', 'cluster')]
+    return found[-1] if any(found) else 'client'
+
+
+def _transfer_targets(reservation, master_picked, command, targets):
+    '''Picks the nodes that need the application data. The master always needs it, as we run spark-submit there.
+    Args:
+        command (str or SubmitCommandBuilder): spark-submit command. With "auto" targets, its deploy mode decides which nodes need the data.
+    Raises:
+        ValueError: When `targets` is not a known value, or contains unknown node ids.
+
+    Returns:
+        `list` of nodes, starting with the master.'''
+    if targets == 'auto':
+        targets = 'all' if _deploy_mode(command) == 'cluster' else 'master'
+    if targets == 'all':
+        return [master_picked] + [x for x in reservation.nodes if x != master_picked]
+    if targets == 'master':
+        return [master_picked]
+    if isinstance(targets, str):
+        raise ValueError('Only know of "auto", "all" and "master" transfer targets, or a list of node ids. Found: "{}"'.format(targets))
+    nodes = [reservation.get_node(node_id=x) for x in targets]
+    if any(x == None for x in nodes):
+        raise ValueError('Transfer targets contain unknown node ids: {}'.format(targets))
+    return [master_picked] + [x for x in nodes if x != master_picked]
+
+
 def clean(reservation, key_path, paths, admin_id=None, connectionwrapper=None, silent=False):
     '''Cleans data from the RADOS-Ceph cluster, on an existing reservation.
     Args:
@@ -95,7 +220,7 @@ def clean(reservation, key_path, paths, admin_id=None, connectionwrapper=None, s
         connectionwrapper = get_wrapper(admin_picked, admin_picked.ip_public, ssh_params=ssh_kwargs, silent=silent)
 
     if any(paths):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count()-1) as executor:
+        with engine.executor(len(paths)) as executor:
             if not silent:
                 print('Exporting data...')
             rm_futures = [executor.submit(remoto.process.check, connectionwrapper.connection, 'sudo rm -rf {}'.format(fs.join(mountpoint_path, path)), shell=True) for path in paths]
@@ -107,7 +232,7 @@ def clean(reservation, key_path, paths, admin_id=None, connectionwrapper=None, s
         state_ok = exitcode == 0
     else:
         paths = [x if x[0] != '/' else x[1:] for x in paths]
-        with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count()-1) as executor:
+        with engine.executor(len(paths)) as executor:
             if not silent:
                 print('Deleting data...')
             rm_futures = [executor.submit(remoto.process.check, connectionwrapper.connection, 'sudo rm -rf {}'.format(fs.join(mountpoint_path, path)), shell=True) for path in paths]
@@ -125,27 +250,53 @@ def clean(reservation, key_path, paths, admin_id=None, connectionwrapper=None, s
 
 
 
-def submit(reservation, command, paths=[], install_dir=install_defaults.install_dir(), key_path=None, connectionwrappers=None, application_dir=defaults.application_dir(), master_id=None, use_sudo=False, silent=False):
+def submit(reservation, command, paths=[], install_dir=install_defaults.install_dir(), key_path=None, connectionwrappers=None, application_dir=defaults.application_dir(), master_id=None, use_sudo=False, multiplex=False, transfer_mode='direct', app_cache=False, app_cache_size=defaults.app_cache_size(), targets='auto', hdfs_dir=None, stream=False, output=None, detach=False, silent=False):
     '''Submit applications using spark-submit on the remote Spark cluster, on an existing reservation.
     Args:
         reservation (`metareserve.Reservation`): Reservation object with all nodes to we run Spark on. 
                                                  Important if we deploy in cluster mode, as every node could be chosen to boot the JAR on, meaning every node must have the JAR.
                                                  In client mode, you can just provide only the master node.
-        command (str): Command to propagate to remote "spark-submit" executable.
+        command (str or SubmitCommandBuilder): Command to propagate to remote "spark-submit" executable.
         paths (optional list(str)): Data paths to offload to the remote cluster. Can be relative to CWD or absolute.
         install_dir (str): Location on remote host where Spark (and any local-installed Java) is installed in.
         key_path (str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
-        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
         application_dir (optional str): Location on remote host where we export all given 'paths' to.
                                         Illegal values: 1. ''. 2. '~/'. The reason is that we use rsync for fast file transfer, which messes up homedir permissions if set as destination target.
         master_id (optional int): Node id of the Spark master. If `None`, the node with lowest public ip value (string comparison) will be picked.
         use_sudo (optional bool): If set, uses sudo when deploying.
+        multiplex (optional bool): If set, new connections use OpenSSH multiplexing, so all rsync transfers to a node share 1 ssh connection. Ignored when `connectionwrappers` is set.
+        transfer_mode (optional str): How we get `paths` on all nodes. "direct" sends all paths to every node with 1 rsync process per node.
+                                      "relay" sends all paths (packed in 1 archive) to the master only, which relays them to the workers over the cluster-internal network. Use this when the controller uplink is slow, or when there are many nodes.
+        app_cache (optional bool): If set, nodes keep application data in a content-addressed store, and we only transfer files a node does not have yet.
+                                   Unchanged `paths` then cost 1 manifest exchange per node. Files in `application_dir` are hardlinks to the store, so applications must not modify them in place.
+                                   Cannot be combined with "relay" `transfer_mode`.
+        app_cache_size (optional int): Maximal number of bytes of unused application data every node keeps in its store when using `app_cache`.
+        targets (optional str or list(int)): Nodes receiving `paths`. The master always receives them.
+                                             "auto" picks by deploy mode of `command`: In client mode (the spark-submit default), only the master runs the driver, and Spark ships JARs to executors itself, so only the master receives `paths`. In cluster mode, all nodes receive them.
+                                             "all" and "master" pick all nodes and the master only, respectively. A list of node ids picks these nodes (and the master).
+                                             Note: Use "all" when executors read `paths` from the local filesystem.
+                                             Tip: To stage data once on a filesystem shared by all nodes (e.g. NFS), set `application_dir` to a shared location, and use "master".
+        stream (optional bool): If set, forwards spark-submit output while it arrives, instead of only printing it after a failure. The remote buffers a bounded number of lines.
+        output (optional str or callable): Destination of streamed output. If `None`, we print lines. If `str`, we append lines to the local file at that path. If callable, we call `output(stream, line)` for every line, with `stream` being "stdout" or "stderr".
+        detach (optional bool): If set, launches spark-submit detached from the connection, and returns right away. Output goes to a log file on the master.
+                                Use the returned `JobHandle` to poll, wait for, tail, or kill the application. Cannot be combined with `stream`.
+        hdfs_dir (optional str): If set, the master uploads `paths` to this HDFS location (e.g. "hdfs://namenode:9000/apps") using the `hdfs` command, and only the master receives `paths`. Refer to the HDFS location in `command`.
         silent (optional bool): If set, we only print errors and critical info. Otherwise, more verbose output.
 
     Returns:
-        `True` on success, `False` otherwise.'''
+        `True` on success, `False` otherwise. If `stream` is set, the exitcode of spark-submit instead (0 on success).
+        If `detach` is set, a `JobHandle` on success, `None` otherwise.'''
     if not reservation or len(reservation) == 0:
         raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+    builder = command if isinstance(command, SubmitCommandBuilder) else None
+    command = builder.build() if builder else command
+    if transfer_mode != 'direct' and transfer_mode != 'relay':
+        raise ValueError('Only know of "direct" and "relay" transfer modes. Found: "{}"'.format(transfer_mode))
+    if stream and detach:
+        raise ValueError('stream cannot be combined with detach.')
+    if app_cache and transfer_mode == 'relay':
+        raise ValueError('app_cache cannot be combined with "relay" transfer mode.')
 
     if application_dir == '~/' or application_dir == '~' or not application_dir:
         raise ValueError('application_dir must not be equal to "{}". Check the docs.'.format(application_dir))
@@ -155,24 +306,35 @@ def submit(reservation, command, paths=[], install_dir=install_defaults.install_
 
     master_picked, workers_picked = _get_master_and_workers(reservation, master_id)
     print('Picked master node: {}'.format(master_picked))
+    target_nodes = _transfer_targets(reservation, master_picked, builder or command, 'master' if hdfs_dir else targets)
+    if not silent and any(paths):
+        print('Application data goes to {}/{} nodes.'.format(len(target_nodes), len(reservation)))
 
     local_connections = connectionwrappers == None
     if local_connections:
         ssh_kwargs = {'IdentitiesOnly': 'yes', 'User': master_picked.extra_info['user'], 'StrictHostKeyChecking': 'no'}
         if key_path:
             ssh_kwargs['IdentityFile'] = key_path
-        connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=silent)
+        connectionwrappers = get_wrappers(target_nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), multiplex=multiplex, silent=silent)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count()-1) as executor:
-        _, _, exitcode = remoto.process.check(connectionwrappers[master_picked].connection, 'ls {}'.format(fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit')), shell=True)
-        if exitcode != 0:
+    target_wrappers = {x: connectionwrappers[x] for x in target_nodes}
+
+    submit_module = _generate_module_submit()
+    with engine.executor(len(target_nodes)) as executor:
+        # Every target node needs the application directory. The master also checks for spark-submit, in the same round-trip.
+        batches = {x: Batch() for x in target_nodes}
+        check_submit = batches[master_picked].shell('ls {}'.format(fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit')))
+        check_mkdir = {x: batch.shell('mkdir -p {}'.format(application_dir)) for x, batch in batches.items()}
+        futures_batches = {x: executor.submit(batch.run, connectionwrappers[x].connection, submit_module) for x, batch in batches.items()}
+        results = {x: future.result() for x, future in futures_batches.items()}
+        shell_ok = lambda result: result[0] and result[1][0] == 0
+
+        if not shell_ok(results[master_picked][check_submit]):
             if local_connections:
                 close_wrappers(connectionwrappers)
             raise FileNotFoundError('Could not find spark-submit executable on master. Expected at: {}'.format(fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit')))
 
-        mkdir_fun = lambda conn: remoto.process.check(conn, 'mkdir -p {}'.format(application_dir), shell=True)[2] == 0
-        futures_application_mkdir = [executor.submit(mkdir_fun, connectionwrappers[x].connection) for x in reservation.nodes]
-        if not all(x.result() for x in futures_application_mkdir):
+        if not all(shell_ok(results[x][check_mkdir[x]]) for x in batches.keys()):
             printe('Could not make directory "{}" on all nodes.'.format(application_dir))
             if local_connections:
                 close_wrappers(connectionwrappers)
@@ -192,16 +354,29 @@ def submit(reservation, command, paths=[], install_dir=install_defaults.install_
                     close_wrappers(connectionwrappers)
                 return False
 
-            dests = [fs.join(application_dir, fs.basename(path)) for path in paths]
-            rsync_global_net_fun = lambda node, conn_wrapper, path, dest: subprocess.call('rsync -e "ssh -F {}" -azL {} {}:{}'.format(conn_wrapper.ssh_config.name, path, node.ip_public, dest), shell=True) == 0
-            futures_rsync = [executor.submit(rsync_global_net_fun, node, conn_wrapper, path, dest) for (path, dest) in zip(paths, dests) for (node, conn_wrapper) in connectionwrappers.items()]
-
-            if not all(x.result() for x in futures_rsync):
+            if app_cache:
+                state = appcache.sync(target_wrappers, submit_module, paths, loc.appstore(install_dir), application_dir, max_size=app_cache_size, silent=silent)
+            else:
+                state = broadcast(target_wrappers, paths, application_dir, mode=transfer_mode, first=master_picked, silent=silent)
+            if not all(state.values()):
                 printe('Could not deploy data to all remote nodes.')
                 if local_connections:
                     close_wrappers(connectionwrappers)
                 return False
 
+            if hdfs_dir:
+                if not silent:
+                    print('Uploading application data to {}...'.format(hdfs_dir))
+                upload_cmd = 'hdfs dfs -mkdir -p {0} && hdfs dfs -put -f {1} {0}'.format(shlex.quote(hdfs_dir), ' '.join(shlex.quote(fs.basename(x)) for x in paths))
+                batch = Batch()
+                check_upload = batch.shell(upload_cmd, application_dir)
+                result = batch.run(connectionwrappers[master_picked].connection, submit_module)[check_upload]
+                if not shell_ok(result):
+                    printe('Could not upload application data to {}: {}'.format(hdfs_dir, result[1][1].strip() if result[0] else result[1]))
+                    if local_connections:
+                        close_wrappers(connectionwrappers)
+                    return False
+
         if not silent:
             prints('Application data deployed.')
 
@@ -210,8 +385,20 @@ def submit(reservation, command, paths=[], install_dir=install_defaults.install_
     run_cmd = '{} {}'.format(fs.join(loc.sparkdir(install_dir), 'bin', 'spark-submit'), command)
     if use_sudo:
         run_cmd = 'sudo '+run_cmd
-    submit_module = _generate_module_submit()
-    retval = _submit_spark(connectionwrappers[master_picked].connection, submit_module, run_cmd, application_dir, silent=silent)
+    if detach:
+        retval = _launch_detached(connectionwrappers[master_picked].connection, submit_module, master_picked, install_dir, command, run_cmd, application_dir, key_path=key_path, silent=silent)
+    elif stream:
+        sink, close_sink = _output_sink(output, silent=silent)
+        try:
+            retval = _submit_spark_stream(connectionwrappers[master_picked].connection, submit_module, run_cmd, application_dir, sink, silent=silent)
+        finally:
+            close_sink()
+        if retval == 0:
+            prints('Application submission succeeded.')
+        else:
+            printe('Application exited with exitcode {}.'.format(retval))
+    else:
+        retval = _submit_spark(connectionwrappers[master_picked].connection, submit_module, run_cmd, application_dir, silent=silent)
     if local_connections:
         close_wrappers(connectionwrappers)
     return retval
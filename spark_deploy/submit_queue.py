@@ -0,0 +1,398 @@
+'''Queue to run many Spark applications on 1 cluster. All applications share connections and application data transfers.
+We keep a bounded number of applications running, and only launch more when the master reports enough free cores and memory.'''
+
+import math
+import re
+import time
+
+import spark_deploy.internal.defaults.install as install_defaults
+import spark_deploy.internal.defaults.start as start_defaults
+import spark_deploy.internal.defaults.submit as defaults
+import spark_deploy.internal.remoto.appcache as appcache
+from spark_deploy.internal.remoto.batch import Batch
+from spark_deploy.internal.remoto.distribute import broadcast
+import spark_deploy.internal.remoto.modulecache as modulecache
+from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
+import spark_deploy.internal.util.fs as fs
+import spark_deploy.internal.util.location as loc
+from spark_deploy.internal.util.printer import *
+from spark_deploy.submit import _get_master_and_workers, _launch_detached, _merge_kwargs, _submit_options, _transfer_targets, SubmitCommandBuilder
+
+
+def _generate_module_queue(silent=False):
+    '''Generates submit-queue module from available sources.'''
+    files = [
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'util', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'printer.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'env.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_stop.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_start.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'spark_submit.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'app_cache.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'batch.py'),
+        fs.join(fs.dirname(fs.abspath(__file__)), 'internal', 'remoto', 'modules', 'remoto_base.py'),
+    ]
+    return modulecache.get_module('submit_queue', files, modules=[fs], silent=silent)
+
+
+def _jvm_megabytes(string):
+    '''Converts JVM byte size notation (e.g. "4G", "512m") to megabytes.'''
+    found = re.fullmatch(r'([0-9]+)([kbmgt]?)', string.strip(), re.IGNORECASE)
+    if not found:
+        raise ValueError('Given value ("{}") is not in JVM byte size notation.'.format(string))
+    factor = {'b': 1/(1024*1024), 'k': 1/1024, '': 1/(1024*1024), 'm': 1, 'g': 1024, 't': 1024*1024}[found.group(2).lower()]
+    return int(int(found.group(1)) * factor)
+
+
+def _max_cores(command):
+    '''Returns the maximal number of cores a spark-submit command lets its application claim, or `None` if it sets no limit.'''
+    found = None
+    for name, value in _submit_options(command):
+        if name == '--total-executor-cores' and value:
+            found = value
+        elif name == '--conf' and value and value.partition('=')[0] == 'spark.cores.max':
+            found = value.partition('=')[2]
+    return int(found) if found else None
+
+
+def _executor_cores(command):
+    '''Returns the number of cores per executor a spark-submit command sets, or `None` if it sets none.'''
+    found = None
+    for name, value in _submit_options(command):
+        if name == '--executor-cores' and value:
+            found = value
+        elif name == '--conf' and value and value.partition('=')[0] == 'spark.executor.cores':
+            found = value.partition('=')[2]
+    return int(found) if found else None
+
+
+def _executors(command, cores, workers):
+    '''Estimates the number of executors Spark standalone launches for an application.
+    With a number of cores per executor, it launches executors until the application has all its cores.
+    Otherwise, it launches 1 executor per worker, claiming all free cores of that worker.
+    Args:
+        command (str): Arguments to spark-submit.
+        cores (int or None): Number of cores the application claims, or `None` if unknown.
+        workers (int or None): Number of alive workers, or `None` if unknown.'''
+    executor_cores = _executor_cores(command)
+    if executor_cores != None and cores != None:
+        return max(1, math.ceil(cores / executor_cores))
+    if workers == None:
+        return 1
+    return max(1, workers if cores == None else min(workers, cores)) # Every executor claims at least 1 core.
+
+
+def _demand(builder, command, cores, memory, total=None, workers=None):
+    '''Estimates the cores and memory (in megabytes) an application claims from the cluster.
+    Args:
+        builder (SubmitCommandBuilder or None): Builder of the command, if any. We read executor and driver memory from it.
+        command (str): Arguments to spark-submit.
+        cores (int or None): Number of cores, as given to `SubmitQueue.add`.
+        memory (int or str or None): Memory, as given to `SubmitQueue.add`.
+        total (optional tuple(int, int)): `(cores, memory)` of the cluster, if known.
+        workers (optional int): Number of alive workers, if known.
+
+    Returns:
+        `(cores, memory)`. Without a core limit, Spark standalone gives the application all free cores, so we assume it claims all cores of the cluster.
+        `cores` is `None` when the application sets no core limit and we do not know the cluster size.'''
+    if cores == None:
+        cores = _max_cores(command)
+    if cores == None and total != None:
+        cores = total[0]
+    if memory == None:
+        memory = 0
+        if builder:
+            memory = _jvm_megabytes(builder.executor_memory) * _executors(command, cores, workers)
+            if builder.deploymode == 'cluster': # The driver runs on a worker too.
+                memory += _jvm_megabytes(builder.driver_memory)
+    elif isinstance(memory, str):
+        memory = _jvm_megabytes(memory)
+    return cores, memory
+
+
+class SubmitQueue(object):
+    '''Runs many Spark applications on 1 cluster. Example:
+        with SubmitQueue(reservation, key_path='~/.ssh/id_rsa', max_running=8) as queue:
+            for x in range(100):
+                queue.add(builder_for(x), paths=['app.jar'])
+            records = queue.run()
+    All applications share 1 connection per node. We check for spark-submit and create the application directory once, and transfer the union of all `paths` once.
+    Afterwards, we launch applications detached (see `submit`), keeping up to `max_running` running at once.
+    We launch the next application only when the master reports enough free cores and memory for it.'''
+    def __init__(self, reservation, install_dir=install_defaults.install_dir(), key_path=None, connectionwrappers=None, application_dir=defaults.application_dir(), master_id=None, master_host=lambda x: x.ip_local, webui_port=start_defaults.webuiport(), max_running=defaults.queue_max_running(), poll_interval=defaults.queue_poll_interval(), max_poll_failures=defaults.queue_max_poll_failures(), targets='auto', app_cache=False, use_sudo=False, multiplex=False, silent=False):
+        '''Args:
+            reservation (`metareserve.Reservation`): Reservation object with all nodes of the cluster.
+            install_dir (optional str): Location on remote host where Spark (and any local-installed Java) is installed in.
+            key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+            connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
+            application_dir (optional str): Location on remote host where we export all `paths` to. See `submit`.
+            master_id (optional int): Node id of the Spark master. If `None`, the node with lowest public ip value (string comparison) will be picked.
+            master_host (str or function or lambda): IP/Hostname the master listens on. See `start`.
+            webui_port (optional int): port of the Spark webUI. We read free cores and memory from it.
+            max_running (optional int): Maximal number of applications running at the same time.
+            poll_interval (optional float): Maximal number of seconds between checks of running applications.
+            max_poll_failures (optional int): Number of consecutive failed checks after which we consider a running application lost.
+            targets (optional str or list(int)): Nodes receiving `paths`. See `submit`. With "auto", a node receives data when any application needs it there.
+            app_cache (optional bool): If set, uses the content-addressed application cache on nodes. See `submit`.
+            use_sudo (optional bool): If set, uses sudo when running spark-submit.
+            multiplex (optional bool): If set, new connections use OpenSSH multiplexing. Ignored when `connectionwrappers` is set.
+            silent (optional bool): If set, we only print errors and critical info.
+
+        Raises:
+            ValueError: When the reservation is empty, `application_dir` is illegal, or `max_running` or `max_poll_failures` is smaller than 1.'''
+        if not reservation or len(reservation) == 0:
+            raise ValueError('Reservation does not contain any items'+(' (reservation=None)' if not reservation else ''))
+        if application_dir == '~/' or application_dir == '~' or not application_dir:
+            raise ValueError('application_dir must not be equal to "{}". Check the docs.'.format(application_dir))
+        if max_running < 1:
+            raise ValueError('max_running must be at least 1 (found {}).'.format(max_running))
+        if max_poll_failures < 1:
+            raise ValueError('max_poll_failures must be at least 1 (found {}).'.format(max_poll_failures))
+        self.reservation = reservation
+        self.install_dir = install_dir
+        self.key_path = key_path
+        self.application_dir = application_dir[2:] if application_dir.startswith('~/') else application_dir
+        self.master_picked, _ = _get_master_and_workers(reservation, master_id)
+        self.master_host = master_host(self.master_picked) if callable(master_host) else (master_host or self.master_picked.ip_local)
+        self.webui_port = webui_port
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.max_poll_failures = max_poll_failures
+        self.targets = targets
+        self.app_cache = app_cache
+        self.use_sudo = use_sudo
+        self.multiplex = multiplex
+        self.silent = silent
+        self._connectionwrappers = connectionwrappers
+        self._local_connections = connectionwrappers == None
+        self._jobs = []
+        self._paths = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, command, paths=[], name=None, cores=None, memory=None):
+        '''Adds an application to the queue.
+        Args:
+            command (str or SubmitCommandBuilder): Command to propagate to remote "spark-submit" executable.
+            paths (optional list(str)): Data paths the application needs. Paths shared by many applications are transferred only once.
+            name (optional str): Name to recognize the application by in the records. Defaults to the position in the queue.
+            cores (optional int): Number of cores the application claims. If `None`, we read "spark.cores.max" or "--total-executor-cores" from the command.
+                                  Without those, Spark standalone gives the application all free cores, so we assume it claims all cores of the cluster.
+            memory (optional int or str): Megabytes (or JVM byte size notation) the application claims. If `None`, we use the executor (and in cluster mode, driver) memory of a `SubmitCommandBuilder`, and assume 0 otherwise.
+                                          We multiply executor memory by the expected number of executors: cores divided by "spark.executor.cores" or "--executor-cores" when set, 1 per worker otherwise.
+
+        Raises:
+            ValueError: When 2 different paths have the same basename, as they would overwrite each other in the application directory.
+
+        Returns:
+            Record `dict` of the application. We update it while the queue runs (see `run`).'''
+        builder = command if isinstance(command, SubmitCommandBuilder) else None
+        command = builder.build() if builder else command
+        for path in (fs.abspath(x) for x in paths):
+            if self._paths.get(fs.basename(path), path) != path:
+                raise ValueError('Paths "{}" and "{}" have the same basename.'.format(self._paths[fs.basename(path)], path))
+            self._paths[fs.basename(path)] = path
+        if isinstance(memory, str):
+            memory = _jvm_megabytes(memory)
+        demand_cores, demand_memory = _demand(builder, command, cores, memory)
+        record = {'name': name if name != None else str(len(self._jobs)), 'command': command, 'cores': demand_cores, 'memory': demand_memory, 'state': 'pending', 'exitcode': None, 'job_id': None, 'submission_id': None, 'log_path': None, 'queued_at': time.time(), 'started_at': None, 'finished_at': None}
+        self._jobs.append({'record': record, 'handle': None, 'builder': builder, 'paths': [fs.abspath(x) for x in paths], 'cores': cores, 'memory': memory, 'poll_failures': 0})
+        return record
+
+    @property
+    def records(self):
+        '''Records of all applications, in the order they were added.'''
+        return [x['record'] for x in self._jobs]
+
+    def close(self):
+        '''Closes the connections we made. Running applications keep running.'''
+        if self._local_connections and self._connectionwrappers:
+            close_wrappers(self._connectionwrappers)
+            self._connectionwrappers = None
+
+    def _prepare(self, module):
+        '''Connects to all nodes needing application data, checks for spark-submit, creates the application directory, and transfers all paths once.
+        Returns:
+            `True` on success, `False` otherwise.'''
+        target_nodes = [self.master_picked]
+        for job in self._jobs:
+            target_nodes += [x for x in _transfer_targets(self.reservation, self.master_picked, job['builder'] or job['record']['command'], self.targets) if not x in target_nodes]
+        if self._connectionwrappers == None:
+            ssh_kwargs = {'IdentitiesOnly': 'yes', 'StrictHostKeyChecking': 'no'}
+            if self.key_path:
+                ssh_kwargs['IdentityFile'] = self.key_path
+            self._connectionwrappers = get_wrappers(target_nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), multiplex=self.multiplex, silent=self.silent)
+
+        submit_bin = fs.join(loc.sparkdir(self.install_dir), 'bin', 'spark-submit')
+        with engine.executor(len(target_nodes)) as executor:
+            batches = {x: Batch() for x in target_nodes}
+            check_submit = batches[self.master_picked].shell('ls {}'.format(submit_bin))
+            check_mkdir = {x: batch.shell('mkdir -p {}'.format(self.application_dir)) for x, batch in batches.items()}
+            futures_batches = {x: executor.submit(batch.run, self._connectionwrappers[x].connection, module) for x, batch in batches.items()}
+            results = {x: future.result() for x, future in futures_batches.items()}
+        shell_ok = lambda result: result[0] and result[1][0] == 0
+        if not shell_ok(results[self.master_picked][check_submit]):
+            raise FileNotFoundError('Could not find spark-submit executable on master. Expected at: {}'.format(submit_bin))
+        if not all(shell_ok(results[x][check_mkdir[x]]) for x in target_nodes):
+            printe('Could not make directory "{}" on all nodes.'.format(self.application_dir))
+            return False
+
+        paths = list(self._paths.values())
+        if any(paths):
+            missing = [x for x in paths if not (fs.exists(x) or fs.issymlink(x))]
+            if any(missing):
+                printe('Application data transfer found non-existing source paths: {}'.format(', '.join(missing)))
+                return False
+            if not self.silent:
+                print('Transferring application data for {} applications to {} nodes...'.format(len(self._jobs), len(target_nodes)))
+            target_wrappers = {x: self._connectionwrappers[x] for x in target_nodes}
+            if self.app_cache:
+                state = appcache.sync(target_wrappers, module, paths, loc.appstore(self.install_dir), self.application_dir, silent=self.silent)
+            else:
+                state = broadcast(target_wrappers, paths, self.application_dir, first=self.master_picked, silent=self.silent)
+            if not all(state.values()):
+                printe('Could not deploy data to all remote nodes.')
+                return False
+        return True
+
+    def _fail_pending(self):
+        '''Marks all pending applications as failed.'''
+        for job in self._jobs:
+            if job['record']['state'] == 'pending':
+                job['record'].update({'state': 'failed', 'finished_at': time.time()})
+
+    def _lose(self, job, running):
+        '''Marks a running application as lost, and stops checking it.'''
+        job['record'].update({'state': 'lost', 'finished_at': time.time()})
+        running.remove(job)
+
+    def _free_resources(self, remote_module):
+        '''Returns `(cores, memory)` the master reports free, or `(None, None)` when the master is unreachable.'''
+        try:
+            status = remote_module.master_status(self.master_host, self.webui_port)
+        except Exception as e:
+            printw('Could not fetch Spark master status: {}'.format(e))
+            return None, None
+        if status == None:
+            return None, None
+        return status.get('cores', 0) - status.get('coresused', 0), status.get('memory', 0) - status.get('memoryused', 0)
+
+    def _fits(self, record, running, free_cores, free_memory, total):
+        '''Decides whether we can launch an application now.
+        Running applications of this queue may not have registered at the master yet, so we also subtract their demand from the cluster total.'''
+        if not any(running):
+            return True # Always make progress, even when an application claims more than the master reports free.
+        if free_cores == None: # Without master status, only `max_running` bounds us.
+            return True
+        if record['cores'] == None: # Claims all cores of a cluster with unknown size.
+            return False
+        cores = free_cores if total == None else min(free_cores, total[0] - sum(x['record']['cores'] for x in running))
+        memory = free_memory if total == None else min(free_memory, total[1] - sum(x['record']['memory'] for x in running))
+        return record['cores'] <= cores and record['memory'] <= memory
+
+    def run(self):
+        '''Runs all pending applications. Blocks until all of them stopped running.
+        Returns:
+            `list` of records, 1 per application, in the order they were added. Records contain:
+                "name", "command", "cores", "memory": As given to `add`, or estimated from the command and the cluster. Applications without core limit claim all cores of the cluster.
+                "state": "finished", "killed", "lost" (vanished without exitcode, or could not be checked `max_poll_failures` times in a row), or "failed" (could not launch).
+                "exitcode": Exitcode of spark-submit, or `None`.
+                "job_id", "submission_id", "log_path": See `JobHandle`.
+                "queued_at", "started_at", "finished_at": Times (seconds since the epoch).'''
+        module = _generate_module_queue(silent=self.silent)
+        try:
+            prepared = self._prepare(module)
+        except Exception as e:
+            self._fail_pending()
+            raise e
+        if not prepared:
+            self._fail_pending()
+            return self.records
+
+        running = []
+        try:
+            self._run(module, running)
+        except Exception as e:
+            self._fail_pending()
+            for job in list(running):
+                self._lose(job, running)
+            raise e
+        return self.records
+
+    def _run(self, module, running):
+        '''Launches pending applications and checks running ones (kept in `running`) until none are left.'''
+        connection = self._connectionwrappers[self.master_picked].connection
+        remote_module = connection.import_module(module)
+        status = remote_module.master_status(self.master_host, self.webui_port)
+        total = (status.get('cores', 0), status.get('memory', 0)) if status else None
+        workers = len([x for x in status.get('workers', []) if x.get('state') == 'ALIVE']) if status else None
+        if status == None and not self.silent:
+            printw('Could not reach the Spark master on node {}. Only max_running={} limits running applications.'.format(self.master_picked, self.max_running))
+        for job in self._jobs: # Now we know the cluster, we estimate demands of applications without a core limit, and the number of executors.
+            job['record']['cores'], job['record']['memory'] = _demand(job['builder'], job['record']['command'], job['cores'], job['memory'], total, workers)
+        pending = [x for x in self._jobs if x['record']['state'] == 'pending']
+        sleep = 0.5
+        while any(pending) or any(running):
+            if any(running): # We check all running applications in 1 round-trip.
+                batch = Batch()
+                checks = [batch.add('job_poll', x['handle'].job_dir) for x in running]
+                try:
+                    results = batch.run(connection, module)
+                except Exception as e:
+                    printw('Could not check running applications: {}'.format(e))
+                    results = {check: (False, None) for check in checks}
+                for job, check in zip(list(running), checks):
+                    ok, value = results[check]
+                    if not ok:
+                        job['poll_failures'] += 1
+                        if job['poll_failures'] >= self.max_poll_failures:
+                            self._lose(job, running)
+                            printe('Lost application {}: could not check it {} times in a row.'.format(job['record']['name'], job['poll_failures']))
+                        continue
+                    job['poll_failures'] = 0
+                    job['record']['submission_id'] = value['submission_id']
+                    if value['state'] != 'running':
+                        job['record'].update({'state': value['state'], 'exitcode': value['exitcode'], 'finished_at': time.time()})
+                        running.remove(job)
+                        if not self.silent:
+                            (prints if value['exitcode'] == 0 else printw)('Application {} {} (exitcode={}).'.format(job['record']['name'], value['state'], value['exitcode']))
+
+            launched = False
+            free_cores, free_memory = self._free_resources(remote_module) if any(pending) and len(running) < self.max_running else (None, None)
+            while any(pending) and len(running) < self.max_running and self._fits(pending[0]['record'], running, free_cores, free_memory, total):
+                job = pending.pop(0)
+                run_cmd = '{} {}'.format(fs.join(loc.sparkdir(self.install_dir), 'bin', 'spark-submit'), job['record']['command'])
+                if self.use_sudo:
+                    run_cmd = 'sudo '+run_cmd
+                try:
+                    handle = _launch_detached(connection, module, self.master_picked, self.install_dir, job['record']['command'], run_cmd, self.application_dir, key_path=self.key_path, silent=True)
+                except Exception as e:
+                    job['record'].update({'state': 'failed', 'finished_at': time.time()})
+                    printe('Could not launch application {}: {}'.format(job['record']['name'], e))
+                    continue
+                if handle == None:
+                    job['record'].update({'state': 'failed', 'finished_at': time.time()})
+                    printe('Could not launch application {}.'.format(job['record']['name']))
+                    continue
+                job['handle'] = handle
+                job['record'].update({'state': 'running', 'job_id': handle.job_id, 'log_path': handle.log_path, 'started_at': time.time()})
+                running.append(job)
+                launched = True
+                if not self.silent:
+                    print('Launched application {} ({} running, {} pending).'.format(job['record']['name'], len(running), len(pending)))
+
+            if any(pending) or any(running):
+                sleep = 0.5 if launched else min(self.poll_interval, sleep*2)
+                time.sleep(sleep)
+
+    def handles(self):
+        '''Returns the `JobHandle` of every launched application (e.g. to tail its output), keyed by application name.'''
+        return {x['record']['name']: x['handle'] for x in self._jobs if x['handle'] != None}
\ No newline at end of file
@@ -1,9 +1,8 @@
-import concurrent.futures
-
 import remoto.process
 
 import spark_deploy.internal.defaults.install as install_defaults
 from spark_deploy.internal.remoto.ssh_wrapper import get_wrappers, close_wrappers
+import spark_deploy.internal.util.engine as engine
 import spark_deploy.internal.util.location as loc
 from spark_deploy.internal.util.printer import *
 
@@ -16,6 +15,10 @@ def _uninstall_java(connection, install_dir):
     remoto.process.run(connection, ['rm', '-rf', loc.java_nonroot_dir(install_dir)])
 
 
+def _uninstall_manifest(connection, install_dir):
+    remoto.process.run(connection, ['rm', '-f', loc.manifest(install_dir)])
+
+
 def _merge_kwargs(x, y):
     z = x.copy()
     z.update(y)
@@ -28,6 +31,7 @@ def uninstall(reservation, install_dir=install_defaults.install_dir(), key_path=
         reservation (`metareserve.Reservation`): Reservation object with all nodes to remove Spark, Java from.
         install_dir (str): Location on remote host where Spark and dependencies are installed.
         key_path (optional str): Path to SSH key, which we use to connect to nodes. If `None`, we do not authenticate using an IdentityFile.
+        connectionwrappers (optional dict(metareserve.Node, RemotoSSHWrapper)): If set, uses provided connections instead of making new ones (e.g. from a `ConnectionPool`).
 
     Raises:
         Valuerror: When reservation contains 0 nodes or is `None`.
@@ -45,14 +49,15 @@ def uninstall(reservation, install_dir=install_defaults.install_dir(), key_path=
         else:
             printw('Connections have no assigned ssh key. Prepare to fill in your password often.')
         connectionwrappers = get_wrappers(reservation.nodes, lambda node: node.ip_public, ssh_params=lambda node: _merge_kwargs(ssh_kwargs, {'User': node.extra_info['user']}), silent=True)
-    if any(x for x in connectionwrappers if not x):
+    if any(x for x in connectionwrappers.values() if not x):
         printe('Could not connect to some nodes.')
         if local_connections:
             close_wrappers(connectionwrappers)
         return False
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(reservation)) as executor:
-        futures_uninstall = [executor.submit(_uninstall_spark, x.connection, install_dir) for x in connectionwrappers]
-        futures_uninstall+= [executor.submit(_uninstall_java, x.connection, install_dir) for x in connectionwrappers]
+    with engine.executor(3*len(reservation)) as executor:
+        futures_uninstall = [executor.submit(_uninstall_spark, x.connection, install_dir) for x in connectionwrappers.values()]
+        futures_uninstall+= [executor.submit(_uninstall_java, x.connection, install_dir) for x in connectionwrappers.values()]
+        futures_uninstall+= [executor.submit(_uninstall_manifest, x.connection, install_dir) for x in connectionwrappers.values()]
 
         results = [x.result() for x in futures_uninstall]
         if local_connections: